@@ -4,16 +4,31 @@ import os
 from collections import defaultdict
 from operator import itemgetter
 
+from utils.manifest_utils import ClipManifest
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input_file", type=str)
+    parser.add_argument("--input_file", type=str, help="Annotation csv, or a clip manifest to export as txt files.")
     parser.add_argument("--output_dir", type=str, default=None)
+    parser.add_argument("--output_file", type=str, default=None, help="Output path of the clip manifest.")
+    parser.add_argument(
+        "--format",
+        type=str,
+        default="txt",
+        choices=["txt", "manifest"],
+        help="One txt file per video, or a single memory-mapped clip manifest.",
+    )
     args = parser.parse_args()
 
     if args.output_dir is None:
-        args.output_dir = args.input_file.replace(".csv", "")
+        args.output_dir = os.path.splitext(args.input_file)[0]
 
-    os.makedirs(args.output_dir, exist_ok=False)
+    if args.output_file is None:
+        args.output_file = os.path.splitext(args.input_file)[0] + ".clips"
+
+    if not args.input_file.endswith(".csv"):
+        ClipManifest(args.input_file).export_txt(args.output_dir)
+        exit(0)
 
     vid2clips = defaultdict(list)
 
@@ -25,6 +40,14 @@ if __name__ == "__main__":
             vid, s_frame, e_frame = os.path.splitext(line[0])[0].rsplit("_", 2)
             vid2clips[vid].append((s_frame, e_frame))
 
+    if args.format == "manifest":
+        if os.path.exists(args.output_file):
+            raise FileExistsError(args.output_file)
+        ClipManifest.write(args.output_file, vid2clips)
+        exit(0)
+
+    os.makedirs(args.output_dir, exist_ok=False)
+
     for vid, clips in vid2clips.items():
         clips = sorted(clips, key=itemgetter(0))
 
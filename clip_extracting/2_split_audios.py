@@ -1,5 +1,4 @@
-import multiprocessing.dummy  # noqa: I001
-import os
+import os  # noqa: I001
 import logging
 import argparse
 import shlex
@@ -7,8 +6,35 @@ import subprocess
 
 import tqdm
 
+from utils.audio_utils import can_copy_audio, probe_audio
+from utils.pipeline_utils import Pipeline, Stage
+
+
+def extract_astream(video_filename, astream_filename, audio_codec="flac"):
+    """
+    With `audio_codec` auto, AAC audio at 48 kHz stereo is stream-copied into `<vid>.m4a` instead of re-encoded into
+    `<vid>.flac`, 4_remix_to_files.py then cuts the clips from it by stream copy as well.
+    """
+    if audio_codec == "auto" and can_copy_audio(probe_audio(video_filename)):
+        subprocess.run(
+            [
+                "ffmpeg",
+                "-y",
+                "-i",
+                video_filename,
+                "-map",
+                "0:a:0",
+                "-c:a",
+                "copy",
+                "-loglevel",
+                "error",
+                os.path.splitext(astream_filename)[0] + ".m4a",
+            ],
+            check=True,
+        )
+        logging.info(f"Finish process video '{os.path.splitext(os.path.basename(video_filename))[0]}' by stream copy.")
+        return
 
-def extract_astream(video_filename, astream_filename):
     subprocess.run(
         shlex.split(
             "ffmpeg -y -i {} -map 0:a:0 -c:a flac -ar 48000 -ac 2 -sample_fmt s16 -loglevel error {}".format(
@@ -21,7 +47,8 @@ def extract_astream(video_filename, astream_filename):
 
 
 def extract_astream_wrapper(kargs):
-    return extract_astream(*kargs)
+    extract_astream(*kargs)
+    return kargs[0]
 
 
 if __name__ == "__main__":
@@ -29,6 +56,13 @@ if __name__ == "__main__":
     parser.add_argument("--input_dir", type=str)
     parser.add_argument("--output_dir", type=str, default=None)
     parser.add_argument("--num_workers", type=int, default=os.cpu_count() // 4)
+    parser.add_argument(
+        "--audio_codec",
+        type=str,
+        default="auto",
+        choices=["auto", "flac"],
+        help="'auto' stream-copies AAC audio at 48 kHz stereo and only re-encodes other audio to FLAC.",
+    )
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.INFO)
@@ -43,9 +77,17 @@ if __name__ == "__main__":
 
     kargs = []
     for vid in vids:
-        kargs.append((os.path.join(args.input_dir, f"{vid}.mkv"), os.path.join(args.output_dir, f"{vid}.flac")))
+        kargs.append(
+            (
+                os.path.join(args.input_dir, f"{vid}.mkv"),
+                os.path.join(args.output_dir, f"{vid}.flac"),
+                args.audio_codec,
+            )
+        )
 
-    with multiprocessing.dummy.Pool(processes=args.num_workers) as pool:
-        results = pool.imap_unordered(extract_astream_wrapper, kargs)
-        for _ in tqdm.tqdm(results, total=len(kargs), mininterval=10):
-            pass
+    # A single stage of threads, the work itself runs in ffmpeg processes.
+    with tqdm.tqdm(total=len(kargs), mininterval=10) as progress:
+        stats = Pipeline([Stage("audio", extract_astream_wrapper, args.num_workers)]).run(
+            kargs, on_result=lambda _: progress.update()
+        )
+    Pipeline.report(stats)
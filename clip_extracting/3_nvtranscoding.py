@@ -1,8 +1,11 @@
 # NOTE: One must import PyCuda driver first, before CVCUDA or VPF otherwise things may throw unexpected errors.
 import gc
+import json
 import logging
 import os
 import argparse
+import resource
+import time
 
 import pycuda.driver as cuda  # noqa: F401
 import cvcuda
@@ -10,45 +13,86 @@ import cvcuda
 # import tqdm
 import torch
 
+from utils.audio_utils import find_astream
+from utils.fanout_utils import ClipFanout, plan_fanout_passes
+from utils.journal_utils import Journal, atomic_write, reached
+from utils.manifest_utils import open_clip_index
+from utils.mux_utils import MOVFLAGS, mux_clip
+from utils.pipeline_utils import Pipeline, Stage
+from utils.shard_utils import ShardWriter, clip_key, parse_clip_key
+from utils.sink_utils import FileSink
+from utils.write_behind import WriteBehind
+from utils.plan_utils import CostModel, plan_videos
 from utils.nvvpf_utils import (
     VideoBatchDecoder,
     VideoMemoryEncoder,
 )
 
 
-def process_one_video(video_filename, vstream_filename_format, clips):
+def process_one_video(
+    video_filename,
+    vstream_filename_format,
+    clips,
+    vid=None,
+    seek=None,
+    mp4_layout=None,
+    astream_filename=None,
+    sink=None,
+    writer=None,
+    max_sessions=1,
+):
+    """
+    With `mp4_layout`, clips are muxed straight into MP4 files (with audio cut from `astream_filename` if given)
+    instead of written as raw HEVC streams, and recorded as muxed. With a ShardWriter as `sink`, the MP4 files are
+    moved into its shards, and recorded once their shard is finalized.
+    With a WriteBehind `writer`, finished clips are written by its pool while decoding goes on, call
+    `writer.flush()` before relying on them.
+    Each decode pass feeds up to `max_sessions` overlapping clips at once, more overlapping clips take extra passes.
+    """
     files = []
     if len(clips) == 0:
         return files
 
-    decoder.initialize(video_filename)
-
-    clip_idx, s, e = 0, clips[0][0], clips[0][1]
-    with cvcuda_stream, torch.cuda.stream(torch_stream):
-        for frame_idx, frames in enumerate(decoder):
-            if frame_idx == s:
-                encoder.initialize()
-                encoder(frames)
-            elif s < frame_idx < e - 1:
-                encoder(frames)
-            elif frame_idx == e - 1:
-                encoder(frames)
-                file = encoder.finish()
-
-                with open(
-                    os.path.join(vstream_filename_format.format(s, e)), "wb"
-                ) as f:
-                    f.write(file)
-                del file
-                files.append(vstream_filename_format.format(s, e))
-
-                clip_idx += 1
-                if clip_idx == len(clips):
-                    break
-                s, e = clips[clip_idx]
-    assert clip_idx == len(clips) == len(files)
-
-    decoder.finish()
+    def store(s, e, file):
+        filename = vstream_filename_format.format(s, e)
+        if mp4_layout is None:
+            if writer is not None:
+                atomic_write(filename, file)
+        else:
+            mux_clip(filename, file, decoder.fps, astream_filename, s, e, mp4_layout)
+        if sink is not None:
+            sink.write(clip_key(vid, (s, e)), {"mp4": filename})
+            os.remove(filename)
+        elif journal is not None:
+            journal.set_clip_state(vid, (s, e), "transcoded" if mp4_layout is None else "muxed")
+
+    def open_clip(clip):
+        # Raw HEVC streams go straight to disk unless written behind, the rest uses in-memory buffers.
+        if mp4_layout is None and writer is None:
+            return encoder.open(FileSink(vstream_filename_format.format(*clip)))
+        return encoder.open()
+
+    def finish_clip(clip, stream):
+        file = stream.finish()
+        if writer is not None:
+            # The encoder reuses its buffers for later clips, so hand a copy over to the pool.
+            writer.submit(store, *clip, bytes(file))
+        else:
+            store(*clip, file)
+        del file
+        files.append(vstream_filename_format.format(*clip))
+
+    passes = plan_fanout_passes(clips, max_sessions)
+    for pass_clips in passes:
+        decoder.initialize(video_filename, pass_clips, seek=seek)
+        fanout = ClipFanout(pass_clips, open_clip, finish_clip, encoder.prepare, max_sessions)
+        with cvcuda_stream, torch.cuda.stream(torch_stream):
+            fanout.run(decoder)
+        decoder.finish()
+    if len(passes) > 1:
+        logging.info(f"Decoded {len(passes)} passes for overlapping clips.")
+    assert len(files) == sum(len(pass_clips) for pass_clips in passes)
+
     gc.collect()
     # torch.cuda.empty_cache()
     # nvcv.clear_cache()
@@ -57,7 +101,7 @@ def process_one_video(video_filename, vstream_filename_format, clips):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input_clip_dir", type=str)
+    parser.add_argument("--input_clip_dir", type=str, help="Dir of per-video clip txt files, or a clip manifest.")
     parser.add_argument("--input_video_dir", type=str)
     parser.add_argument("--output_dir", type=str)
     parser.add_argument(
@@ -79,14 +123,113 @@ if __name__ == "__main__":
         default=0,
         help="Specify the GPU ID if you have multiple GPUs.",
     )
+    parser.add_argument(
+        "--seek",
+        action="store_true",
+        help="Only decode from the keyframe preceding each clip, skipping the gaps between clips.",
+    )
+    parser.add_argument(
+        "--pixel_format",
+        type=str,
+        default="rgb",
+        choices=["rgb", "nv12"],
+        help="Resize in RGB, or resize the NV12 planes directly and skip both colour conversions.",
+    )
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        default="hevc",
+        choices=["hevc", "mp4"],
+        help="Write raw HEVC streams for 4_remix_to_files.py, or final MP4 clips directly.",
+    )
+    parser.add_argument(
+        "--mp4_layout",
+        type=str,
+        default="faststart",
+        choices=list(MOVFLAGS),
+        help="Moov-first layout of MP4 clips, 'fragmented' writes every clip in a single pass.",
+    )
+    parser.add_argument(
+        "--input_astream_dir",
+        type=str,
+        default=None,
+        help="Dir of audio streams from 2_split_audios.py to mux into MP4 clips, mute clips if not given.",
+    )
+    parser.add_argument(
+        "--output_sink",
+        type=str,
+        default="files",
+        choices=["files", "shards"],
+        help="Write one file per clip under '<output_dir>/<vid>', or pack MP4 clips into tar shards in output_dir.",
+    )
+    parser.add_argument("--shard_size_mb", type=int, default=1024, help="Rotate a shard once it exceeds this size.")
+    parser.add_argument(
+        "--num_shards",
+        type=int,
+        default=1,
+        help="Split videos across GPUs/nodes by estimated cost, longest first. Run once per --shard_id.",
+    )
+    parser.add_argument("--shard_id", type=int, default=0)
+    parser.add_argument("--prior_report", type=str, default=None, help="Prior run report to refine the cost model.")
+    parser.add_argument("--report_file", type=str, default=None, help="Append per-video processing time to it.")
+    parser.add_argument(
+        "--journal",
+        type=str,
+        default=None,
+        help="SQLite journal of finished videos and clips, defaults to 'journal.sqlite' in the output dir.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted run, skipping the clips already finished according to the journal.",
+    )
+    parser.add_argument(
+        "--write_workers",
+        type=int,
+        default=0,
+        help="Write finished clips in a pool of this many threads while decoding goes on, 0 to write inline.",
+    )
+    parser.add_argument("--write_queue", type=int, default=8, help="Max clips queued for writing before decoding waits.")
+    parser.add_argument(
+        "--max_sessions",
+        type=int,
+        default=1,
+        help="Encode up to this many overlapping clips from one decode pass, within the NVENC session limit of the GPU.",
+    )
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.INFO)
 
+    if args.output_sink == "shards" and args.output_format != "mp4":
+        parser.error("--output_sink shards requires --output_format mp4.")
+
     if args.output_dir is None:
         args.output_dir = args.input_clip_dir + "_vstreams"
 
-    os.makedirs(args.output_dir, exist_ok=False)
+    if args.journal is None:
+        args.journal = os.path.join(args.output_dir, "journal.sqlite")
+
+    # MP4 clips need no remix step, so they are finished once muxed.
+    done_state = "transcoded" if args.output_format == "hevc" else "muxed"
+    mp4_layout = args.mp4_layout if args.output_format == "mp4" else None
+
+    os.makedirs(args.output_dir, exist_ok=args.resume)
+    journal = Journal(args.journal)
+
+    sink = None
+    if args.output_sink == "shards":
+
+        def finalize_shard(shard_filename, keys):
+            for key in keys:
+                journal.set_clip_state(*parse_clip_key(key), "muxed")
+            logging.info(f"Finalize shard '{shard_filename}' with {len(keys)} clips.")
+
+        # Shard filenames are prefixed with the shard id, so the processes of a multi-GPU run share output_dir.
+        sink = ShardWriter(
+            args.output_dir, args.shard_size_mb << 20, on_finalize=finalize_shard, prefix=f"{args.shard_id:03d}-"
+        )
+
+    writer = WriteBehind(args.write_workers, args.write_queue) if args.write_workers > 0 else None
 
     logging.info(f"Using CUDA device: {args.device_id}.")
 
@@ -104,6 +247,8 @@ if __name__ == "__main__":
         args.device_id,
         cuda_ctx,
         cvcuda_stream,
+        seek=args.seek,
+        pixel_format=args.pixel_format,
     )
     assert decoder.fps == 30
 
@@ -115,25 +260,110 @@ if __name__ == "__main__":
         args.device_id,
         cuda_ctx,
         cvcuda_stream,
+        pixel_format=args.pixel_format,
+        max_sessions=args.max_sessions,
     )
 
-    vids = sorted([os.path.splitext(vid)[0] for vid in os.listdir(args.input_clip_dir)])
+    clip_index = open_clip_index(args.input_clip_dir)
+    vids = clip_index.vids()
+    if args.num_shards > 1:
+        model = CostModel()
+        if args.prior_report is not None:
+            model.refine(args.prior_report, clip_index)
+        vids = plan_videos({vid: clip_index[vid] for vid in vids}, model, args.num_shards, args.shard_id)
     logging.info(f"Total {len(vids)} file(s) to process.")
 
-    for idx, vid in enumerate(vids, start=1):
-        with open(os.path.join(args.input_clip_dir, f"{vid}.txt"), "r") as f:
-            clips = [tuple(map(int, line.strip().split(" "))) for line in f]
+    def prepare(item):
+        """
+        Pipeline stage picking the pending clips of a video, ahead of the GPU stage.
+        """
+        idx, vid = item
+        clips = clip_index[vid]
+
+        if args.resume:
+            if reached(journal.video_state(vid), done_state):
+                logging.info(f"[{idx}/{len(vids)}] Skip finished '{vid}'.")
+                return None
+            pending = journal.pending_clips(vid, clips, done_state)
+        else:
+            pending = clips
+
+        os.makedirs(os.path.join(args.output_dir, vid), exist_ok=args.resume)
 
+        astream_filename = None
+        if mp4_layout is not None and args.input_astream_dir is not None:
+            astream_filename = find_astream(args.input_astream_dir, vid)
+        return {"idx": idx, "vid": vid, "clips": clips, "pending": pending, "astream": astream_filename}
+
+    def transcode(item):
+        """
+        Pipeline stage decoding and encoding all pending clips of a video on the GPU.
+        """
+        idx, vid, pending = item["idx"], item["vid"], item["pending"]
         logging.info(f"[{idx}/{len(vids)}] Start processing '{vid}'.")
+        start_time = time.time()
 
-        os.makedirs(os.path.join(args.output_dir, vid), exist_ok=False)
+        # Only set by a decode, a video with no pending clips must not carry the flag of the previous one.
+        decoder.passthrough = False
+        cuda_ctx.push()
+        try:
+            files = process_one_video(
+                os.path.join(args.input_video_dir, f"{vid}.mp4"),
+                os.path.join(args.output_dir, vid, f"{vid}_{{:07d}}_{{:07d}}.{args.output_format}"),
+                pending,
+                vid,
+                # Decode a partially finished video only from its first missing clip.
+                seek=True if len(pending) < len(item["clips"]) else None,
+                mp4_layout=mp4_layout,
+                astream_filename=item["astream"],
+                sink=sink,
+                writer=writer,
+                max_sessions=args.max_sessions,
+            )
+            if writer is not None:
+                writer.flush()
+                logging.info(f"Write-behind stats: {writer.stats()}.")
+        finally:
+            cuda_ctx.pop()
+        if sink is not None:
+            # Clips are recorded once their shard is finalized, resume then relies on the clip states.
+            os.rmdir(os.path.join(args.output_dir, vid))
+        else:
+            journal.set_video_state(vid, done_state)
 
-        files = process_one_video(
-            os.path.join(args.input_video_dir, f"{vid}.mp4"),
-            os.path.join(args.output_dir, vid, f"{vid}_{{:07d}}_{{:07d}}.hevc"),
-            clips,
+        seconds = time.time() - start_time
+        num_frames = sum(e - s for s, e in pending)
+        ms_per_frame = seconds / num_frames * 1000 if num_frames > 0 else 0.0
+        logging.info(
+            f"Finish process {len(files)} clips of '{vid}', {ms_per_frame:.2f}ms per frame"
+            f"{' (passthrough)' if decoder.passthrough else ''}."
         )
+        return {
+            "vid": vid,
+            "seconds": seconds,
+            "frames": num_frames,
+            "ms_per_frame": ms_per_frame,
+            "passthrough": decoder.passthrough if num_frames > 0 else None,
+        }
+
+    def record(report):
+        if args.report_file is not None:
+            with open(args.report_file, "a") as f:
+                # Peak RSS of the process so far, ru_maxrss is in KiB on Linux.
+                report["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+                f.write(json.dumps(report) + "\n")
 
-        logging.info(f"Finish process {len(files)} clips of '{vid}'.")
+    # Every stage keeps a single video in flight: one GPU session, and the next video prepared meanwhile.
+    stats = Pipeline(
+        [Stage("prepare", prepare, 1, queue_size=1), Stage("transcode", transcode, 1, queue_size=1)]
+    ).run(enumerate(vids, start=1), on_result=record)
+    Pipeline.report(stats)
 
+    logging.info(f"Encoder sessions: {encoder.pool.stats()}.")
+    encoder.close()
+    if writer is not None:
+        writer.close()
+    if sink is not None:
+        sink.close()
+    journal.close()
     cuda_ctx.pop()
@@ -1,77 +1,270 @@
-import multiprocessing.dummy  # noqa: I001
+import functools  # noqa: I001
 import os
 import shutil
 import argparse
 import logging
 import shlex
 import subprocess
+import threading
 
-import tqdm
+from utils.audio_utils import copy_clip_audios, find_astream, split_clip_audios
+from utils.ffmpeg_utils import count_video_frames
+from utils.journal_utils import Journal, reached
+from utils.manifest_utils import open_clip_index
+from utils.shard_utils import ShardWriter, clip_key, parse_clip_key
+from utils.task_pool import TaskPool
 
 
-def process_one_video(args, vid, clips, ignore_audio=False):
-    os.makedirs(os.path.join(args.output_dir, vid), exist_ok=False)
-    os.makedirs(os.path.join(args.output_dir, vid, "temp"), exist_ok=False)
+class RemixVideo:
+    """
+    Remix of the clips of one video, split into `setup`, one `process_clip` per clip and `finish`, so that the clips
+    can be spread over a TaskPool. `finish` runs once after the last clip, whichever thread processed it.
+    With a ShardWriter as `sink`, every clip and its sidecars go into the shards instead of `<output_dir>/<vid>`.
+    The journal then records a clip only once its shard is finalized, see `finalize_shard`.
+    """
 
-    if not ignore_audio:
-        raw_astream_filename = os.path.join(args.input_astream_dir, f"{vid}.flac")
+    def __init__(self, args, vid, clips, ignore_audio=False, sink=None):
+        self.args = args
+        self.vid = vid
+        self.clips = clips
+        self.ignore_audio = ignore_audio
+        self.sink = sink
 
-    vstream_filename = os.path.join(args.input_vstream_dir, vid, f"{vid}_{{:07d}}_{{:07d}}.hevc")
-    astream_filename = os.path.join(args.output_dir, vid, "temp", f"{vid}_{{:07d}}_{{:07d}}.m4a")
-    clip_filename = os.path.join(args.output_dir, vid, f"{vid}_{{:07d}}_{{:07d}}.mp4")
+        self.lock = threading.Lock()
+        self.journal = None
+        self.remuxers = {}
+        self.files = []
+        self.n_audio_invocations = 0
+
+        self.vstream_filename = os.path.join(args.input_vstream_dir, vid, f"{vid}_{{:07d}}_{{:07d}}.hevc")
+        self.astream_filename = os.path.join(args.output_dir, vid, "temp", f"{vid}_{{:07d}}_{{:07d}}.m4a")
+        self.clip_filename = os.path.join(args.output_dir, vid, f"{vid}_{{:07d}}_{{:07d}}.mp4")
+        # Mux into a temporary file first, so an interrupted run never leaves a truncated clip behind.
+        self.temp_clip_filename = os.path.join(args.output_dir, vid, "temp", f"{vid}_{{:07d}}_{{:07d}}.mp4")
+
+    def setup(self):
+        """
+        Skip finished clips, create the output dirs and cut the audio of the remaining clips.
+        :return: The clips left to process.
+        """
+        args = self.args
+        self.journal = Journal(args.journal)
+        self.state = "validated" if args.validate else "muxed"
+        if args.resume:
+            if reached(self.journal.video_state(self.vid), self.state):
+                self.journal.close()
+                return []
+            self.clips = self.journal.pending_clips(self.vid, self.clips, self.state)
+        self.remaining = len(self.clips)
+
+        os.makedirs(os.path.join(args.output_dir, self.vid), exist_ok=args.resume)
+        os.makedirs(os.path.join(args.output_dir, self.vid, "temp"), exist_ok=args.resume)
+
+        self.copy_audio = False
+        if not self.ignore_audio:
+            self.raw_astream_filename = find_astream(args.input_astream_dir, self.vid)
+            # AAC streams written by 2_split_audios.py are cut by stream copy, FLAC streams are re-encoded.
+            self.copy_audio = self.raw_astream_filename.endswith(".m4a")
+
+        if self.ignore_audio or (args.remuxer == "pyav" and self.copy_audio and not args.audio_sidecar):
+            # An AAC source stays open in the remuxers, which copy the audio of each clip from it.
+            pass
+        elif self.copy_audio:
+            self.n_audio_invocations += copy_clip_audios(self.raw_astream_filename, self.clips, self.astream_filename)
+        elif args.audio_mode == "per_video":
+            self.n_audio_invocations += split_clip_audios(self.raw_astream_filename, self.clips, self.astream_filename)
+
+        if self.remaining == 0:
+            self.finish()
+        return self.clips
+
+    def remuxer(self):
+        """
+        PyAV remuxer of the calling thread, each keeps its own handle of the AAC source.
+        """
+        from utils.remux_utils import ClipRemuxer
+
+        with self.lock:
+            thread_id = threading.get_ident()
+            if thread_id not in self.remuxers:
+                self.remuxers[thread_id] = ClipRemuxer(self.raw_astream_filename if self.copy_audio else None)
+            return self.remuxers[thread_id]
+
+    def process_clip(self, sframe, eframe):
+        args, vid, ignore_audio, copy_audio = self.args, self.vid, self.ignore_audio, self.copy_audio
 
-    files = []
-    for sframe, eframe in clips:
         stime, etime = round(sframe / 30.0, 6), round(eframe / 30.0, 6)
-        _vstream_filename = vstream_filename.format(sframe, eframe)
-        _astream_filename = astream_filename.format(sframe, eframe)
-        _clip_filename = clip_filename.format(sframe, eframe)
+        _vstream_filename = self.vstream_filename.format(sframe, eframe)
+        _astream_filename = self.astream_filename.format(sframe, eframe)
+        _clip_filename = self.clip_filename.format(sframe, eframe)
+        _temp_clip_filename = self.temp_clip_filename.format(sframe, eframe)
 
-        if not ignore_audio:
+        if not ignore_audio and not copy_audio and args.audio_mode == "per_clip":
             subprocess.run(
                 shlex.split(
-                    "ffmpeg -i {} -ss {} -to {} -c:a aac -ar 48000 -ac 2 -b:a 192k -loglevel error {}".format(
-                        raw_astream_filename, stime, etime, _astream_filename
+                    "ffmpeg -i {} -ss {} -to {} -c:a aac -ar 48000 -ac 2 -b:a 192k -loglevel error -y {}".format(
+                        self.raw_astream_filename, stime, etime, _astream_filename
                     )
                 ),
                 check=True,
             )
+            with self.lock:
+                self.n_audio_invocations += 1
+
+        if args.remuxer == "pyav":
+            self.remuxer().remux(
+                _vstream_filename,
+                _temp_clip_filename,
+                sframe,
+                eframe,
+                None if ignore_audio or copy_audio else _astream_filename,
+            )
+        elif not ignore_audio:
             subprocess.run(
                 shlex.split(
                     "ffmpeg -i {} -i {} -map 0:v -map 1:a -c copy -t 60 -movflags +faststart -vtag hvc1 "
-                    "-loglevel error {}".format(_vstream_filename, _astream_filename, _clip_filename),
+                    "-loglevel error -y {}".format(_vstream_filename, _astream_filename, _temp_clip_filename),
                 ),
                 check=True,
             )
         else:
             subprocess.run(
                 shlex.split(
-                    "ffmpeg -i {} -map 0:v -c copy -t 60 -movflags +faststart -vtag hvc1 -loglevel error {}".format(
-                        _vstream_filename, _clip_filename
+                    "ffmpeg -i {} -map 0:v -c copy -t 60 -movflags +faststart -vtag hvc1 -loglevel error -y {}".format(
+                        _vstream_filename, _temp_clip_filename
                     ),
                 ),
                 check=True,
             )
 
-        files.append(os.path.basename(_clip_filename))
+        if args.validate:
+            n_frames = count_video_frames(_temp_clip_filename)
+            if n_frames != min(eframe - sframe, 60 * 30):
+                raise RuntimeError(f"'{_clip_filename}' has {n_frames} frames, {eframe - sframe} expected.")
 
-    shutil.rmtree(os.path.join(args.output_dir, vid, "temp"))
-    logging.info(f"Finish process video '{vid}', generate {len(files)} video clips.")
+        if self.sink is not None:
+            key = clip_key(vid, (sframe, eframe))
+            members = {"mp4": _temp_clip_filename}
+            if args.audio_sidecar and not ignore_audio:
+                members["m4a"] = _astream_filename
+            for ext, sidecar_dir in args.sidecar:
+                sidecar_filename = os.path.join(sidecar_dir, vid, f"{key}.{ext}")
+                if os.path.exists(sidecar_filename):
+                    members[ext] = sidecar_filename
+            self.sink.write(key, members)
+            os.remove(_temp_clip_filename)
+            file = key
+        else:
+            os.replace(_temp_clip_filename, _clip_filename)
+            self.journal.set_clip_state(vid, (sframe, eframe), "muxed")
+            if args.validate:
+                self.journal.set_clip_state(vid, (sframe, eframe), "validated")
+            file = os.path.basename(_clip_filename)
+
+        with self.lock:
+            self.files.append(file)
+            self.remaining -= 1
+            last = self.remaining == 0
+        if last:
+            self.finish()
+
+    def finish(self):
+        for remuxer in self.remuxers.values():
+            remuxer.close()
+        shutil.rmtree(os.path.join(self.args.output_dir, self.vid, "temp"))
+        if self.sink is not None:
+            os.rmdir(os.path.join(self.args.output_dir, self.vid))
+        else:
+            self.journal.set_video_state(self.vid, self.state)
+        self.journal.close()
+        logging.info(f"Finish process video '{self.vid}', generate {len(self.files)} video clips.")
+
+    def video_task(self):
+        """
+        TaskPool task processing the whole video in one go.
+        """
+        for clip in self.setup():
+            self.process_clip(*clip)
+
+    def clip_tasks(self):
+        """
+        TaskPool task running the setup, and returning one follow-up task per remaining clip.
+        """
+        return [functools.partial(self.process_clip, *clip) for clip in self.setup()]
 
 
-def process_one_video_wrapper(kargs):
-    result = process_one_video(*kargs)
-    return result
+def finalize_shard(args, shard_filename, keys):
+    state = "validated" if args.validate else "muxed"
+    journal = Journal(args.journal)
+    for key in keys:
+        vid, clip = parse_clip_key(key)
+        journal.set_clip_state(vid, clip, state)
+    journal.close()
+    logging.info(f"Finalize shard '{shard_filename}' with {len(keys)} clips.")
+
+
+def parse_sidecar(value):
+    ext, sidecar_dir = value.split("=", 1)
+    return ext, sidecar_dir
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input_clip_dir", type=str)
+    parser.add_argument("--input_clip_dir", type=str, help="Dir of per-video clip txt files, or a clip manifest.")
     parser.add_argument("--input_astream_dir", type=str)
     parser.add_argument("--input_vstream_dir", type=str)
     parser.add_argument("--output_dir", type=str, default=None)
     parser.add_argument("--ignore_audio", action="store_true", help="Ignore audio stream during processing.")
     parser.add_argument("--num_workers", type=int, default=os.cpu_count() // 4)
+    parser.add_argument(
+        "--schedule",
+        type=str,
+        default="clip",
+        choices=["clip", "video"],
+        help="Spread individual clips over the workers once their video is set up, or whole videos.",
+    )
+    parser.add_argument(
+        "--journal",
+        type=str,
+        default=None,
+        help="SQLite journal shared with 3_nvtranscoding.py, defaults to 'journal.sqlite' in the vstream dir.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted run, skipping the clips already finished according to the journal.",
+    )
+    parser.add_argument("--validate", action="store_true", help="Check the frame count of every muxed clip.")
+    parser.add_argument(
+        "--remuxer",
+        type=str,
+        default="ffmpeg",
+        choices=["ffmpeg", "pyav"],
+        help="Mux every clip with an ffmpeg process, or in-process with PyAV (needs `pip install av`).",
+    )
+    parser.add_argument(
+        "--audio_mode",
+        type=str,
+        default="per_video",
+        choices=["per_video", "per_clip"],
+        help="Cut the audio of all clips of a video in one ffmpeg pass, or run ffmpeg once per clip.",
+    )
+    parser.add_argument(
+        "--output_sink",
+        type=str,
+        default="files",
+        choices=["files", "shards"],
+        help="Write one file per clip under '<output_dir>/<vid>', or pack the clips into tar shards in output_dir.",
+    )
+    parser.add_argument("--shard_size_mb", type=int, default=1024, help="Rotate a shard once it exceeds this size.")
+    parser.add_argument(
+        "--sidecar",
+        type=parse_sidecar,
+        action="append",
+        default=[],
+        help="'ext=dir', add '<dir>/<vid>/<vid>_<start>_<end>.<ext>' to the shards next to each clip if it exists.",
+    )
+    parser.add_argument("--audio_sidecar", action="store_true", help="Also store the AAC audio of each clip in shards.")
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.INFO)
@@ -79,20 +272,42 @@ if __name__ == "__main__":
     if args.output_dir is None:
         args.output_dir = args.input_clip_dir + "_clips"
 
-    os.makedirs(args.output_dir, exist_ok=False)
+    if args.journal is None:
+        args.journal = os.path.join(args.input_vstream_dir, "journal.sqlite")
+
+    os.makedirs(args.output_dir, exist_ok=args.resume)
 
-    vids = sorted([os.path.splitext(vid)[0] for vid in os.listdir(args.input_clip_dir)])
+    clip_index = open_clip_index(args.input_clip_dir)
+    vids = clip_index.vids()
     logging.info(f"Start process {len(vids)} videos.")
 
-    kargs = []
-    for vid in vids:
-        with open(os.path.join(args.input_clip_dir, f"{vid}.txt"), "r") as f:
-            clips = [tuple(map(int, line.strip().split(" "))) for line in f]
+    sink = None
+    if args.output_sink == "shards":
+        sink = ShardWriter(
+            args.output_dir,
+            max_size=args.shard_size_mb << 20,
+            on_finalize=lambda shard_filename, keys: finalize_shard(args, shard_filename, keys),
+        )
 
-        # process_one_video(vid, clips)
-        kargs.append((args, vid, clips, args.ignore_audio))
+    videos = [RemixVideo(args, vid, clip_index[vid], args.ignore_audio, sink) for vid in vids]
 
-    with multiprocessing.dummy.Pool(processes=args.num_workers) as pool:
-        results = pool.imap_unordered(process_one_video_wrapper, kargs)
-        for _ in tqdm.tqdm(results, total=len(kargs), mininterval=120):
-            pass
+    pool = TaskPool(args.num_workers)
+    if args.schedule == "clip":
+        pool.run([video.clip_tasks for video in videos])
+    else:
+        pool.run([video.video_task for video in videos])
+    report = pool.report()
+    logging.info(
+        f"Finish in {report['makespan']:.1f}s with {args.schedule} scheduling, "
+        f"{report['tail']:.1f}s tail with idle workers, {report['utilization']:.0%} utilization."
+    )
+
+    n_audio_invocations = sum(video.n_audio_invocations for video in videos)
+    n_audio_clips = 0 if args.ignore_audio else sum(len(video.files) for video in videos)
+    logging.info(
+        f"Cut audio of {n_audio_clips} clips with {n_audio_invocations} ffmpeg invocations "
+        f"({n_audio_clips} in per_clip mode)."
+    )
+
+    if sink is not None:
+        sink.close()
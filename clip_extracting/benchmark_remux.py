@@ -0,0 +1,101 @@
+import argparse
+import logging
+import os
+import shlex
+import subprocess
+import tempfile
+import time
+
+import av
+import numpy as np
+
+from utils.audio_utils import copy_clip_audios
+from utils.remux_utils import ClipRemuxer
+
+
+def make_synthetic(output_dir, num_clips, clip_frames, width, height, fps=30):
+    """
+    Write `num_clips` raw HEVC clips named like the output of 3_nvtranscoding.py, and an AAC source stream that
+    covers all of them, as 2_split_audios.py writes for AAC sources.
+    """
+    clips = [(i * clip_frames, (i + 1) * clip_frames) for i in range(num_clips)]
+    vstream_filename = os.path.join(output_dir, "synthetic_{:07d}_{:07d}.hevc")
+    for s, e in clips:
+        output = av.open(vstream_filename.format(s, e), "w", format="hevc")
+        stream = output.add_stream("libx265", rate=fps)
+        stream.width, stream.height, stream.pix_fmt = width, height, "yuv420p"
+        stream.options = {"x265-params": "log-level=error"}
+        for idx in range(s, e):
+            frame = np.random.default_rng(idx).integers(0, 256, (height, width, 3), dtype=np.uint8)
+            output.mux(stream.encode(av.VideoFrame.from_ndarray(frame, format="rgb24")))
+        output.mux(stream.encode())
+        output.close()
+
+    astream_filename = os.path.join(output_dir, "synthetic.m4a")
+    output = av.open(astream_filename, "w", format="ipod")
+    stream = output.add_stream("aac", rate=48000)
+    stream.layout = "stereo"
+    n_samples = clips[-1][1] * 48000 // fps
+    for pts in range(0, n_samples, 1024):
+        samples = np.sin(np.arange(pts, pts + 1024, dtype=np.float32) * 2 * np.pi * 440 / 48000)
+        frame = av.AudioFrame.from_ndarray(np.stack([samples, samples]), format="fltp", layout="stereo")
+        frame.sample_rate, frame.pts = 48000, pts
+        output.mux(stream.encode(frame))
+    output.mux(stream.encode())
+    output.close()
+
+    return clips, vstream_filename, astream_filename
+
+
+def remux_subprocess(clips, vstream_filename, astream_filename, output_dir):
+    clip_astream_filename = os.path.join(output_dir, "synthetic_{:07d}_{:07d}.m4a")
+    copy_clip_audios(astream_filename, clips, clip_astream_filename)
+    for s, e in clips:
+        subprocess.run(
+            shlex.split(
+                "ffmpeg -i {} -i {} -map 0:v -map 1:a -c copy -t 60 -movflags +faststart -vtag hvc1 "
+                "-loglevel error -y {}".format(
+                    vstream_filename.format(s, e),
+                    clip_astream_filename.format(s, e),
+                    os.path.join(output_dir, f"synthetic_{s:07d}_{e:07d}.mp4"),
+                ),
+            ),
+            check=True,
+        )
+
+
+def remux_pyav(clips, vstream_filename, astream_filename, output_dir):
+    remuxer = ClipRemuxer(astream_filename)
+    for s, e in clips:
+        remuxer.remux(vstream_filename.format(s, e), os.path.join(output_dir, f"synthetic_{s:07d}_{e:07d}.mp4"), s, e)
+    remuxer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the ffmpeg subprocess remux of 4_remix_to_files.py with PyAV.")
+    parser.add_argument("--num_clips", type=int, default=32)
+    parser.add_argument("--clip_frames", type=int, default=150)
+    parser.add_argument("--width", type=int, default=320)
+    parser.add_argument("--height", type=int, default=180)
+    parser.add_argument("--output_dir", type=str, default=None, help="Defaults to a temporary dir.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.output_dir is None:
+        args.output_dir = tempfile.mkdtemp(prefix="remux_benchmark_")
+
+    clips, vstream_filename, astream_filename = make_synthetic(
+        args.output_dir, args.num_clips, args.clip_frames, args.width, args.height
+    )
+    logging.info(f"{len(clips)} synthetic clips of {args.clip_frames} frames in '{args.output_dir}'.")
+
+    elapsed = {}
+    for name, remux in [("subprocess", remux_subprocess), ("pyav", remux_pyav)]:
+        output_dir = os.path.join(args.output_dir, name)
+        os.makedirs(output_dir, exist_ok=True)
+        start_time = time.time()
+        remux(clips, vstream_filename, astream_filename, output_dir)
+        elapsed[name] = time.time() - start_time
+        logging.info(f"{name}: {elapsed[name]:.2f}s, {elapsed[name] / len(clips) * 1000:.1f}ms per clip.")
+    logging.info(f"Speedup {elapsed['subprocess'] / elapsed['pyav']:.2f}x.")
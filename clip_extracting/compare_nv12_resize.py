@@ -0,0 +1,62 @@
+import argparse
+import itertools
+import logging
+import time
+
+import numpy as np
+
+from utils.ffmpeg_utils import FFmpegVideoDecoder, probe_video
+from utils.nv12_utils import psnr, resize_nv12, resize_nv12_via_rgb, rgb_to_nv12, split_nv12
+
+
+def synthetic_frames(width, height, num_frames):
+    yy, xx = np.mgrid[0:height, 0:width]
+    for idx in range(num_frames):
+        rgb = np.stack(
+            [
+                xx / width * 255,
+                yy / height * 255,
+                128 + 100 * np.sin((xx + 8 * idx) / 37) * np.cos(yy / 23),
+            ],
+            axis=-1,
+        )
+        yield rgb_to_nv12(rgb.astype(np.uint8))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the RGB and NV12 resize paths of 3_nvtranscoding.py on CPU.")
+    parser.add_argument("--video", type=str, default=None, help="Source video, synthetic 1080p frames if not given.")
+    parser.add_argument("--num_frames", type=int, default=8)
+    parser.add_argument("--width", type=int, default=1280, help="Width of the output video.")
+    parser.add_argument("--height", type=int, default=720, help="Height of the output video.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.video is not None:
+        info = probe_video(args.video)
+        decoder = FFmpegVideoDecoder(args.video, info["width"], info["height"], pix_fmt="nv12")
+        frames = list(itertools.islice(decoder, args.num_frames))
+        decoder.finish()
+    else:
+        frames = list(synthetic_frames(1920, 1080, args.num_frames))
+
+    elapsed = {"rgb": 0.0, "nv12": 0.0}
+    scores = []
+    for frame in frames:
+        start_time = time.time()
+        via_rgb = resize_nv12_via_rgb(frame, args.height, args.width)
+        elapsed["rgb"] += time.time() - start_time
+
+        start_time = time.time()
+        direct = resize_nv12(frame, args.height, args.width)
+        elapsed["nv12"] += time.time() - start_time
+
+        (y_rgb, uv_rgb), (y_nv12, uv_nv12) = split_nv12(via_rgb), split_nv12(direct)
+        scores.append((psnr(y_rgb, y_nv12), psnr(uv_rgb, uv_nv12)))
+
+    y_psnr, uv_psnr = np.mean(scores, axis=0)
+    logging.info(f"{len(frames)} frames {frames[0].shape[1]}x{frames[0].shape[0] * 2 // 3} -> {args.width}x{args.height}.")
+    logging.info(f"PSNR of the NV12 path against the RGB path: Y {y_psnr:.2f}dB, UV {uv_psnr:.2f}dB.")
+    for name, seconds in elapsed.items():
+        logging.info(f"{name}: {seconds / len(frames) * 1000:.1f}ms per frame.")
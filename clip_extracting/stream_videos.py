@@ -0,0 +1,314 @@
+# NOTE: One must import PyCuda driver first, before CVCUDA or VPF otherwise things may throw unexpected errors.
+import argparse
+import importlib
+import logging
+import os
+import shutil
+import threading
+import time
+
+import pycuda.driver as cuda
+import cvcuda
+import torch
+
+from utils.audio_utils import find_astream
+from utils.fanout_utils import ClipFanout, plan_fanout_passes
+from utils.journal_utils import Journal, reached
+from utils.manifest_utils import open_clip_index
+from utils.mux_utils import MOVFLAGS, mux_clip
+from utils.nvvpf_utils import VideoBatchDecoder, VideoMemoryEncoder
+from utils.pipeline_utils import Pipeline, Stage
+from utils.sink_utils import FileSink
+
+extract_astream = importlib.import_module("2_split_audios").extract_astream
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except FileNotFoundError:
+                # Deleted by another stage in the meantime.
+                pass
+    return total
+
+
+class StreamingDriver:
+    """
+    Moves every video through audio extraction, transcoding and remux as soon as its source video is available,
+    instead of running 2_split_audios.py, 3_nvtranscoding.py and 4_remix_to_files.py over the whole dataset one after
+    the other. The audio stream and the raw HEVC clips of a video only live in the scratch dir while the video is in
+    flight: each HEVC stream is deleted once its clip is muxed, the audio stream once the video is done. Peak scratch
+    usage is thus bounded by the videos in flight, i.e. the workers and queue slots of the stages, not by the dataset.
+    Remux runs in a stage of its own, so that the GPU goes on with the next video meanwhile.
+    """
+
+    def __init__(self, args, decoder, encoder, cuda_ctx, cvcuda_stream, torch_stream):
+        self.args = args
+        self.decoder = decoder
+        self.encoder = encoder
+        self.cuda_ctx = cuda_ctx
+        self.cvcuda_stream = cvcuda_stream
+        self.torch_stream = torch_stream
+
+        self.clip_index = open_clip_index(args.input_clip_dir)
+        self.journal = Journal(args.journal)
+        self.astream_dir = os.path.join(args.scratch_dir, "astreams")
+        self.vstream_dir = os.path.join(args.scratch_dir, "vstreams")
+        os.makedirs(self.astream_dir, exist_ok=True)
+        os.makedirs(self.vstream_dir, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.peak_scratch = 0
+
+    def source(self, vid):
+        return os.path.join(self.args.input_video_dir, f"{vid}.{self.args.video_ext}")
+
+    def iter_videos(self):
+        """
+        Yield the videos with unfinished clips as their sources show up. With --watch, keep polling the input dir
+        for sources still being downloaded, which must appear under their final name only once complete.
+        """
+        remaining = dict.fromkeys(self.clip_index.vids())
+        if self.args.resume:
+            for vid in list(remaining):
+                if reached(self.journal.video_state(vid), "muxed"):
+                    del remaining[vid]
+        logging.info(f"Total {len(remaining)} video(s) to process.")
+
+        while len(remaining) > 0:
+            for vid in list(remaining):
+                if os.path.exists(self.source(vid)):
+                    del remaining[vid]
+                    yield vid
+            if not self.args.watch or len(remaining) == 0:
+                break
+            time.sleep(self.args.poll_interval)
+        if len(remaining) > 0:
+            logging.warning(f"No source video of {len(remaining)} video(s) in '{self.args.input_video_dir}'.")
+
+    def sample_scratch(self):
+        size = dir_size(self.args.scratch_dir)
+        with self.lock:
+            self.peak_scratch = max(self.peak_scratch, size)
+
+    def cleanup(self, vid, astream_filename=None):
+        shutil.rmtree(os.path.join(self.vstream_dir, vid), ignore_errors=True)
+        if astream_filename is not None and os.path.exists(astream_filename):
+            os.remove(astream_filename)
+
+    def audio(self, vid):
+        clips = self.clip_index[vid]
+        pending = self.journal.pending_clips(vid, clips, "muxed") if self.args.resume else clips
+        item = {"vid": vid, "clips": clips, "pending": pending, "astream": None}
+        if not self.args.ignore_audio:
+            extract_astream(self.source(vid), os.path.join(self.astream_dir, f"{vid}.flac"), self.args.audio_codec)
+            item["astream"] = find_astream(self.astream_dir, vid)
+        self.sample_scratch()
+        return item
+
+    def transcode(self, item):
+        vid, clips, pending = item["vid"], item["clips"], item["pending"]
+        os.makedirs(os.path.join(self.vstream_dir, vid), exist_ok=True)
+        vstream_format = os.path.join(self.vstream_dir, vid, f"{vid}_{{:07d}}_{{:07d}}.hevc")
+
+        def finish_clip(clip, stream):
+            stream.finish()
+            self.journal.set_clip_state(vid, clip, "transcoded")
+
+        self.cuda_ctx.push()
+        try:
+            for pass_clips in plan_fanout_passes(pending, self.args.max_sessions):
+                # Decode a partially finished video only from its first missing clip.
+                self.decoder.initialize(self.source(vid), pass_clips, seek=True if len(pending) < len(clips) else None)
+                fanout = ClipFanout(
+                    pass_clips,
+                    lambda clip: self.encoder.open(FileSink(vstream_format.format(*clip))),
+                    finish_clip,
+                    self.encoder.prepare,
+                    self.args.max_sessions,
+                )
+                with self.cvcuda_stream, torch.cuda.stream(self.torch_stream):
+                    finished = fanout.run(self.decoder)
+                self.decoder.finish()
+                if len(finished) < len(pass_clips):
+                    raise RuntimeError(f"Only {len(finished)} of {len(pass_clips)} clips of '{vid}' were transcoded.")
+        except BaseException:
+            self.cleanup(vid, item["astream"])
+            raise
+        finally:
+            self.cuda_ctx.pop()
+
+        self.sample_scratch()
+        return dict(item, vstream_format=vstream_format)
+
+    def remux(self, item):
+        vid = item["vid"]
+        os.makedirs(os.path.join(self.args.output_dir, vid), exist_ok=True)
+        try:
+            for s, e in sorted(set(item["pending"])):
+                vstream_filename = item["vstream_format"].format(s, e)
+                with open(vstream_filename, "rb") as f:
+                    bitstream = f.read()
+                mux_clip(
+                    os.path.join(self.args.output_dir, vid, f"{vid}_{s:07d}_{e:07d}.mp4"),
+                    bitstream,
+                    self.args.fps,
+                    item["astream"],
+                    s,
+                    e,
+                    self.args.mp4_layout,
+                )
+                os.remove(vstream_filename)
+                self.journal.set_clip_state(vid, (s, e), "muxed")
+        finally:
+            self.sample_scratch()
+            self.cleanup(vid, item["astream"])
+
+        self.journal.set_video_state(vid, "muxed")
+        # Only once the video is recorded as done, a failed remux leaves the source for a rerun with --resume.
+        if self.args.delete_sources:
+            os.remove(self.source(vid))
+        logging.info(f"Finish process {len(item['pending'])} clips of '{vid}'.")
+        return vid
+
+    def stages(self):
+        # One queue slot per worker keeps the videos in flight, and with them the scratch usage, to a minimum.
+        return [
+            Stage("audio", self.audio, self.args.audio_workers, queue_size=self.args.audio_workers),
+            Stage("transcode", self.transcode, 1, queue_size=1),
+            Stage("remux", self.remux, self.args.remux_workers, queue_size=self.args.remux_workers),
+        ]
+
+    def close(self):
+        self.journal.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run steps 2 to 4 video by video, keeping only the videos in flight in the scratch dir."
+    )
+    parser.add_argument("--input_clip_dir", type=str, help="Dir of per-video clip txt files, or a clip manifest.")
+    parser.add_argument("--input_video_dir", type=str)
+    parser.add_argument("--output_dir", type=str)
+    parser.add_argument(
+        "--scratch_dir",
+        type=str,
+        default=None,
+        help="Dir of the audio streams and raw HEVC clips in flight, defaults to '_scratch' in the output dir.",
+    )
+    parser.add_argument("--video_ext", type=str, default="mp4", help="Extension of the source videos.")
+    parser.add_argument("--width", type=int, default=1280, help="Width of the output video.")
+    parser.add_argument("--height", type=int, default=720, help="Height of the output video.")
+    parser.add_argument("--fps", type=int, default=30, help="FPS of the output video.")
+    parser.add_argument("--device_id", type=int, default=0, help="Specify the GPU ID if you have multiple GPUs.")
+    parser.add_argument(
+        "--seek",
+        action="store_true",
+        help="Only decode from the keyframe preceding each clip, skipping the gaps between clips.",
+    )
+    parser.add_argument(
+        "--pixel_format",
+        type=str,
+        default="rgb",
+        choices=["rgb", "nv12"],
+        help="Resize in RGB, or resize the NV12 planes directly and skip both colour conversions.",
+    )
+    parser.add_argument("--max_sessions", type=int, default=1, help="Overlapping clips encoded from one decode pass.")
+    parser.add_argument(
+        "--audio_codec",
+        type=str,
+        default="auto",
+        choices=["auto", "flac"],
+        help="'auto' stream-copies AAC audio at 48 kHz stereo and only re-encodes other audio to FLAC.",
+    )
+    parser.add_argument("--ignore_audio", action="store_true", help="Write mute clips.")
+    parser.add_argument(
+        "--mp4_layout",
+        type=str,
+        default="faststart",
+        choices=list(MOVFLAGS),
+        help="Moov-first layout of the MP4 clips, 'fragmented' writes every clip in a single pass.",
+    )
+    parser.add_argument("--audio_workers", type=int, default=2, help="Videos whose audio is extracted at a time.")
+    parser.add_argument("--remux_workers", type=int, default=2, help="Videos whose clips are remuxed at a time.")
+    parser.add_argument(
+        "--delete_sources",
+        action="store_true",
+        help="Delete every source video once its clips are muxed, e.g. while a downloader still fills the input dir.",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep polling the input dir for source videos that are not there yet.",
+    )
+    parser.add_argument("--poll_interval", type=float, default=60, help="Seconds between polls with --watch.")
+    parser.add_argument(
+        "--journal",
+        type=str,
+        default=None,
+        help="SQLite journal of finished videos and clips, defaults to 'journal.sqlite' in the output dir.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted run, skipping the clips already finished according to the journal.",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.output_dir is None:
+        args.output_dir = args.input_clip_dir + "_clips"
+
+    if args.scratch_dir is None:
+        args.scratch_dir = os.path.join(args.output_dir, "_scratch")
+
+    if args.journal is None:
+        args.journal = os.path.join(args.output_dir, "journal.sqlite")
+
+    os.makedirs(args.output_dir, exist_ok=args.resume)
+
+    logging.info(f"Using CUDA device: {args.device_id}.")
+
+    cuda_device = cuda.Device(args.device_id)
+    cuda_ctx = cuda_device.retain_primary_context()
+    cuda_ctx.push()
+    cvcuda_stream = cvcuda.Stream().current
+    torch_stream = torch.cuda.default_stream(device=cuda_device)
+
+    decoder = VideoBatchDecoder(
+        args.width,
+        args.height,
+        args.fps,
+        1,
+        args.device_id,
+        cuda_ctx,
+        cvcuda_stream,
+        seek=args.seek,
+        pixel_format=args.pixel_format,
+    )
+    assert decoder.fps == 30
+
+    encoder = VideoMemoryEncoder(
+        args.width,
+        args.height,
+        args.fps,
+        1,
+        args.device_id,
+        cuda_ctx,
+        cvcuda_stream,
+        pixel_format=args.pixel_format,
+        max_sessions=args.max_sessions,
+    )
+
+    driver = StreamingDriver(args, decoder, encoder, cuda_ctx, cvcuda_stream, torch_stream)
+    stats = Pipeline(driver.stages()).run(driver.iter_videos())
+    Pipeline.report(stats)
+    logging.info(f"Peak scratch usage: {driver.peak_scratch / (1 << 30):.2f} GiB.")
+
+    driver.close()
+    encoder.close()
+    cuda_ctx.pop()
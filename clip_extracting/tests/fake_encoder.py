@@ -0,0 +1,85 @@
+import types
+
+from utils.encoder_pool import EncoderSession
+from utils.hevc_utils import IDR_W_RADL, PPS_NUT, SPS_NUT, VPS_NUT, nal_units
+
+TRAIL_R = 1
+
+
+class FakeEncoderSession(EncoderSession):
+    """
+    CPU stand-in for an encoder session, e.g. to check clip bookkeeping without a GPU: writes one line per frame,
+    `repr(frame)`, and a line of `IDR` at the start of every stream. With `ignore_reset`, a restarted stream gets no
+    `IDR` line, like an encoder binding that ignores the reset of a reused session.
+    """
+
+    def __init__(self, sink, ignore_reset=False):
+        self.ignore_reset = ignore_reset
+        self.sink = sink
+        self.sink.write(b"IDR\n")
+
+    def __call__(self, frame) -> None:
+        self.sink.write(f"{frame!r}\n".encode())
+
+    def finish(self) -> None:
+        pass
+
+    def restart(self, sink) -> None:
+        self.sink = sink
+        if not self.ignore_reset:
+            self.sink.write(b"IDR\n")
+
+    def close(self) -> None:
+        self.sink = None
+
+
+def nal_unit(nal_type, payload=b""):
+    return b"\x00\x00\x00\x01" + bytes([nal_type << 1, 1]) + payload
+
+
+class FakeNvEncoder:
+    """
+    Stand-in for a PyNvVideoCodec encoder over integer frames. Every frame becomes one access unit whose slice payload
+    is the frame number, the first of a session or of a reset stream an IDR frame with its parameter sets. Output lags
+    `delay` frames behind the input, as with B-frames or lookahead, and EndEncode() flushes the rest.
+    :param ignore_reset: Reconfigure() accepts the reset flags but keeps the stream going without an IDR frame.
+    """
+
+    def __init__(self, delay=0, ignore_reset=False):
+        self.delay = delay
+        self.ignore_reset = ignore_reset
+        self.pending = []
+        self.idr = True
+        self.reconfigured = 0
+
+    def unit(self, frame):
+        data = str(frame).encode()
+        if self.idr:
+            self.idr = False
+            return nal_unit(VPS_NUT) + nal_unit(SPS_NUT) + nal_unit(PPS_NUT) + nal_unit(IDR_W_RADL, data)
+        return nal_unit(TRAIL_R, data)
+
+    def Encode(self, frame):
+        self.pending.append(self.unit(frame))
+        if len(self.pending) <= self.delay:
+            return b""
+        return self.pending.pop(0)
+
+    def EndEncode(self):
+        output, self.pending = b"".join(self.pending), []
+        return output
+
+    def GetEncodeReconfigureParams(self):
+        return types.SimpleNamespace(resetEncoder=0, forceIDR=0)
+
+    def Reconfigure(self, params):
+        self.reconfigured += 1
+        if params.forceIDR and not self.ignore_reset:
+            self.idr = True
+
+
+def decode_frames(stream):
+    """
+    Frame numbers of a stream written by FakeNvEncoder sessions, in order.
+    """
+    return [int(unit[2:]) for unit in nal_units(stream) if (unit[0] >> 1) & 0x3F < VPS_NUT]
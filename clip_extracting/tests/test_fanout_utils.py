@@ -0,0 +1,146 @@
+import functools
+import io
+import random
+import unittest
+
+from tests.fake_encoder import FakeEncoderSession
+from utils.encoder_pool import EncoderPool
+from utils.fanout_utils import ClipFanout, plan_fanout_passes
+
+
+def max_overlap(clips):
+    events = sorted([(s, 1) for s, _ in clips] + [(e, -1) for _, e in clips])
+    active = peak = 0
+    for _, delta in events:
+        active += delta
+        peak = max(peak, active)
+    return peak
+
+
+class FakeTranscoder:
+    """
+    Runs ClipFanout over numbered frames with pooled FakeEncoderSessions, and keeps what every clip received.
+    """
+
+    def __init__(self, max_idle=2, ignore_reset=False):
+        self.pool = EncoderPool(functools.partial(FakeEncoderSession, ignore_reset=ignore_reset), max_idle)
+        self.outputs = {}
+        self.prepared = []
+
+    def open_clip(self, clip):
+        sink = io.BytesIO()
+        self.outputs[clip] = sink
+        return self.pool.acquire(sink)
+
+    def finish_clip(self, clip, session):
+        session.finish()
+        self.pool.release(session)
+
+    def prepare(self, frame):
+        self.prepared.append(frame)
+        return frame
+
+    def run(self, clips, n_frames, max_sessions=None):
+        wanted = {idx for s, e in clips for idx in range(s, e)}
+        frames = [idx if idx in wanted else None for idx in range(n_frames)]
+        finished = []
+        for pass_clips in plan_fanout_passes(clips, max_sessions):
+            fanout = ClipFanout(pass_clips, self.open_clip, self.finish_clip, self.prepare, max_sessions)
+            finished.extend(fanout.run(frames))
+        return finished
+
+    def frames_of(self, clip):
+        lines = self.outputs[clip].getvalue().decode().splitlines()
+        assert lines[0] == "IDR", lines[:1]
+        return [int(line) for line in lines[1:]]
+
+
+class PlanFanoutPassesTest(unittest.TestCase):
+    def test_disjoint_and_adjacent_clips_share_one_pass(self):
+        clips = [(30, 40), (0, 10), (10, 20), (20, 30)]
+        self.assertEqual(plan_fanout_passes(clips, 1), [sorted(clips)])
+
+    def test_overlaps_beyond_cap_take_extra_passes(self):
+        clips = [(0, 100), (10, 20), (15, 30), (50, 60)]
+        passes = plan_fanout_passes(clips, 1)
+        self.assertEqual(passes, [[(0, 100)], [(10, 20), (50, 60)], [(15, 30)]])
+        self.assertEqual(plan_fanout_passes(clips, 2), [[(0, 100), (10, 20), (50, 60)], [(15, 30)]])
+        self.assertEqual(plan_fanout_passes(clips), [sorted(clips)])
+
+    def test_duplicates_are_dropped(self):
+        self.assertEqual(plan_fanout_passes([(5, 9), (0, 4), (5, 9)], 1), [[(0, 4), (5, 9)]])
+
+    def test_random_clips(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            clips = [(s, s + rng.randint(1, 40)) for s in (rng.randint(0, 200) for _ in range(rng.randint(1, 12)))]
+            cap = rng.choice([None, 1, 2, 3])
+            passes = plan_fanout_passes(clips, cap)
+            self.assertEqual(sorted(clip for pass_clips in passes for clip in pass_clips), sorted(set(clips)))
+            for pass_clips in passes:
+                self.assertEqual(pass_clips, sorted(pass_clips))
+                if cap is not None:
+                    self.assertLessEqual(max_overlap(pass_clips), cap)
+
+
+class ClipFanoutTest(unittest.TestCase):
+    def check(self, clips, n_frames=None, max_sessions=None):
+        n_frames = n_frames or max(e for _, e in clips) + 5
+        transcoder = FakeTranscoder()
+        finished = transcoder.run(clips, n_frames, max_sessions)
+        self.assertEqual(sorted(finished), sorted(set(clips)))
+        for s, e in set(clips):
+            self.assertEqual(transcoder.frames_of((s, e)), list(range(s, e)), (s, e))
+        return transcoder
+
+    def test_overlapping_and_nested_clips(self):
+        transcoder = self.check([(0, 50), (10, 20), (15, 40), (45, 60)])
+        # Every frame inside some clip is prepared once, however many clips share it.
+        self.assertEqual(transcoder.prepared, list(range(60)))
+
+    def test_adjacent_clips(self):
+        transcoder = self.check([(0, 10), (10, 20), (20, 21)])
+        self.assertEqual(transcoder.pool.stats()["created"], 1)
+
+    def test_reused_session_ignoring_reset(self):
+        # Without a working reset, a reused session continues the previous stream, which the IDR check catches.
+        transcoder = FakeTranscoder(ignore_reset=True)
+        transcoder.run([(0, 10), (10, 20)], 25)
+        self.assertEqual(transcoder.pool.stats()["reused"], 1)
+        self.assertEqual(transcoder.frames_of((0, 10)), list(range(10)))
+        with self.assertRaises(AssertionError):
+            transcoder.frames_of((10, 20))
+
+    def test_out_of_order_clips(self):
+        self.check([(40, 50), (0, 10), (20, 35), (5, 25)])
+
+    def test_capped_sessions(self):
+        clips = [(0, 30), (5, 25), (10, 20), (12, 18)]
+        self.check(clips, max_sessions=2)
+        self.check(clips, max_sessions=1)
+
+    def test_overlap_beyond_cap_raises(self):
+        transcoder = FakeTranscoder()
+        fanout = ClipFanout([(0, 10), (5, 15)], transcoder.open_clip, transcoder.finish_clip, max_sessions=1)
+        with self.assertRaises(RuntimeError):
+            fanout.run(range(20))
+
+    def test_short_video(self):
+        transcoder = FakeTranscoder()
+        fanout = ClipFanout([(0, 5), (8, 20)], transcoder.open_clip, transcoder.finish_clip)
+        self.assertEqual(fanout.run(range(10)), [(0, 5)])
+
+    def test_invalid_clips(self):
+        with self.assertRaises(ValueError):
+            ClipFanout([(5, 5)], None, None)
+
+    def test_random_clips(self):
+        rng = random.Random(1)
+        for _ in range(200):
+            clips = [(s, s + rng.randint(1, 30)) for s in (rng.randint(0, 100) for _ in range(rng.randint(1, 10)))]
+            transcoder = self.check(clips, max_sessions=rng.choice([None, 1, 2, 4]))
+            self.assertLessEqual(transcoder.pool.stats()["idle"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
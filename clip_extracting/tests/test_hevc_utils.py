@@ -0,0 +1,33 @@
+import unittest
+
+from utils.hevc_utils import nal_unit_types, starts_with_idr
+
+
+def nal(nal_type, payload=b"\x01\xaa", long_start_code=False):
+    start_code = b"\x00\x00\x00\x01" if long_start_code else b"\x00\x00\x01"
+    return start_code + bytes([nal_type << 1]) + payload
+
+
+PARAMS = nal(32, long_start_code=True) + nal(33) + nal(34)
+
+
+class HevcUtilsTest(unittest.TestCase):
+    def test_nal_unit_types(self):
+        self.assertEqual(nal_unit_types(PARAMS + nal(39) + nal(19) + nal(1)), [32, 33, 34, 39, 19, 1])
+        self.assertEqual(nal_unit_types(b""), [])
+
+    def test_starts_with_idr(self):
+        self.assertTrue(starts_with_idr(PARAMS + nal(19)))
+        self.assertTrue(starts_with_idr(memoryview(PARAMS + nal(39) + nal(20) + nal(1))))
+
+    def test_not_a_fresh_stream(self):
+        # Trailing frame, parameter sets missing, CRA instead of IDR, no slice at all.
+        self.assertFalse(starts_with_idr(PARAMS + nal(1)))
+        self.assertFalse(starts_with_idr(nal(19)))
+        self.assertFalse(starts_with_idr(nal(33) + nal(34) + nal(19)))
+        self.assertFalse(starts_with_idr(PARAMS + nal(21)))
+        self.assertFalse(starts_with_idr(PARAMS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import filecmp
+import os
+import tempfile
+import unittest
+
+from utils.manifest_utils import MANIFEST_ALIGN, ClipManifest, ClipTxtDir, open_clip_index
+
+CLIPS = {
+    "-abc_DEF123": [(0, 60), (120, 1920), (1920, 1980)],
+    "video-b": [(30, 90)],
+    "empty": [],
+    "long_video_id_0123456789": [(s, s + 300) for s in range(0, 90000, 450)],
+}
+
+
+class ClipManifestTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+
+        # Per-video txt files as written by 1_csv_to_clips.py.
+        self.txt_dir = os.path.join(self.tmp, "clips")
+        os.makedirs(self.txt_dir)
+        for vid, clips in CLIPS.items():
+            with open(os.path.join(self.txt_dir, vid + ".txt"), "x") as f:
+                for s, e in clips:
+                    f.write(f"{s:07d} {e:07d}\n")
+
+        txt = open_clip_index(self.txt_dir)
+        self.assertIsInstance(txt, ClipTxtDir)
+        self.manifest_file = os.path.join(self.tmp, "split.clips")
+        ClipManifest.write(self.manifest_file, {vid: txt[vid] for vid in txt.vids()})
+
+    def test_round_trip(self):
+        manifest = open_clip_index(self.manifest_file)
+        self.assertIsInstance(manifest, ClipManifest)
+        self.assertEqual(manifest.vids(), sorted(CLIPS))
+        self.assertEqual(len(manifest), len(CLIPS))
+        for vid, clips in CLIPS.items():
+            self.assertIn(vid, manifest)
+            self.assertEqual(manifest[vid], clips)
+
+    def test_unknown_and_empty_vids(self):
+        manifest = ClipManifest(self.manifest_file)
+        self.assertNotIn("missing", manifest)
+        with self.assertRaises(KeyError):
+            manifest["missing"]
+        self.assertIn("empty", manifest)
+        self.assertEqual(manifest["empty"], [])
+
+    def test_columns(self):
+        manifest = ClipManifest(self.manifest_file)
+        n_clips = sum(len(clips) for clips in CLIPS.values())
+        self.assertEqual(int(manifest.offsets[-1]), n_clips)
+        self.assertEqual(len(manifest.columns["video_idx"]), n_clips)
+        for col in manifest.columns.values():
+            self.assertEqual(col.offset % MANIFEST_ALIGN, 0)
+
+    def test_export_txt(self):
+        export_dir = os.path.join(self.tmp, "exported")
+        ClipManifest(self.manifest_file).export_txt(export_dir)
+        files = sorted(os.listdir(self.txt_dir))
+        self.assertEqual(sorted(os.listdir(export_dir)), files)
+        _, mismatch, errors = filecmp.cmpfiles(self.txt_dir, export_dir, files, shallow=False)
+        self.assertEqual(mismatch + errors, [])
+
+    def test_empty_manifest(self):
+        filename = os.path.join(self.tmp, "empty.clips")
+        ClipManifest.write(filename, {"a": [], "b": []})
+        manifest = ClipManifest(filename)
+        self.assertEqual(manifest.vids(), ["a", "b"])
+        self.assertEqual(manifest["b"], [])
+
+    def test_not_a_manifest(self):
+        with self.assertRaises(ValueError):
+            ClipManifest(os.path.join(self.txt_dir, "video-b.txt"))
+
+
+if __name__ == "__main__":
+    unittest.main()
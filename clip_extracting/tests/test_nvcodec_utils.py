@@ -0,0 +1,117 @@
+import importlib
+import io
+import sys
+import types
+import unittest
+from unittest import mock
+
+from tests.fake_encoder import FakeNvEncoder, decode_frames
+from utils.encoder_pool import EncoderPool, EncoderSession
+from utils.hevc_utils import starts_with_idr
+
+
+class NVVCVideoEncoderTest(unittest.TestCase):
+    """
+    Session reuse of NVVCVideoEncoder with PyNvVideoCodec replaced by FakeNvEncoder, so that it runs without a GPU.
+    """
+
+    def setUp(self):
+        self.nvvc = types.ModuleType("PyNvVideoCodec")
+        self.nvvc.CreateEncoder = self.create_encoder
+        patcher = mock.patch.dict(sys.modules, {"PyNvVideoCodec": self.nvvc})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        sys.modules.pop("utils.nvcodec_utils", None)
+        self.nvcodec_utils = importlib.import_module("utils.nvcodec_utils")
+
+        self.delay = 0
+        self.ignore_reset = False
+        self.encoders = []
+
+    def create_encoder(self, *args, **kwargs):
+        self.encoders.append(FakeNvEncoder(self.delay, self.ignore_reset))
+        return self.encoders[-1]
+
+    def open(self, sink):
+        stream = types.SimpleNamespace(handle=0)
+        return self.nvcodec_utils.NVVCVideoEncoder(sink, 0, 1280, 720, 30, None, stream)
+
+    def encode(self, session, frames):
+        for frame in frames:
+            session(frame)
+        session.finish()
+
+    def check_stream(self, sink, frames):
+        self.assertTrue(starts_with_idr(sink.getvalue()))
+        self.assertEqual(decode_frames(sink.getvalue()), list(frames))
+
+    def run_streams(self, streams):
+        sinks = [io.BytesIO() for _ in streams]
+        session = self.open(sinks[0])
+        for idx, (sink, frames) in enumerate(zip(sinks, streams)):
+            if idx > 0:
+                session.restart(sink)
+            self.encode(session, frames)
+        for sink, frames in zip(sinks, streams):
+            self.check_stream(sink, frames)
+        return session
+
+    def test_reset_honoured(self):
+        for delay in (0, 2):
+            with self.subTest(delay=delay):
+                self.delay, self.encoders = delay, []
+                session = self.run_streams([range(0, 5), range(5, 10), range(10, 13)])
+                self.assertTrue(session.resettable)
+                self.assertEqual(len(self.encoders), 1)
+                self.assertEqual(self.encoders[0].reconfigured, 2)
+
+    def test_reset_ignored(self):
+        # The first output of the restarted stream is not an IDR frame: its buffered frames are encoded again with a
+        # fresh session, and every later stream gets a fresh session without Reconfigure.
+        self.ignore_reset = True
+        for delay in (0, 2):
+            with self.subTest(delay=delay):
+                self.delay, self.encoders = delay, []
+                with self.assertLogs(level="WARNING"):
+                    session = self.run_streams([range(0, 5), range(5, 10), range(10, 13), range(13, 20)])
+                self.assertFalse(session.resettable)
+                self.assertEqual(len(self.encoders), 4)
+                self.assertEqual([encoder.reconfigured for encoder in self.encoders], [1, 0, 0, 0])
+
+    def test_reset_ignored_verified_in_finish(self):
+        # A restarted stream shorter than the encoder delay has its first output in finish(): the fresh session that
+        # takes over its frames has to be flushed as well.
+        self.delay, self.ignore_reset = 3, True
+        with self.assertLogs(level="WARNING"):
+            session = self.run_streams([range(0, 5), range(5, 7), range(7, 12)])
+        self.assertFalse(session.resettable)
+        self.assertEqual(len(self.encoders), 3)
+
+    def test_pooled_sessions(self):
+        self.delay, self.ignore_reset = 1, True
+        pool = EncoderPool(self.open, max_idle=1)
+        streams = [range(s, s + 4) for s in range(0, 20, 4)]
+        sinks = []
+        with self.assertLogs(level="WARNING"):
+            for frames in streams:
+                sinks.append(io.BytesIO())
+                session = pool.acquire(sinks[-1])
+                self.encode(session, frames)
+                pool.release(session)
+        for sink, frames in zip(sinks, streams):
+            self.check_stream(sink, frames)
+        self.assertEqual(pool.stats(), {"created": 1, "reused": 4, "idle": 1})
+
+
+class EncoderSessionTest(unittest.TestCase):
+    def test_incomplete_session(self):
+        class Incomplete(EncoderSession):
+            def __call__(self, frame):
+                pass
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import unittest
+
+from utils.pipeline_utils import Pipeline, Stage, parse_stage_option
+
+
+def square(x):
+    return x * x
+
+
+async def async_square(x):
+    await asyncio.sleep(0)
+    return x * x
+
+
+class Holder:
+    """
+    Stage function bound to an object holding a lock, which a process pool cannot pickle.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def double(self, x):
+        return 2 * x
+
+
+def run(stages, items):
+    results = []
+    stats = Pipeline(stages).run(items, on_result=results.append)
+    return sorted(results), stats
+
+
+class PipelineTest(unittest.TestCase):
+    def test_executors(self):
+        for executor in ("thread", "process", "asyncio"):
+            with self.subTest(executor=executor):
+                results, stats = run([Stage("square", square, 2, executor)], range(10))
+                self.assertEqual(results, [x * x for x in range(10)])
+                self.assertEqual(stats[0]["items_in"], 10)
+                self.assertEqual(stats[0]["items_out"], 10)
+
+    def test_asyncio_coroutine(self):
+        results, _ = run([Stage("square", async_square, 3, "asyncio")], range(10))
+        self.assertEqual(results, [x * x for x in range(10)])
+
+    def test_asyncio_runs_plain_function_in_thread(self):
+        # A bound method of a plain class, as the stages of the download pipeline are.
+        results, stats = run([Stage("double", Holder().double, 2, "asyncio")], range(5))
+        self.assertEqual(results, [0, 2, 4, 6, 8])
+        self.assertEqual(stats[0]["errors"], 0)
+
+    def test_unpicklable_process_stage(self):
+        with self.assertRaises(ValueError):
+            Stage("double", Holder().double, 2, "process")
+
+    def test_unsupported_executor(self):
+        with self.assertRaises(ValueError):
+            Stage("transcode", square, 1, "asyncio", executors=("thread",))
+        Stage("transcode", square, 1, "thread", executors=("thread",))
+
+    def test_expand_drop_and_errors(self):
+        def split(x):
+            if x == 3:
+                raise RuntimeError("broken item")
+            return [x, None, -x]
+
+        with self.assertLogs(level="ERROR"):
+            results, stats = run(
+                [Stage("split", split, 2, expand=True), Stage("square", square, 1, "asyncio")],
+                range(5),
+            )
+        self.assertEqual(results, sorted([0, 0, 1, 1, 4, 4, 16, 16]))
+        self.assertEqual(stats[0]["errors"], 1)
+        self.assertEqual(stats[0]["items_out"], 8)
+
+    def test_parse_stage_option(self):
+        self.assertEqual(
+            parse_stage_option("fetch=4:thread:8"),
+            {"name": "fetch", "workers": 4, "executor": "thread", "queue_size": 8},
+        )
+        self.assertEqual(parse_stage_option("mux=:process"), {"name": "mux", "executor": "process"})
+        with self.assertRaises(ValueError):
+            parse_stage_option("mux=2:fiber")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+try:
+    import av
+except ImportError:
+    av = None
+
+from utils.hevc_utils import picture_order_counts
+
+if av is not None:
+    from utils.remux_utils import ClipRemuxer
+
+
+def encode_hevc(filename, n_frames, x265_params, width=128, height=96, fps=30):
+    output = av.open(filename, "w", format="hevc")
+    stream = output.add_stream("libx265", rate=fps)
+    stream.width, stream.height, stream.pix_fmt = width, height, "yuv420p"
+    stream.options = {"x265-params": f"log-level=error:{x265_params}"}
+    for idx in range(n_frames):
+        # Change the picture every few frames, so that the encoder picks a mix of P- and B-frames.
+        frame = np.random.default_rng(idx // 4).integers(0, 256, (height, width, 3), dtype=np.uint8)
+        output.mux(stream.encode(av.VideoFrame.from_ndarray(frame, format="rgb24")))
+    output.mux(stream.encode())
+    output.close()
+
+
+@unittest.skipIf(av is None, "PyAV is not installed.")
+class ClipRemuxerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def remux(self, n_frames, x265_params, max_duration=60):
+        vstream_filename = os.path.join(self.tmpdir.name, "clip.hevc")
+        clip_filename = os.path.join(self.tmpdir.name, "clip.mp4")
+        encode_hevc(vstream_filename, n_frames, x265_params)
+        remuxer = ClipRemuxer(fps=30, max_duration=max_duration)
+        remuxer.remux(vstream_filename, clip_filename, 0, n_frames)
+        remuxer.close()
+        with av.open(vstream_filename, format="hevc") as container:
+            pocs = picture_order_counts([bytes(packet) for packet in container.demux(video=0) if packet.size > 0])
+        with av.open(clip_filename) as container:
+            stream = container.streams.video[0]
+            pts = [frame.pts for frame in container.decode(stream)]
+            frame_duration = round(1 / (30 * stream.time_base))
+        return pocs, pts, frame_duration
+
+    def assert_presentation_order(self, pts, frame_duration, n_frames):
+        self.assertEqual(len(pts), n_frames)
+        self.assertEqual(np.diff(pts).tolist(), [frame_duration] * (n_frames - 1))
+
+    def test_b_frames(self):
+        pocs, pts, frame_duration = self.remux(60, "bframes=3")
+        self.assertNotEqual(pocs, sorted(pocs), "The stream should have reordered frames.")
+        self.assert_presentation_order(pts, frame_duration, 60)
+
+    def test_poc_wraparound_and_idr(self):
+        # 16 frames of POC LSB and an IDR every 100 frames.
+        pocs, pts, frame_duration = self.remux(300, "bframes=3:log2-max-poc-lsb=4:keyint=100:min-keyint=100")
+        self.assertGreater(max(pocs), 16)
+        self.assert_presentation_order(pts, frame_duration, 300)
+
+    def test_no_b_frames(self):
+        pocs, pts, frame_duration = self.remux(30, "bframes=0")
+        self.assertEqual(pocs, sorted(pocs))
+        self.assert_presentation_order(pts, frame_duration, 30)
+
+    def test_max_duration(self):
+        _, pts, frame_duration = self.remux(60, "bframes=3", max_duration=1)
+        self.assertEqual(pts, sorted(pts))
+        self.assertLessEqual(pts[-1], 30 * frame_duration)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import itertools
+import unittest
+
+import numpy as np
+
+from utils.sampler_utils import EMDownSampler
+
+
+class EMDownSamplerMaskTest(unittest.TestCase):
+    FPS_PAIRS = [(60, 30), (59.94, 30), (50, 30), (30, 30), (25, 25), (29.97, 25), (24, 24), (120, 30)]
+
+    def per_frame(self, s_fps, t_fps, n_frames):
+        return np.fromiter(itertools.islice(EMDownSampler(s_fps, t_fps), n_frames), dtype=bool, count=n_frames)
+
+    def test_matches_per_frame_sampler(self):
+        n_frames = 20000
+        for s_fps, t_fps in self.FPS_PAIRS:
+            with self.subTest(s_fps=s_fps, t_fps=t_fps):
+                expected = self.per_frame(s_fps, t_fps, n_frames)
+                np.testing.assert_array_equal(EMDownSampler(s_fps, t_fps).mask(n_frames), expected)
+
+    def test_prefixes(self):
+        sampler = EMDownSampler(59.94, 30)
+        expected = self.per_frame(59.94, 30, 3000)
+        for n_frames in [0, 1, 179, 180, 1178, 1179, 3000]:
+            with self.subTest(n_frames=n_frames):
+                np.testing.assert_array_equal(sampler.mask(n_frames), expected[:n_frames])
+
+    def test_mask_is_writable(self):
+        mask = EMDownSampler(60, 30).mask(10)
+        mask[:] = False
+        self.assertTrue(EMDownSampler(60, 30).mask(10).any())
+
+
+if __name__ == "__main__":
+    unittest.main()
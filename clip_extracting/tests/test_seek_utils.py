@@ -0,0 +1,87 @@
+import random
+import unittest
+
+import numpy as np
+
+from utils.sampler_utils import EMDownSampler
+from utils.seek_utils import clip_frame_mask, iter_seek_frames, plan_seek_segments, source_frame_index
+
+
+class SeekPlanTest(unittest.TestCase):
+    """
+    Frames are their source indices, so that the output of a seek plan can be compared with a linear pass.
+    """
+
+    def linear_pass(self, sampler, n_source):
+        return list(iter_seek_frames(((idx, idx) for idx in range(n_source)), sampler, n_source))
+
+    def check(self, sampler, clips, keyframes):
+        kept = source_frame_index(sampler, max(e for _, e in clips))
+        keyframes = np.asarray(keyframes, dtype=np.int64)
+        segments = plan_seek_segments(clips, kept, keyframes)
+
+        starts = set(keyframes.tolist()) | {0}
+        for (a, b), (next_a, _) in zip(segments, segments[1:]):
+            self.assertLess(b, next_a)
+        for a, b in segments:
+            self.assertIn(a, starts)
+            self.assertLess(a, b)
+
+        n_source = segments[-1][1]
+        frames = ((idx, idx) for a, b in segments for idx in range(a, b))
+        wanted = clip_frame_mask(clips)
+        output = list(iter_seek_frames(frames, sampler, n_source, wanted=wanted))
+
+        linear = self.linear_pass(sampler, n_source)
+        self.assertEqual(linear, kept[: len(linear)].tolist())
+        for s, e in clips:
+            self.assertEqual(output[s:e], linear[s:e], (s, e))
+        for idx, frame in enumerate(output):
+            if not wanted[idx]:
+                self.assertIsNone(frame, idx)
+        return segments
+
+    def samplers(self):
+        return {"60": EMDownSampler(60, 30), "59.94": EMDownSampler(59.94, 30), "30": EMDownSampler(30, 30)}
+
+    def test_unsorted_clips(self):
+        for name, sampler in self.samplers().items():
+            with self.subTest(sampler=name):
+                self.check(sampler, [(900, 960), (100, 160), (500, 530)], range(0, 4000, 120))
+
+    def test_clip_at_frame_zero(self):
+        for name, sampler in self.samplers().items():
+            with self.subTest(sampler=name):
+                segments = self.check(sampler, [(0, 60), (600, 660)], range(0, 4000, 250))
+                self.assertEqual(segments[0][0], 0)
+
+    def test_keyframe_inside_previous_span_merges(self):
+        for name, sampler in self.samplers().items():
+            with self.subTest(sampler=name):
+                # The keyframe before the second clip lies inside the span of the first one.
+                segments = self.check(sampler, [(300, 360), (370, 420)], [0, 500, 1000])
+                self.assertEqual(len(segments), 1)
+
+    def test_adjacent_clips(self):
+        for name, sampler in self.samplers().items():
+            with self.subTest(sampler=name):
+                self.check(sampler, [(200, 260), (260, 300), (300, 301)], range(0, 2000, 48))
+
+    def test_sparse_keyframes(self):
+        # No keyframe but the first: everything is decoded from the start.
+        segments = self.check(EMDownSampler(59.94, 30), [(1000, 1060), (3000, 3060)], [0])
+        self.assertEqual(len(segments), 1)
+        self.assertEqual(segments[0][0], 0)
+
+    def test_random_plans(self):
+        rng = random.Random(0)
+        samplers = list(self.samplers().values())
+        for _ in range(100):
+            sampler = rng.choice(samplers)
+            clips = [(s, s + rng.randint(1, 90)) for s in (rng.randint(0, 3000) for _ in range(rng.randint(1, 6)))]
+            keyframes = sorted(rng.sample(range(1, 8000), rng.randint(0, 60)))
+            self.check(sampler, clips, keyframes)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+
+from utils.shard_utils import ShardReader, ShardWriter, clip_key, parse_clip_key
+
+
+class ShardWriterTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def write(self, keys, prefix=""):
+        finalized = []
+        writer = ShardWriter(
+            self.dir, max_count=1, on_finalize=lambda filename, keys: finalized.append(filename), prefix=prefix
+        )
+        for key in keys:
+            writer.write(key, {"mp4": key.encode(), "json": b"{}"})
+        writer.close()
+        return [os.path.basename(filename) for filename in finalized]
+
+    def test_round_trip(self):
+        keys = [clip_key("vid", (s, s + 60)) for s in (0, 60, 120)]
+        self.assertEqual(self.write(keys), [f"shard-{idx:06d}.tar" for idx in range(3)])
+        reader = ShardReader(self.dir)
+        self.assertEqual(sorted(reader.keys()), keys)
+        for key in keys:
+            self.assertEqual(reader.read(key, "mp4"), key.encode())
+        self.assertEqual(parse_clip_key(keys[1]), ("vid", (60, 120)))
+
+    def test_continue_after_highest_shard(self):
+        self.write(["a_0000000_0000001", "a_0000001_0000002", "a_0000002_0000003"])
+        # A shard moved away after upload must not make the next run reuse an index of an existing shard.
+        os.remove(os.path.join(self.dir, "shard-000001.tar"))
+        os.remove(os.path.join(self.dir, "shard-000001.json"))
+        with open(os.path.join(self.dir, "shard-000002.tar"), "rb") as f:
+            last = f.read()
+
+        self.assertEqual(self.write(["b_0000000_0000001"]), ["shard-000003.tar"])
+        with open(os.path.join(self.dir, "shard-000002.tar"), "rb") as f:
+            self.assertEqual(f.read(), last)
+
+    def test_prefixes_are_numbered_separately(self):
+        self.write(["a_0000000_0000001", "a_0000001_0000002"], prefix="000-")
+        self.assertEqual(self.write(["b_0000000_0000001"], prefix="001-"), ["001-shard-000000.tar"])
+        self.assertEqual(self.write(["c_0000000_0000001"], prefix="000-"), ["000-shard-000002.tar"])
+
+
+if __name__ == "__main__":
+    unittest.main()
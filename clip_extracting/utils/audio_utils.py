@@ -0,0 +1,122 @@
+import json
+import os
+import subprocess
+from typing import Optional, Sequence, Tuple, Union
+
+
+def probe_audio(filename: str) -> Optional[dict]:
+    """
+    Codec, sample rate and channel count of the first audio stream, None if there is none.
+    """
+    result = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "a:0",
+            "-show_entries",
+            "stream=codec_name,sample_rate,channels",
+            "-of",
+            "json",
+            filename,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    streams = json.loads(result.stdout).get("streams", [])
+    if len(streams) == 0:
+        return None
+    return {
+        "codec_name": streams[0]["codec_name"],
+        "sample_rate": int(streams[0]["sample_rate"]),
+        "channels": int(streams[0]["channels"]),
+    }
+
+
+def can_copy_audio(info: Optional[dict], sample_rate: int = 48000, channels: int = 2) -> bool:
+    """
+    Whether the audio can go into the clips by stream copy, i.e. it is already AAC in the target format.
+    """
+    return (
+        info is not None
+        and info["codec_name"] == "aac"
+        and info["sample_rate"] == sample_rate
+        and info["channels"] == channels
+    )
+
+
+def find_astream(astream_dir: str, vid: str) -> str:
+    """
+    Audio stream of a video written by 2_split_audios.py, the stream-copied AAC if there is one, else the FLAC.
+    """
+    astream_filename = os.path.join(astream_dir, f"{vid}.m4a")
+    if os.path.exists(astream_filename):
+        return astream_filename
+    return os.path.join(astream_dir, f"{vid}.flac")
+
+
+def split_clip_audios(
+    astream_filename: str,
+    clips: Sequence[Tuple[int, int]],
+    filename_format: str,
+    fps: Union[int, float] = 30,
+    sample_rate: int = 48000,
+    bitrate: str = "192k",
+    max_outputs: int = 64,
+) -> int:
+    """
+    Cut the audio segments of all clips of a video and encode them to AAC, decoding the audio stream once per
+    `max_outputs` clips instead of once per clip. Segments are cut by sample index, `[s, e)` frames at `fps` cover the
+    samples `[s * sample_rate / fps, e * sample_rate / fps)` after resampling.
+    :param filename_format: Output filename with two placeholders, the start and end frame of the clip.
+    :return: Number of ffmpeg invocations.
+    """
+    n_invocations = 0
+    for batch_start in range(0, len(clips), max_outputs):
+        batch = clips[batch_start : batch_start + max_outputs]
+
+        filters = [
+            f"[0:a:0]aresample={sample_rate},aformat=channel_layouts=stereo,asplit={len(batch)}"
+            + "".join(f"[a{i}]" for i in range(len(batch)))
+        ]
+        outputs = []
+        for i, (s, e) in enumerate(batch):
+            start_sample, end_sample = round(s * sample_rate / fps), round(e * sample_rate / fps)
+            filters.append(f"[a{i}]atrim=start_sample={start_sample}:end_sample={end_sample},asetpts=PTS-STARTPTS[o{i}]")
+            outputs += ["-map", f"[o{i}]", "-c:a", "aac", "-b:a", bitrate, "-y", filename_format.format(s, e)]
+
+        cmd = ["ffmpeg", "-v", "error", "-i", astream_filename, "-filter_complex", ";".join(filters)] + outputs
+        subprocess.run(cmd, check=True)
+        n_invocations += 1
+    return n_invocations
+
+
+def copy_clip_audios(
+    astream_filename: str,
+    clips: Sequence[Tuple[int, int]],
+    filename_format: str,
+    fps: Union[int, float] = 30,
+    max_outputs: int = 64,
+) -> int:
+    """
+    Cut the audio segments of all clips of a video from an AAC stream by stream copy, without decoding.
+    Each clip opens the stream as its own input seeked to the clip start, so ffmpeg keeps the AAC frame overlapping
+    the start (plus its priming) and trims the surplus with an edit list, instead of re-encoding the segment.
+    :param filename_format: Output filename with two placeholders, the start and end frame of the clip.
+    :return: Number of ffmpeg invocations.
+    """
+    n_invocations = 0
+    for batch_start in range(0, len(clips), max_outputs):
+        batch = clips[batch_start : batch_start + max_outputs]
+
+        inputs, outputs = [], []
+        for i, (s, e) in enumerate(batch):
+            stime, etime = round(s / fps, 6), round(e / fps, 6)
+            inputs += ["-ss", str(stime), "-to", str(etime), "-i", astream_filename]
+            outputs += ["-map", f"{i}:a:0", "-c:a", "copy", "-use_editlist", "1", "-y", filename_format.format(s, e)]
+
+        subprocess.run(["ffmpeg", "-v", "error"] + inputs + outputs, check=True)
+        n_invocations += 1
+    return n_invocations
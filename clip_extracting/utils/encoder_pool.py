@@ -0,0 +1,77 @@
+import abc
+import threading
+from typing import Any, Callable, List
+
+
+class EncoderSession(abc.ABC):
+    """
+    Interface of the encoders kept by an EncoderPool. A session encodes one stream at a time into a sink with a
+    `write` method: `finish()` flushes the stream but keeps the session open, and `restart()` points it to the sink of
+    the next stream, whose first frame has to be an IDR frame with its parameter sets so that it decodes on its own.
+    CPU or fake encoders implement the same methods to be pooled the same way.
+    """
+
+    @abc.abstractmethod
+    def __call__(self, frame) -> None:
+        pass
+
+    @abc.abstractmethod
+    def finish(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    def restart(self, sink) -> None:
+        pass
+
+    @abc.abstractmethod
+    def close(self) -> None:
+        pass
+
+
+class EncoderPool:
+    """
+    Keeps finished encoder sessions for the next clips instead of creating and destroying one per clip.
+    :param create: Called with the sink of a stream to open a new session.
+    :param max_idle: Sessions kept open while unused, extra ones are closed on release.
+    """
+
+    def __init__(self, create: Callable[[Any], EncoderSession], max_idle: int = 2):
+        self.create = create
+        self.max_idle = max_idle
+        self.idle: List[EncoderSession] = []
+        self.lock = threading.Lock()
+
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self, sink) -> EncoderSession:
+        with self.lock:
+            session = self.idle.pop() if self.idle else None
+            if session is None:
+                self.created += 1
+            else:
+                self.reused += 1
+        if session is None:
+            return self.create(sink)
+        session.restart(sink)
+        return session
+
+    def release(self, session: EncoderSession) -> None:
+        """
+        Return a finished session to the pool.
+        """
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(session)
+                return
+        session.close()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"created": self.created, "reused": self.reused, "idle": len(self.idle)}
+
+    def close(self) -> None:
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for session in idle:
+            session.close()
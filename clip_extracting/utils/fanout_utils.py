@@ -0,0 +1,88 @@
+import collections
+import heapq
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple
+
+Clip = Tuple[int, int]
+
+
+def plan_fanout_passes(clips: Sequence[Clip], max_sessions: Optional[int] = None) -> List[List[Clip]]:
+    """
+    Split clips into decode passes in which at most `max_sessions` clips overlap at any frame, all in one pass if not
+    capped. Clips are taken by start frame and go to the first pass with a session free at their start, so clips
+    without overlaps always end up in the first pass. Duplicates are dropped.
+    """
+    passes = []
+    for s, e in sorted(set(clips)):
+        for pass_clips, ends in passes:
+            while ends and ends[0] <= s:
+                heapq.heappop(ends)
+            if max_sessions is None or len(ends) < max_sessions:
+                break
+        else:
+            pass_clips, ends = [], []
+            passes.append((pass_clips, ends))
+        pass_clips.append((s, e))
+        heapq.heappush(ends, e)
+    return [pass_clips for pass_clips, _ in passes]
+
+
+class ClipFanout:
+    """
+    Feed one stream of target-fps frames to one encoder stream per active clip, so that overlapping and nested clips
+    come out of a single decode pass. Clips may also touch or come in any order.
+    Every frame inside some clip is prepared once and the same object is handed to all active streams, it is freed
+    once the last of them is done with it instead of being copied per clip. Frames outside all clips are skipped
+    and may be None, as yielded by the decoders.
+    :param open_clip: Called with (s, e) at the first frame of the clip, returns the stream to feed.
+    :param finish_clip: Called with (s, e) and its stream after the last frame of the clip.
+    :param prepare: Applied to each frame before it is fed, e.g. the colour conversion of the encoder.
+    :param max_sessions: Cap on clips encoded at the same time, see `plan_fanout_passes` to stay within it.
+    """
+
+    def __init__(
+        self,
+        clips: Sequence[Clip],
+        open_clip: Callable[[Clip], Callable[[Any], None]],
+        finish_clip: Callable[[Clip, Any], None],
+        prepare: Callable[[Any], Any] = lambda frame: frame,
+        max_sessions: Optional[int] = None,
+    ):
+        self.clips = sorted(set(clips))
+        if any(not 0 <= s < e for s, e in self.clips):
+            raise ValueError(f"Invalid clips: {[clip for clip in self.clips if not 0 <= clip[0] < clip[1]]}.")
+        self.open_clip = open_clip
+        self.finish_clip = finish_clip
+        self.prepare = prepare
+        self.max_sessions = max_sessions
+
+        self.peak_sessions = 0
+
+    def run(self, frames: Iterable) -> List[Clip]:
+        """
+        Consume frames until every clip is finished or the frames run out.
+        :return: The finished clips, in the order they finished.
+        """
+        pending = collections.deque(self.clips)
+        active = {}
+        finished = []
+        for frame_idx, frame in enumerate(frames):
+            while pending and pending[0][0] == frame_idx:
+                clip = pending.popleft()
+                active[clip] = self.open_clip(clip)
+            if len(active) == 0:
+                continue
+            if self.max_sessions is not None and len(active) > self.max_sessions:
+                raise RuntimeError(f"{len(active)} clips overlap at frame {frame_idx}, over {self.max_sessions}.")
+            self.peak_sessions = max(self.peak_sessions, len(active))
+
+            frame = self.prepare(frame)
+            for stream in active.values():
+                stream(frame)
+            del frame
+
+            for clip in [clip for clip in active if clip[1] - 1 == frame_idx]:
+                self.finish_clip(clip, active.pop(clip))
+                finished.append(clip)
+            if len(pending) == 0 and len(active) == 0:
+                break
+        return finished
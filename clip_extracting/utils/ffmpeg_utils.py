@@ -0,0 +1,333 @@
+import json
+import logging
+import subprocess
+import threading
+from fractions import Fraction
+from typing import Optional, Tuple, Union
+
+import numpy as np
+
+from utils.sampler_utils import EMDownSampler
+from utils.seek_utils import iter_seek_frames, plan_seek_segments, source_frame_index
+
+
+def probe_video(filename: str) -> dict:
+    result = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "stream=width,height,r_frame_rate,start_time",
+            "-of",
+            "json",
+            filename,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    stream = json.loads(result.stdout)["streams"][0]
+    start_time = stream.get("start_time", "N/A")
+
+    return {
+        "width": int(stream["width"]),
+        "height": int(stream["height"]),
+        "fps": float(Fraction(stream["r_frame_rate"])),
+        "start_time": 0.0 if start_time == "N/A" else float(start_time),
+    }
+
+
+def probe_keyframes(filename: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Build the keyframe index of the first video stream from its packets, without decoding.
+    Every packet counts as a frame, so that packet indices line up with the packets fed to the decoder. Packets
+    without a pts fall back to their dts, or to the time of the packet before them.
+    :return: Presentation timestamps of all frames in display order, display-order indices of the keyframes,
+        and decode-order packet indices of the keyframes.
+    """
+    result = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "packet=pts_time,dts_time,flags",
+            "-of",
+            "csv=print_section=0",
+            filename,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    pts, key = [], []
+    for line in result.stdout.splitlines():
+        pts_time, dts_time, flags = line.strip().split(",")[:3]
+        if pts_time != "N/A":
+            pts.append(float(pts_time))
+        elif dts_time != "N/A":
+            pts.append(float(dts_time))
+        else:
+            pts.append(pts[-1] if pts else 0.0)
+        key.append(flags.startswith("K"))
+    pts, key = np.asarray(pts), np.asarray(key, dtype=bool)
+    packet_idx = np.arange(len(pts), dtype=np.int64)
+
+    order = np.argsort(pts, kind="stable")
+    keyframes = np.flatnonzero(key[order])
+    return pts[order], keyframes, packet_idx[order][keyframes]
+
+
+def count_video_frames(filename: str) -> int:
+    """
+    Number of frames of the first video stream, counted from its packets without decoding.
+    """
+    result = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-count_packets",
+            "-show_entries",
+            "stream=nb_read_packets",
+            "-of",
+            "csv=print_section=0",
+            filename,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return int(result.stdout.strip().split(",")[0])
+
+
+class FFmpegVideoDecoder:
+    def __init__(
+        self,
+        enc_file: str,
+        width: int,
+        height: int,
+        start_time: Optional[float] = None,
+        pix_fmt: str = "rgb24",
+    ):
+        """
+        CPU decoder piping raw frames out of an ffmpeg process, the counterpart of NVVCVideoDecoder.
+        :param enc_file: Full path to the video file that needs to be decoded.
+        :param width: Width of the yielded frames, scaled with Lanczos if it differs from the source.
+        :param height: Height of the yielded frames.
+        :param start_time: Start at the first frame whose presentation timestamp (seconds) is not before this.
+        :param pix_fmt: Pixel format of the yielded frames, rgb24 or nv12.
+        """
+        self.enc_file = enc_file
+        self.width = width
+        self.height = height
+        self.start_time = start_time
+        self.pix_fmt = pix_fmt
+
+        if pix_fmt == "rgb24":
+            self.frame_shape = (height, width, 3)
+        elif pix_fmt == "nv12":
+            self.frame_shape = (height * 3 // 2, width)
+        else:
+            raise ValueError(f"Unsupported pixel format: {pix_fmt}")
+
+        cmd = ["ffmpeg", "-v", "error", "-nostdin"]
+        if start_time is not None:
+            cmd += ["-seek_timestamp", "1", "-ss", f"{start_time:.6f}"]
+        cmd += [
+            "-i",
+            enc_file,
+            "-map",
+            "0:v:0",
+            "-fps_mode",
+            "passthrough",
+            "-vf",
+            f"scale={width}:{height}:flags=lanczos",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            pix_fmt,
+            "-",
+        ]
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+
+        self.frame_idx = 0
+
+    def __iter__(self):
+        frame_size = int(np.prod(self.frame_shape))
+        while True:
+            buf = self.proc.stdout.read(frame_size)
+            if len(buf) < frame_size:
+                break
+            self.frame_idx += 1
+            yield np.frombuffer(buf, dtype=np.uint8).reshape(self.frame_shape)
+
+    def finish(self):
+        self.proc.kill()
+        self.proc.wait()
+        self.proc.stdout.close()
+        logging.info(f"Finish decode {self.frame_idx} frames.")
+
+
+class FFmpegVideoBatchDecoder:
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        fps: Union[int, float],
+        batch_size: int,
+        seek: bool = False,
+        pix_fmt: str = "rgb24",
+    ):
+        """
+        CPU counterpart of VideoBatchDecoder, yielding batches of (N, H, W, C) frames at the target fps.
+        With `seek`, only the spans covering the clips are decoded, and None is yielded for the skipped frames.
+        """
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.batch_size = batch_size
+        self.seek = seek
+        self.pix_fmt = pix_fmt
+        assert not seek or batch_size == 1
+
+        self.filename = None
+        self.info = None
+        self.sampler = None
+        self.segments = None
+        self.frame_pts = None
+        self.decoders = []
+
+    def initialize(self, filename: str, clips=None) -> None:
+        self.filename = filename
+        self.info = probe_video(filename)
+        self.sampler = EMDownSampler(self.info["fps"], self.fps)
+
+        self.segments = None
+        if self.seek and clips:
+            self.frame_pts, keyframes, _ = probe_keyframes(filename)
+            kept = source_frame_index(self.sampler, max(e for _, e in clips))
+            self.segments = plan_seek_segments(clips, kept, keyframes)
+            logging.info(
+                f"Decode {len(self.segments)} segment(s) covering {sum(b - a for a, b in self.segments)} frames."
+            )
+
+    def open_segment(self, src_start: int):
+        self.finish()
+
+        if src_start == 0:
+            decoder = FFmpegVideoDecoder(self.filename, self.width, self.height, pix_fmt=self.pix_fmt)
+        else:
+            # Half a frame early, so that timestamp rounding never drops the keyframe itself.
+            start_time = self.frame_pts[src_start] - 0.5 / self.info["fps"]
+            decoder = FFmpegVideoDecoder(self.filename, self.width, self.height, start_time, self.pix_fmt)
+        self.decoders.append(decoder)
+        return iter(decoder)
+
+    def iter_segments(self):
+        for src_start, src_stop in self.segments:
+            for src_idx, frame in enumerate(self.open_segment(src_start), start=src_start):
+                if src_idx == src_stop:
+                    break
+                yield src_idx, frame
+
+    def __iter__(self):
+        if self.segments is not None:
+            yield from iter_seek_frames(
+                self.iter_segments(), self.sampler, self.segments[-1][1], lambda frame: frame[None]
+            )
+            return
+
+        frames = []
+        mask = self.sampler.mask(65536)
+        for src_idx, frame in enumerate(self.open_segment(0)):
+            if src_idx == len(mask):
+                mask = self.sampler.mask(2 * len(mask))
+            if mask[src_idx]:
+                frames.append(frame)
+            if len(frames) == self.batch_size:
+                yield np.stack(frames)
+                frames.clear()
+        if len(frames) > 0:
+            yield np.stack(frames)
+            frames.clear()
+
+    def finish(self):
+        for decoder in self.decoders:
+            decoder.finish()
+        self.decoders.clear()
+
+
+class FFmpegVideoEncoder:
+    def __init__(
+        self,
+        filename: Optional[str],
+        width: int,
+        height: int,
+        fps: Union[int, float],
+        codec: str = "libx265",
+        pix_fmt: str = "rgb24",
+    ):
+        """
+        CPU encoder piping raw frames into an ffmpeg process, the counterpart of VideoMemoryEncoder.
+        :param filename: Output file, its extension selects the container, e.g. `.hevc` for a raw HEVC stream.
+            With None, the raw HEVC stream is kept in memory and returned by finish(), like VideoMemoryEncoder.
+        :param pix_fmt: Pixel format of the frames fed to the encoder, rgb24 or nv12.
+        """
+        self.filename = filename
+
+        cmd = [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            pix_fmt,
+            "-s",
+            f"{width}x{height}",
+            "-r",
+            str(fps),
+            "-i",
+            "-",
+            "-c:v",
+            codec,
+            "-pix_fmt",
+            "yuv420p",
+        ]
+        if codec == "libx265":
+            cmd += ["-x265-params", "log-level=error"]
+        if filename is None:
+            cmd += ["-f", "hevc", "-"]
+            self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            # Drain stdout concurrently, a full pipe would otherwise block ffmpeg and in turn our writes.
+            self.chunks = []
+            self.reader = threading.Thread(target=lambda: self.chunks.append(self.proc.stdout.read()), daemon=True)
+            self.reader.start()
+        else:
+            cmd += ["-y", filename]
+            self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+        self.frame_idx = 0
+
+    def __call__(self, frames: np.ndarray) -> None:
+        for frame in frames:
+            self.proc.stdin.write(memoryview(np.ascontiguousarray(frame)).cast("B"))
+            self.frame_idx += 1
+
+    def finish(self) -> Union[str, bytes]:
+        self.proc.stdin.close()
+        if self.filename is None:
+            self.reader.join()
+            self.proc.stdout.close()
+        if self.proc.wait() != 0:
+            raise subprocess.CalledProcessError(self.proc.returncode, "ffmpeg")
+        return self.filename if self.filename is not None else b"".join(self.chunks)
@@ -0,0 +1,214 @@
+from typing import Dict, List, Optional, Sequence
+
+# HEVC NAL unit types, see ITU-T H.265 Table 7-1.
+RADL_N = 6
+RASL_R = 9
+BLA_W_LP = 16
+IDR_W_RADL = 19
+IDR_N_LP = 20
+CRA_NUT = 21
+VPS_NUT = 32
+SPS_NUT = 33
+PPS_NUT = 34
+
+
+def nal_units(data) -> List[bytes]:
+    """
+    NAL units of an Annex B byte stream, headers included, in stream order.
+    """
+    data = bytes(data)
+    units = []
+    idx = data.find(b"\x00\x00\x01")
+    while idx >= 0 and idx + 3 < len(data):
+        end = data.find(b"\x00\x00\x01", idx + 3)
+        unit = data[idx + 3 : len(data) if end < 0 else end]
+        # Drop the leading zero of the next 4-byte start code and any trailing zeros.
+        units.append(unit.rstrip(b"\x00") or unit[:1])
+        idx = end
+    return units
+
+
+def nal_unit_types(data) -> List[int]:
+    """
+    Types of the NAL units of an Annex B byte stream, in stream order.
+    """
+    return [(unit[0] >> 1) & 0x3F for unit in nal_units(data)]
+
+
+def starts_with_idr(data) -> bool:
+    """
+    Whether an Annex B byte stream starts like a stream of its own: VPS, SPS and PPS ahead of the first slice, which
+    belongs to an IDR frame.
+    """
+    params = set()
+    for nal_type in nal_unit_types(data):
+        if nal_type < 32:
+            return nal_type in (IDR_W_RADL, IDR_N_LP) and {VPS_NUT, SPS_NUT, PPS_NUT} <= params
+        params.add(nal_type)
+    return False
+
+
+class BitReader:
+    """
+    Reads the RBSP of a NAL unit, with the emulation prevention bytes removed, as fixed-width and Exp-Golomb codes.
+    """
+
+    def __init__(self, unit: bytes):
+        self.data = unit[2:].replace(b"\x00\x00\x03", b"\x00\x00")
+        self.pos = 0
+
+    def u(self, n: int) -> int:
+        value = 0
+        for _ in range(n):
+            byte = self.data[self.pos >> 3] if self.pos >> 3 < len(self.data) else 0
+            value = (value << 1) | ((byte >> (7 - (self.pos & 7))) & 1)
+            self.pos += 1
+        return value
+
+    def ue(self) -> int:
+        zeros = 0
+        while self.u(1) == 0:
+            zeros += 1
+            if zeros > 32:
+                raise ValueError("Invalid Exp-Golomb code.")
+        return (1 << zeros) - 1 + self.u(zeros)
+
+
+def parse_sps(unit: bytes) -> Dict[str, int]:
+    """
+    The fields of a sequence parameter set that slice headers depend on, up to the POC LSB width.
+    """
+    r = BitReader(unit)
+    r.u(4)  # sps_video_parameter_set_id
+    max_sub_layers_minus1 = r.u(3)
+    r.u(1)  # sps_temporal_id_nesting_flag
+    # profile_tier_level(1, sps_max_sub_layers_minus1)
+    r.u(96)
+    present = [(r.u(1), r.u(1)) for _ in range(max_sub_layers_minus1)]
+    if max_sub_layers_minus1 > 0:
+        r.u(2 * (8 - max_sub_layers_minus1))
+    for profile_present, level_present in present:
+        r.u(88 * profile_present + 8 * level_present)
+    sps_id = r.ue()
+    chroma_format_idc = r.ue()
+    separate_colour_plane = r.u(1) if chroma_format_idc == 3 else 0
+    r.ue()  # pic_width_in_luma_samples
+    r.ue()  # pic_height_in_luma_samples
+    if r.u(1):  # conformance_window_flag
+        for _ in range(4):
+            r.ue()
+    r.ue()  # bit_depth_luma_minus8
+    r.ue()  # bit_depth_chroma_minus8
+    return {
+        "sps_id": sps_id,
+        "separate_colour_plane": separate_colour_plane,
+        "log2_max_poc_lsb": r.ue() + 4,
+    }
+
+
+def parse_pps(unit: bytes) -> Dict[str, int]:
+    """
+    The fields of a picture parameter set that slice headers depend on, up to the POC LSB.
+    """
+    r = BitReader(unit)
+    return {
+        "pps_id": r.ue(),
+        "sps_id": r.ue(),
+        "dependent_slice_segments": r.u(1),
+        "output_flag_present": r.u(1),
+        "num_extra_slice_header_bits": r.u(3),
+    }
+
+
+def picture_order_counts(access_units: Sequence[bytes]) -> List[Optional[int]]:
+    """
+    Picture order count of every access unit of a HEVC stream in decode order, as derived by the decoder
+    (ITU-T H.265 8.3.1), or None for access units without a slice. The count restarts at every IDR, BLA and leading
+    CRA picture, which begins a new coded video sequence.
+    """
+    spss, ppss = {}, {}
+    prev_tid0_poc = 0
+    first = True
+    pocs = []
+    for data in access_units:
+        poc = None
+        for unit in nal_units(data):
+            nal_type = (unit[0] >> 1) & 0x3F
+            if nal_type == SPS_NUT:
+                sps = parse_sps(unit)
+                spss[sps["sps_id"]] = sps
+                continue
+            if nal_type == PPS_NUT:
+                pps = parse_pps(unit)
+                ppss[pps["pps_id"]] = pps
+                continue
+            if nal_type >= 32:
+                continue
+
+            r = BitReader(unit)
+            if not r.u(1):  # first_slice_segment_in_pic_flag
+                continue
+            if BLA_W_LP <= nal_type <= 23:
+                r.u(1)  # no_output_of_prior_pics_flag
+            pps = ppss[r.ue()]
+            sps = spss[pps["sps_id"]]
+            max_poc_lsb = 1 << sps["log2_max_poc_lsb"]
+
+            if nal_type in (IDR_W_RADL, IDR_N_LP):
+                poc = 0
+            else:
+                r.u(pps["num_extra_slice_header_bits"])
+                r.ue()  # slice_type
+                if pps["output_flag_present"]:
+                    r.u(1)  # pic_output_flag
+                if sps["separate_colour_plane"]:
+                    r.u(2)  # colour_plane_id
+                lsb = r.u(sps["log2_max_poc_lsb"])
+                if BLA_W_LP <= nal_type < IDR_W_RADL or (nal_type == CRA_NUT and first):
+                    msb = 0
+                else:
+                    prev_lsb = prev_tid0_poc & (max_poc_lsb - 1)
+                    prev_msb = prev_tid0_poc - prev_lsb
+                    if lsb < prev_lsb and prev_lsb - lsb >= max_poc_lsb // 2:
+                        msb = prev_msb + max_poc_lsb
+                    elif lsb > prev_lsb and lsb - prev_lsb > max_poc_lsb // 2:
+                        msb = prev_msb - max_poc_lsb
+                    else:
+                        msb = prev_msb
+                poc = msb + lsb
+
+            temporal_id = (unit[1] & 0x07) - 1
+            sub_layer_non_reference = nal_type <= 14 and nal_type % 2 == 0
+            if temporal_id == 0 and not RADL_N <= nal_type <= RASL_R and not sub_layer_non_reference:
+                prev_tid0_poc = poc
+            first = False
+            break
+        pocs.append(poc)
+    return pocs
+
+
+def presentation_order(access_units: Sequence[bytes]) -> List[int]:
+    """
+    Display index of every access unit of a HEVC stream in decode order. Pictures are ranked by their picture order
+    count within each coded video sequence, and sequences follow each other.
+    """
+    pocs = picture_order_counts(access_units)
+    ranks = [0] * len(pocs)
+    sequence = []
+    shown = 0
+
+    def flush():
+        for rank, idx in enumerate(sorted(sequence, key=lambda idx: pocs[idx]), start=shown):
+            ranks[idx] = rank
+        return shown + len(sequence)
+
+    for idx, data in enumerate(access_units):
+        types = [t for t in nal_unit_types(data) if t < 32]
+        if sequence and types and (BLA_W_LP <= types[0] <= IDR_N_LP):
+            shown = flush()
+            sequence = []
+        if pocs[idx] is None:
+            pocs[idx] = max((pocs[i] for i in sequence), default=-1) + 1
+        sequence.append(idx)
+    flush()
+    return ranks
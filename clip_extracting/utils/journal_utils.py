@@ -0,0 +1,89 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Processing states of a video or clip, in pipeline order. A state implies all the earlier ones.
+STATES = ("pending", "downloaded", "transcoded", "muxed", "validated")
+
+
+def atomic_write(filename: str, data: bytes) -> None:
+    """
+    Write to a temporary file next to `filename` and rename it into place, so a crash never leaves a truncated file.
+    """
+    with open(filename + ".tmp", "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(filename + ".tmp", filename)
+
+
+class Journal:
+    """
+    SQLite-backed journal of per-video and per-clip processing states, for resuming a run after a crash.
+    States only move forward, so a late or repeated update never undoes progress. Every process opens its own
+    Journal on the same file, SQLite serializes the writers; threads of one process may share a Journal.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS videos "
+                "(vid TEXT PRIMARY KEY, state INTEGER NOT NULL, path TEXT, updated REAL NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS clips "
+                "(vid TEXT NOT NULL, start_frame INTEGER NOT NULL, end_frame INTEGER NOT NULL, "
+                "state INTEGER NOT NULL, updated REAL NOT NULL, PRIMARY KEY (vid, start_frame, end_frame))"
+            )
+
+    def video_state(self, vid: str) -> str:
+        with self.lock:
+            row = self.conn.execute("SELECT state FROM videos WHERE vid = ?", (vid,)).fetchone()
+        return STATES[row[0]] if row else STATES[0]
+
+    def video_path(self, vid: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT path FROM videos WHERE vid = ?", (vid,)).fetchone()
+        return row[0] if row else None
+
+    def set_video_state(self, vid: str, state: str, path: str = None) -> None:
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO videos VALUES (?, ?, ?, ?) ON CONFLICT (vid) DO UPDATE SET "
+                "state = max(state, excluded.state), path = coalesce(excluded.path, path), updated = excluded.updated",
+                (vid, STATES.index(state), path, time.time()),
+            )
+
+    def clip_states(self, vid: str) -> Dict[Tuple[int, int], str]:
+        with self.lock:
+            rows = self.conn.execute("SELECT start_frame, end_frame, state FROM clips WHERE vid = ?", (vid,)).fetchall()
+        return {(s, e): STATES[state] for s, e, state in rows}
+
+    def set_clip_state(self, vid: str, clip: Tuple[int, int], state: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO clips VALUES (?, ?, ?, ?, ?) ON CONFLICT (vid, start_frame, end_frame) DO UPDATE SET "
+                "state = max(state, excluded.state), updated = excluded.updated",
+                (vid, int(clip[0]), int(clip[1]), STATES.index(state), time.time()),
+            )
+
+    def pending_clips(self, vid: str, clips: Sequence[Tuple[int, int]], state: str) -> List[Tuple[int, int]]:
+        """
+        Clips of `vid` that have not reached `state` yet.
+        """
+        states = self.clip_states(vid)
+        return [clip for clip in clips if not reached(states.get(tuple(clip), STATES[0]), state)]
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def reached(state: str, target: str) -> bool:
+    return STATES.index(state) >= STATES.index(target)
@@ -0,0 +1,123 @@
+import json
+import os
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+MANIFEST_MAGIC = b"SEKAICLP"
+MANIFEST_VERSION = 1
+MANIFEST_ALIGN = 64
+
+
+class ClipManifest:
+    """
+    Columnar clip manifest of a whole split in one memory-mapped file.
+    Clips are stored as `video_idx`, `start_frame` and `end_frame` columns, grouped by video and sorted by start
+    frame. `offsets[i]:offsets[i + 1]` is the row range of the i-th video in `vids`.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+
+        with open(filename, "rb") as f:
+            if f.read(len(MANIFEST_MAGIC)) != MANIFEST_MAGIC:
+                raise ValueError(f"Not a clip manifest: {filename}")
+            version, header_size = np.frombuffer(f.read(8), dtype="<u4")
+            if version != MANIFEST_VERSION:
+                raise ValueError(f"Unsupported clip manifest version {version}: {filename}")
+            header = json.loads(f.read(int(header_size)))
+
+        self.columns = {
+            name: np.memmap(filename, dtype=col["dtype"], mode="r", offset=col["offset"], shape=tuple(col["shape"]))
+            if col["shape"][0] > 0
+            else np.empty(col["shape"], dtype=col["dtype"])
+            for name, col in header.items()
+        }
+        self.offsets = self.columns["offsets"]
+
+        self._vids = [vid.decode() for vid in self.columns["vids"]]
+        self._vid2idx = {vid: idx for idx, vid in enumerate(self._vids)}
+
+    @staticmethod
+    def write(filename: str, vid2clips: Dict[str, Sequence[Tuple[int, int]]]) -> None:
+        vids = sorted(vid2clips)
+        clips = [sorted((int(s), int(e)) for s, e in vid2clips[vid]) for vid in vids]
+        n_clips = np.array([len(c) for c in clips], dtype=np.int64)
+
+        columns = {
+            "vids": np.array([vid.encode() for vid in vids], dtype=f"S{max([len(vid) for vid in vids], default=1)}"),
+            "offsets": np.concatenate([[0], np.cumsum(n_clips)]).astype("<i8"),
+            "video_idx": np.repeat(np.arange(len(vids), dtype="<u4"), n_clips),
+            "start_frame": np.array([s for c in clips for s, _ in c], dtype="<i4"),
+            "end_frame": np.array([e for c in clips for _, e in c], dtype="<i4"),
+        }
+
+        # The header holds absolute offsets, so size it with placeholder offsets of the final width first.
+        header = {name: {"dtype": col.dtype.str, "shape": list(col.shape), "offset": 0} for name, col in columns.items()}
+        header_size = len(json.dumps(header)) + 32 * len(header)
+        offset = len(MANIFEST_MAGIC) + 8 + header_size
+        for name, col in columns.items():
+            offset = -(-offset // MANIFEST_ALIGN) * MANIFEST_ALIGN
+            header[name]["offset"] = offset
+            offset += col.nbytes
+        header_bytes = json.dumps(header).encode().ljust(header_size)
+
+        with open(filename + ".tmp", "wb") as f:
+            f.write(MANIFEST_MAGIC)
+            f.write(np.array([MANIFEST_VERSION, header_size], dtype="<u4").tobytes())
+            f.write(header_bytes)
+            for name, col in columns.items():
+                f.seek(header[name]["offset"])
+                f.write(col.tobytes())
+        os.replace(filename + ".tmp", filename)
+
+    def vids(self) -> List[str]:
+        return list(self._vids)
+
+    def __len__(self) -> int:
+        return len(self._vids)
+
+    def __contains__(self, vid: str) -> bool:
+        return vid in self._vid2idx
+
+    def __getitem__(self, vid: str) -> List[Tuple[int, int]]:
+        idx = self._vid2idx[vid]
+        lo, hi = self.offsets[idx], self.offsets[idx + 1]
+        return list(zip(self.columns["start_frame"][lo:hi].tolist(), self.columns["end_frame"][lo:hi].tolist()))
+
+    def export_txt(self, output_dir: str) -> None:
+        os.makedirs(output_dir, exist_ok=False)
+        for vid in self._vids:
+            with open(os.path.join(output_dir, vid + ".txt"), "x") as f:
+                [f.write(f"{s:07d} {e:07d}\n") for s, e in self[vid]]
+
+
+class ClipTxtDir:
+    """
+    Per-video `<vid>.txt` clip files, one `start end` line per clip, behind the same interface as ClipManifest.
+    """
+
+    def __init__(self, dirname: str):
+        self.dirname = dirname
+
+    def vids(self) -> List[str]:
+        return sorted([os.path.splitext(vid)[0] for vid in os.listdir(self.dirname)])
+
+    def __len__(self) -> int:
+        return len(os.listdir(self.dirname))
+
+    def __contains__(self, vid: str) -> bool:
+        return os.path.exists(os.path.join(self.dirname, f"{vid}.txt"))
+
+    def __getitem__(self, vid: str) -> List[Tuple[int, int]]:
+        with open(os.path.join(self.dirname, f"{vid}.txt"), "r") as f:
+            return [tuple(map(int, line.strip().split(" "))) for line in f]
+
+
+def open_clip_index(path: str):
+    """
+    Open the clips of a split, given either a clip manifest file or a directory of per-video txt files.
+    """
+    if os.path.isdir(path):
+        return ClipTxtDir(path)
+    return ClipManifest(path)
@@ -0,0 +1,50 @@
+import os
+import subprocess
+from typing import Optional, Union
+
+# Moov-first layouts: `faststart` writes a regular MP4 and moves the index to the front once the clip is done,
+# `fragmented` starts with an empty moov and streams fragments, so the output is written exactly once.
+MOVFLAGS = {
+    "faststart": "+faststart",
+    "fragmented": "+frag_keyframe+empty_moov+default_base_moof",
+}
+
+
+def mux_clip(
+    filename: str,
+    bitstream: bytes,
+    fps: Union[int, float],
+    astream_filename: Optional[str] = None,
+    start_frame: Optional[int] = None,
+    end_frame: Optional[int] = None,
+    layout: str = "faststart",
+    max_duration: Optional[float] = 60,
+) -> str:
+    """
+    Mux an in-memory HEVC elementary stream, as returned by VideoMemoryEncoder.finish(), into an MP4 clip.
+    The stream is piped into ffmpeg, so no intermediate .hevc file is written. The clip goes to a temporary file
+    next to `filename` and is renamed into place, so a crash never leaves a truncated clip behind.
+    :param astream_filename: Per-video audio stream from 2_split_audios.py. The span of
+        [start_frame, end_frame) at `fps` is cut from it and encoded to AAC, same as 4_remix_to_files.py, or
+        stream-copied if it is already AAC (`.m4a`).
+    :param layout: `faststart` or `fragmented`, see MOVFLAGS.
+    :param max_duration: Cap of the clip duration in seconds, None for no cap.
+    """
+    cmd = ["ffmpeg", "-v", "error", "-f", "hevc", "-framerate", str(fps), "-i", "-"]
+    if astream_filename is not None:
+        stime, etime = round(start_frame / fps, 6), round(end_frame / fps, 6)
+        cmd += ["-ss", str(stime), "-to", str(etime), "-i", astream_filename]
+        cmd += ["-map", "0:v", "-map", "1:a", "-c:v", "copy"]
+        if astream_filename.endswith(".m4a"):
+            cmd += ["-c:a", "copy"]
+        else:
+            cmd += ["-c:a", "aac", "-ar", "48000", "-ac", "2", "-b:a", "192k"]
+    else:
+        cmd += ["-map", "0:v", "-c:v", "copy"]
+    if max_duration is not None:
+        cmd += ["-t", str(max_duration)]
+    cmd += ["-movflags", MOVFLAGS[layout], "-vtag", "hvc1", "-f", "mp4", "-y", filename + ".tmp"]
+
+    subprocess.run(cmd, input=bitstream, check=True)
+    os.replace(filename + ".tmp", filename)
+    return filename
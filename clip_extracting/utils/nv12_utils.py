@@ -0,0 +1,91 @@
+from typing import Tuple
+
+import numpy as np
+
+# BT.709 limited range, RGB in [0, 255] to YUV, as configured in NVVCVideoEncoder.
+RGB2YUV = np.array(
+    [
+        [0.1826, 0.6142, 0.0620],
+        [-0.1006, -0.3386, 0.4392],
+        [0.4392, -0.3989, -0.0403],
+    ]
+)
+YUV_OFFSET = np.array([16.0, 128.0, 128.0])
+YUV2RGB = np.linalg.inv(RGB2YUV)
+
+
+def lanczos_weights(in_size: int, out_size: int, a: int = 3) -> np.ndarray:
+    """
+    (out_size, in_size) matrix of normalized Lanczos-`a` weights, widened by the scale factor when downscaling.
+    """
+    scale = in_size / out_size
+    stretch = max(scale, 1.0)
+    centers = (np.arange(out_size) + 0.5) * scale - 0.5
+    taps = np.arange(in_size)
+    x = (taps[None, :] - centers[:, None]) / stretch
+    weights = np.where(np.abs(x) < a, np.sinc(x) * np.sinc(x / a), 0.0)
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+def resize_plane(plane: np.ndarray, height: int, width: int) -> np.ndarray:
+    """
+    Lanczos resize of an (H, W) or (H, W, C) plane, returned as float.
+    """
+    plane = plane.astype(np.float64)
+    plane = np.tensordot(lanczos_weights(plane.shape[0], height), plane, axes=(1, 0))
+    plane = np.moveaxis(np.tensordot(lanczos_weights(plane.shape[1], width), plane, axes=(1, 1)), 0, 1)
+    return plane
+
+
+def to_u8(x: np.ndarray) -> np.ndarray:
+    return np.clip(np.round(x), 0, 255).astype(np.uint8)
+
+
+def rgb_to_nv12(rgb: np.ndarray) -> np.ndarray:
+    """
+    (H, W, 3) RGB to (H * 3 / 2, W) NV12, chroma averaged over 2x2 blocks.
+    """
+    h, w, _ = rgb.shape
+    yuv = rgb.astype(np.float64) @ RGB2YUV.T + YUV_OFFSET
+    uv = yuv[:, :, 1:].reshape(h // 2, 2, w // 2, 2, 2).mean(axis=(1, 3))
+    return np.concatenate([to_u8(yuv[:, :, 0]), to_u8(uv).reshape(h // 2, w)], axis=0)
+
+
+def nv12_to_rgb(nv12: np.ndarray) -> np.ndarray:
+    """
+    (H * 3 / 2, W) NV12 to (H, W, 3) RGB, chroma upsampled by repetition.
+    """
+    y, uv = split_nv12(nv12)
+    uv = uv.repeat(2, axis=0).repeat(2, axis=1)
+    yuv = np.concatenate([y[:, :, None], uv], axis=2).astype(np.float64) - YUV_OFFSET
+    return to_u8(yuv @ YUV2RGB.T)
+
+
+def split_nv12(nv12: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Y plane (H, W) and interleaved UV plane (H / 2, W / 2, 2) of an NV12 frame.
+    """
+    h = nv12.shape[0] * 2 // 3
+    return nv12[:h], nv12[h:].reshape(h // 2, nv12.shape[1] // 2, 2)
+
+
+def resize_nv12_via_rgb(nv12: np.ndarray, height: int, width: int) -> np.ndarray:
+    """
+    CPU reference of the RGB path of the transcoder: NV12 to RGB, Lanczos resize in RGB and back to NV12.
+    """
+    return rgb_to_nv12(to_u8(resize_plane(nv12_to_rgb(nv12), height, width)))
+
+
+def resize_nv12(nv12: np.ndarray, height: int, width: int) -> np.ndarray:
+    """
+    CPU reference of the NV12 path of the transcoder: Lanczos resize of the Y and the interleaved UV plane.
+    """
+    y, uv = split_nv12(nv12)
+    y = to_u8(resize_plane(y, height, width))
+    uv = to_u8(resize_plane(uv, height // 2, width // 2))
+    return np.concatenate([y, uv.reshape(height // 2, width)], axis=0)
+
+
+def psnr(a: np.ndarray, b: np.ndarray) -> float:
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else float(10 * np.log10(255.0**2 / mse))
@@ -3,6 +3,19 @@ from fractions import Fraction
 
 import PyNvVideoCodec as nvvc
 
+from utils.encoder_pool import EncoderSession
+from utils.hevc_utils import starts_with_idr
+
+
+def as_buffer(bitstream):
+    """
+    View an encoded packet without copying it if it supports the buffer protocol, else convert it once.
+    """
+    try:
+        return memoryview(bitstream)
+    except TypeError:
+        return bytearray(bitstream)
+
 
 class NVVCVideoDecoder:
     def __init__(self, enc_file, device_id, cuda_ctx, cuda_stream):
@@ -17,13 +30,7 @@ class NVVCVideoDecoder:
         self.enc_file = enc_file
         self.cuda_stream = cuda_stream
         self.nvDemux = nvvc.PyNvDemuxer(self.enc_file)
-        self.nvDec = nvvc.CreateDecoder(
-            gpuid=0,
-            codec=self.nvDemux.GetNvCodecId(),
-            cudacontext=self.cuda_ctx.handle,
-            cudastream=self.cuda_stream.handle,
-            usedevicememory=1,
-        )
+        self.nvDec = self.create_decoder()
 
         self.width = self.nvDemux.Width()
         self.height = self.nvDemux.Height()
@@ -34,17 +41,58 @@ class NVVCVideoDecoder:
 
         logging.info(f"Width={self.width}, Height={self.height}, FrameRate={self.fps}, PixelFormat={self.pixelFormat}.")
 
+    def create_decoder(self):
+        return nvvc.CreateDecoder(
+            gpuid=0,
+            codec=self.nvDemux.GetNvCodecId(),
+            cudacontext=self.cuda_ctx.handle,
+            cudastream=self.cuda_stream.handle,
+            usedevicememory=1,
+        )
+
     def __iter__(self):
         for packet in self.nvDemux:
             for frame in self.nvDec.Decode(packet):
                 self.frame_idx += 1
                 yield frame
 
+    def iter_segments(self, segments, keyframe_packets):
+        """
+        Yield (frame_idx, frame) for the frames inside each [start, stop) span of a seek plan.
+        Packets before a span's keyframe are demuxed but never decoded, and decoding restarts there with a fresh
+        decoder session. If that keyframe was already fed while finishing the previous span, decoding just goes on.
+        :param keyframe_packets: Maps the display index of each keyframe to its decode-order packet index.
+        """
+        spans = iter(segments)
+        start, stop = next(spans)
+        decoding, frame_idx = False, 0
+        for packet_idx, packet in enumerate(self.nvDemux):
+            if not decoding:
+                if packet_idx < keyframe_packets.get(start, 0):
+                    continue
+                if frame_idx > 0:
+                    self.nvDec = self.create_decoder()
+                decoding, frame_idx = True, start
+
+            for frame in self.nvDec.Decode(packet):
+                if start <= frame_idx:
+                    self.frame_idx += 1
+                    yield frame_idx, frame
+                frame_idx += 1
+
+                if frame_idx == stop:
+                    start, stop = next(spans, (None, None))
+                    if start is None:
+                        return
+                    if keyframe_packets.get(start, 0) > packet_idx:
+                        decoding = False
+                        break
+
     def finish(self):
         logging.info(f"Finish decode {self.frame_idx} frames.")
 
 
-class NVVCVideoEncoder:
+class NVVCVideoEncoder(EncoderSession):
     def __init__(
         self,
         enc_file,
@@ -56,18 +104,29 @@ class NVVCVideoEncoder:
         cuda_stream,
     ):
         self.device_id = device_id
+        self.width = width
+        self.height = height
         self.fps = round(Fraction(fps), 6)
+        self.encode_fps = fps
         self.enc_file = enc_file
         self.cuda_ctx = cuda_ctx
         self.cuda_stream = cuda_stream
 
-        self.nvEnc = nvvc.CreateEncoder(
-            width,
-            height,
+        self.nvEnc = self.create_encoder()
+
+        self.frame_idx = 0
+        # Frames of a restarted stream, kept until its first output shows whether the reset took effect.
+        self.unverified = None
+        self.resettable = True
+
+    def create_encoder(self):
+        return nvvc.CreateEncoder(
+            self.width,
+            self.height,
             fmt="NV12",
             usecpuinutbuffer=0,
             codec="hevc",
-            fps=fps,
+            fps=self.encode_fps,
             initqp="0,0,0",
             gop=240,
             tuning_info="high_quality",
@@ -79,25 +138,79 @@ class NVVCVideoEncoder:
             temporalaq=1,
             aq=1,
             colorspace="bt709",
-            cudastream=cuda_stream.handle,
+            cudastream=self.cuda_stream.handle,
         )
 
-        self.frame_idx = 0
-
     def __call__(self, frame):
         bitstream = self.nvEnc.Encode(frame)
         self.frame_idx += 1
 
-        bitstream = bytearray(bitstream)
+        if self.unverified is not None:
+            self.unverified.append(frame)
+            if not bitstream:
+                return
+            bitstream = self.verify(bitstream)
 
-        self.enc_file.write(bitstream)
+        if bitstream:
+            self.enc_file.write(as_buffer(bitstream))
 
     def finish(self):
+        """
+        Flush the stream, the session stays open for `restart()`.
+        """
         bitstream = self.nvEnc.EndEncode()
 
-        if bitstream:
-            bitstream = bytearray(bitstream)
+        if self.unverified is not None and bitstream:
+            nvEnc = self.nvEnc
+            bitstream = self.verify(bitstream)
+            if self.nvEnc is not nvEnc:
+                # The frames went into a fresh session, flush that one too.
+                flushed = self.nvEnc.EndEncode()
+                if flushed:
+                    bitstream += as_buffer(flushed)
+        self.unverified = None
 
-            self.enc_file.write(bitstream)
+        if bitstream:
+            self.enc_file.write(as_buffer(bitstream))
 
+    def verify(self, bitstream):
+        """
+        Check the first output of a restarted stream. If the reset did not start it with an IDR frame and its parameter
+        sets, encode its frames again with a fresh session, and use fresh sessions for all later streams too.
+        :return: The output to write.
+        """
+        frames, self.unverified = self.unverified, None
+        if starts_with_idr(as_buffer(bitstream)):
+            return bitstream
+
+        logging.warning("Reconfigure did not restart the stream with an IDR frame, recreating the session per stream.")
+        self.resettable = False
+        self.nvEnc = self.create_encoder()
+        output = bytearray()
+        for frame in frames:
+            bitstream = self.nvEnc.Encode(frame)
+            if bitstream:
+                output += as_buffer(bitstream)
+        return output
+
+    def restart(self, enc_file):
+        """
+        Encode the next stream into `enc_file` with the same session.
+        """
+        self.enc_file = enc_file
+        self.frame_idx = 0
+        if not self.resettable:
+            self.nvEnc = self.create_encoder()
+            return
+
+        # Reset the encoder state and force an IDR frame with its parameter sets, the stream then starts like one of
+        # a new session. The first output is checked, as not every binding exposes both flags.
+        params = self.nvEnc.GetEncodeReconfigureParams()
+        for flag in ("resetEncoder", "forceIDR"):
+            if hasattr(params, flag):
+                setattr(params, flag, 1)
+        self.nvEnc.Reconfigure(params)
+        self.unverified = []
+
+    def close(self):
         del self.nvEnc
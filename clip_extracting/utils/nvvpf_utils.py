@@ -1,4 +1,4 @@
-import io
+import logging
 from typing import List, Union
 
 import cvcuda
@@ -6,11 +6,15 @@ import nvcv
 import PyNvVideoCodec as nvvc
 import torch
 
+from utils.encoder_pool import EncoderPool
+from utils.ffmpeg_utils import probe_keyframes
 from utils.nvcodec_utils import (
     NVVCVideoDecoder,
     NVVCVideoEncoder,
 )
 from utils.sampler_utils import EMDownSampler
+from utils.seek_utils import clip_frame_mask, iter_seek_frames, plan_seek_segments, source_frame_index
+from utils.sink_utils import BufferSink
 
 pixel_format_to_cvcuda_code = {
     nvvc.Pixel_Format.YUV444: cvcuda.ColorConversion.YUV2RGB,
@@ -28,7 +32,14 @@ class VideoBatchDecoder:
         device_id: int,
         cuda_ctx,
         cuda_stream,
+        seek: bool = False,
+        pixel_format: str = "rgb",
     ):
+        """
+        :param pixel_format: `rgb` yields RGB frames resized in RGB. `nv12` yields NV12 frames for the encoder of the
+            same pixel format, resizing the Y and UV planes of NV12 sources directly without any colour conversion.
+            Either way, NV12 sources of the target size are passed through as decoded, see `passthrough`.
+        """
         self.device_id = device_id
         self.cuda_ctx = cuda_ctx
         self.cuda_stream = cuda_stream
@@ -37,28 +48,70 @@ class VideoBatchDecoder:
         self.height = height
         self.fps = fps
         self.batch_size = batch_size
+        self.seek = seek
+        self.pixel_format = pixel_format
+        assert not seek or batch_size == 1
+        assert pixel_format in ("rgb", "nv12")
 
         self.decoder = None
         self.sampler = None
         self.cvcuda_colorconversion = None
+        self.segments = None
+        self.keyframe_packets = None
+        self.wanted = None
+        self.passthrough = False
 
         self.batch_idx = 0
 
-    def initialize(self, filename: str) -> None:
+    def initialize(self, filename: str, clips=None, seek: bool = None) -> None:
+        """
+        :param clips: Clips to be extracted, planning the decoded spans in seek mode. With a batch size of 1, frames
+            outside every clip are only counted and yielded as None, without conversion or resize.
+        :param seek: Override the seek mode of this video, e.g. to resume from the first unfinished clip.
+        """
+        seek = self.seek if seek is None else seek
+        assert not seek or self.batch_size == 1
+
         self.decoder = NVVCVideoDecoder(filename, self.device_id, self.cuda_ctx, self.cuda_stream)
 
         self.sampler = EMDownSampler(self.decoder.fps, self.fps)
 
+        self.wanted = clip_frame_mask(clips) if clips and self.batch_size == 1 else None
+
+        self.segments = None
+        if seek and clips:
+            _, keyframes, keyframe_packets = probe_keyframes(filename)
+            kept = source_frame_index(self.sampler, max(e for _, e in clips))
+            self.segments = plan_seek_segments(clips, kept, keyframes)
+            self.keyframe_packets = dict(zip(keyframes.tolist(), keyframe_packets.tolist()))
+            logging.info(
+                f"Decode {len(self.segments)} segment(s) covering {sum(b - a for a, b in self.segments)} frames."
+            )
+
         self.cvcuda_colorconversion = pixel_format_to_cvcuda_code.get(self.decoder.pixelFormat)
         if self.cvcuda_colorconversion is None:
             raise ValueError(f"Unsupported pixel format: {self.decoder.pixelFormat}")
 
+        # Nothing to resize, the decoded NV12 frames go to the encoder as they are.
+        self.passthrough = self.decoder.pixelFormat == nvvc.Pixel_Format.NV12 and (
+            self.decoder.width,
+            self.decoder.height,
+        ) == (self.width, self.height)
+        if self.passthrough:
+            logging.info("Source matches the target geometry, pass NV12 frames through.")
+
     def process(self, cvcuda_YUVtensor: List[nvcv.Tensor]) -> nvcv.Tensor:
         cvcuda_YUVtensor = cvcuda.stack(cvcuda_YUVtensor)
 
         if cvcuda_YUVtensor.layout != "NHWC":
             raise ValueError("Unexpected tensor layout, NHWC expected.")
 
+        if self.passthrough:
+            return cvcuda_YUVtensor
+
+        if self.pixel_format == "nv12" and self.decoder.pixelFormat == nvvc.Pixel_Format.NV12:
+            return self.process_nv12(cvcuda_YUVtensor)
+
         cvcuda_RGBtensor = cvcuda.cvtcolor(cvcuda_YUVtensor, self.cvcuda_colorconversion)
 
         cvcuda_RGBtensor = cvcuda.hq_resize(
@@ -69,17 +122,63 @@ class VideoBatchDecoder:
             ),
             interpolation=cvcuda.Interp.LANCZOS,
         )
+        if self.pixel_format == "nv12":
+            return cvcuda.cvtcolor(cvcuda_RGBtensor, cvcuda.ColorConversion.RGB2YUV_NV12)
         return cvcuda_RGBtensor
 
+    def process_nv12(self, cvcuda_NV12tensor: nvcv.Tensor) -> nvcv.Tensor:
+        """
+        Resize (N, H * 3 / 2, W, 1) NV12 frames plane by plane: the Y plane as one channel, the interleaved UV plane of
+        half the size as two. See `utils.nv12_utils.resize_nv12` for the CPU reference.
+        """
+        nv12 = torch.as_tensor(cvcuda_NV12tensor.cuda(), device=f"cuda:{self.device_id}")
+        n, h, w = nv12.shape[0], nv12.shape[1] * 2 // 3, nv12.shape[2]
+
+        y = cvcuda.as_tensor(nv12[:, :h].contiguous(), "NHWC")
+        uv = cvcuda.as_tensor(nv12[:, h:].reshape(n, h // 2, w // 2, 2).contiguous(), "NHWC")
+
+        y = cvcuda.hq_resize(y, (self.height, self.width), interpolation=cvcuda.Interp.LANCZOS)
+        uv = cvcuda.hq_resize(uv, (self.height // 2, self.width // 2), interpolation=cvcuda.Interp.LANCZOS)
+
+        nv12 = torch.cat(
+            [
+                torch.as_tensor(y.cuda(), device=f"cuda:{self.device_id}"),
+                torch.as_tensor(uv.cuda(), device=f"cuda:{self.device_id}").reshape(n, self.height // 2, self.width, 1),
+            ],
+            dim=1,
+        )
+        return cvcuda.as_tensor(nv12, "NHWC")
+
+    def as_tensor(self, frame) -> nvcv.Tensor:
+        cvcuda_YUVtensor = nvcv.as_tensor(nvcv.as_image(frame.nvcv_image(), nvcv.Format.U8))
+        if cvcuda_YUVtensor.layout != "NCHW":
+            raise ValueError("Unexpected tensor layout, NCHW expected.")
+        return cvcuda.reformat(cvcuda_YUVtensor, "NHWC")
+
     def __iter__(self):
+        if self.segments is not None:
+            yield from iter_seek_frames(
+                self.decoder.iter_segments(self.segments, self.keyframe_packets),
+                self.sampler,
+                self.segments[-1][1],
+                lambda frame: self.process([self.as_tensor(frame)]),
+                self.wanted,
+            )
+            return
+
         cvcuda_YUVtensor = []
-        for flag, frame in zip(self.sampler, self.decoder):
-            if flag:
-                _cvcuda_YUVtensor = nvcv.as_tensor(nvcv.as_image(frame.nvcv_image(), nvcv.Format.U8))
-                if _cvcuda_YUVtensor.layout == "NCHW":
-                    cvcuda_YUVtensor.append(cvcuda.reformat(_cvcuda_YUVtensor, "NHWC"))
-                else:
-                    raise ValueError("Unexpected tensor layout, NCHW expected.")
+        mask = self.sampler.mask(65536)
+        frame_idx = 0
+        for src_idx, frame in enumerate(self.decoder):
+            if src_idx == len(mask):
+                mask = self.sampler.mask(2 * len(mask))
+            if not mask[src_idx]:
+                continue
+            if self.wanted is not None and not (frame_idx < len(self.wanted) and self.wanted[frame_idx]):
+                yield None
+            else:
+                cvcuda_YUVtensor.append(self.as_tensor(frame))
+            frame_idx += 1
             if len(cvcuda_YUVtensor) == self.batch_size:
                 yield self.process(cvcuda_YUVtensor)
                 cvcuda_YUVtensor.clear()
@@ -93,6 +192,35 @@ class VideoBatchDecoder:
         del self.decoder
 
 
+class EncodeStream:
+    """
+    One clip being encoded by a pooled session, fed with frames from `VideoMemoryEncoder.prepare()`.
+    """
+
+    def __init__(self, encoder: "VideoMemoryEncoder", sink, buffer: BufferSink = None):
+        self.encoder = encoder
+        self.file = sink
+        self.buffer = buffer
+        self.session = encoder.pool.acquire(sink)
+
+    def __call__(self, frame: torch.Tensor):
+        self.session(frame)
+
+    def finish(self):
+        """
+        :return: Whatever the sink returns on close, the filename of a FileSink or a memoryview of the BufferSink.
+        """
+        self.session.finish()
+        self.encoder.pool.release(self.session)
+        self.session = None
+
+        file = self.file.close()
+        if self.buffer is not None:
+            # Reused by a later clip, the view stays valid until then.
+            self.encoder.buffers.append(self.buffer)
+        return file
+
+
 class VideoMemoryEncoder:
     def __init__(
         self,
@@ -103,7 +231,14 @@ class VideoMemoryEncoder:
         device_id: int,
         cuda_ctx,
         cuda_stream,
+        pixel_format: str = "rgb",
+        max_sessions: int = 1,
     ):
+        """
+        :param pixel_format: Pixel format of the frames fed to the encoder, `rgb` or `nv12` as yielded by the decoder.
+            NV12 frames passed through by the decoder are accepted in either case.
+        :param max_sessions: Clips encoded at the same time through `open()`, see `utils.fanout_utils.ClipFanout`.
+        """
         self.device_id = device_id
         self.cuda_ctx = cuda_ctx
         self.cuda_stream = cuda_stream
@@ -112,34 +247,66 @@ class VideoMemoryEncoder:
         self.height = height
         self.fps = fps
         self.batch_size = batch_size
+        self.pixel_format = pixel_format
+        self.max_sessions = max_sessions
         assert batch_size == 1
+        assert pixel_format in ("rgb", "nv12")
 
-        self.file = None
+        self.buffers = []
+        self.stream = None
+        self.pool = EncoderPool(self.create_session, max_idle=max(max_sessions, 2))
 
-        self.encoder = None
+    def create_session(self, sink) -> NVVCVideoEncoder:
+        return NVVCVideoEncoder(sink, self.device_id, self.width, self.height, self.fps, self.cuda_ctx, self.cuda_stream)
 
-    def initialize(self):
-        self.file = io.BytesIO()
+    def open(self, sink=None) -> EncodeStream:
+        """
+        Start encoding a clip into `sink`, by default into a BufferSink reused across clips. Several clips may be
+        open at the same time, each on its own session.
+        """
+        buffer = None
+        if sink is None:
+            buffer = self.buffers.pop() if self.buffers else BufferSink()
+            sink = buffer.reset()
+        return EncodeStream(self, sink, buffer)
 
-        self.encoder = NVVCVideoEncoder(
-            self.file, self.device_id, self.width, self.height, self.fps, self.cuda_ctx, self.cuda_stream
-        )
-
-    def __call__(self, cvcuda_RGBtensor):
-        cvcuda_YUVtensor = cvcuda.cvtcolor(
-            cvcuda_RGBtensor,
-            cvcuda.ColorConversion.RGB2YUV_NV12,
-        )
+    def prepare(self, cvcuda_tensor) -> torch.Tensor:
+        """
+        Convert a frame as yielded by the decoder to the NV12 tensor the sessions take, once for all open clips.
+        """
+        # NV12 frames have a single channel of 3 / 2 times the height.
+        if self.pixel_format == "nv12" or cvcuda_tensor.shape[3] == 1:
+            cvcuda_YUVtensor = cvcuda_tensor
+        else:
+            cvcuda_YUVtensor = cvcuda.cvtcolor(
+                cvcuda_tensor,
+                cvcuda.ColorConversion.RGB2YUV_NV12,
+            )
         cvcuda_YUVtensor = cvcuda.reformat(cvcuda_YUVtensor, "NCHW")
 
-        self.encoder(torch.as_tensor(cvcuda_YUVtensor.cuda(), device=f"cuda:{self.device_id}").squeeze(0, 1))
+        return torch.as_tensor(cvcuda_YUVtensor.cuda(), device=f"cuda:{self.device_id}").squeeze(0, 1)
 
-    def finish(self):
-        self.encoder.finish()
+    def initialize(self, sink=None):
+        """
+        :param sink: Receives the encoded packets as they come, e.g. a FileSink. By default they are collected in
+            a BufferSink reused across clips, and finish() returns a view of it.
+        The encoder session of the previous clip is reused, see `EncoderPool`.
+        """
+        self.stream = self.open(sink)
 
-        file = self.file.getvalue()
-        self.file.close()
+    def __call__(self, cvcuda_tensor):
+        self.stream(self.prepare(cvcuda_tensor))
 
-        del self.file
-        del self.encoder
+    def finish(self):
+        """
+        :return: Whatever the sink returns on close, the filename of a FileSink or a memoryview of the BufferSink.
+        """
+        file = self.stream.finish()
+        self.stream = None
         return file
+
+    def close(self):
+        """
+        Close the pooled encoder sessions.
+        """
+        self.pool.close()
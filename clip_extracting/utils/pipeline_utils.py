@@ -0,0 +1,265 @@
+import asyncio
+import inspect
+import logging
+import pickle
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Iterable, List, Optional, Sequence
+
+EXECUTORS = ("thread", "process", "asyncio")
+
+# End of stream marker passed between stages.
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a Pipeline: `fn` maps an item to the item passed on, or None to drop it. With `expand`, it returns an
+    iterable of items instead, e.g. the clips of a video.
+    :param workers: Items processed at the same time.
+    :param executor: `thread` runs `fn` in threads, `process` in a process pool (`fn` and the items must be
+        picklable), `asyncio` runs `fn` in an event loop of its own, awaiting a coroutine function and moving a plain
+        function to a thread.
+    :param queue_size: Items waiting for this stage before the previous one blocks, 2 per worker by default.
+    :param executors: Executors `fn` supports, e.g. only `thread` for a stage holding a CUDA context.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable,
+        workers: int = 1,
+        executor: str = "thread",
+        queue_size: Optional[int] = None,
+        expand: bool = False,
+        executors: Sequence[str] = EXECUTORS,
+    ):
+        assert executor in EXECUTORS, f"Unknown executor {executor}."
+        if executor not in executors:
+            raise ValueError(f"Stage '{name}' only supports the executors {tuple(executors)}, not '{executor}'.")
+        if executor == "process":
+            try:
+                pickle.dumps(fn)
+            except Exception as e:
+                raise ValueError(f"Stage '{name}' cannot run in a process pool, its function is not picklable.") from e
+        assert workers >= 1
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.executor = executor
+        self.queue_size = queue_size or 2 * workers
+        self.expand = expand
+
+        self.inbox = None
+        self.outbox = None
+        self.pool = None
+        self.lock = threading.Lock()
+        self.running = 0
+
+        self.items_in = 0
+        self.items_out = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.idle = 0.0
+        self.blocked = 0.0
+        self.wall = 0.0
+
+    def account(self, **seconds) -> None:
+        with self.lock:
+            for key, value in seconds.items():
+                setattr(self, key, getattr(self, key) + value)
+
+    def get(self):
+        start_time = time.time()
+        item = self.inbox.get()
+        self.account(idle=time.time() - start_time)
+        if item is _DONE:
+            # Leave the marker for the other workers of this stage.
+            self.inbox.put(_DONE)
+        return item
+
+    def put(self, result) -> None:
+        """
+        Pass the result of one item on, blocking while the next stage is full.
+        """
+        results = [] if result is None else (result if self.expand else [result])
+        for item in results:
+            if item is None:
+                continue
+            start_time = time.time()
+            self.outbox.put(item)
+            self.account(blocked=time.time() - start_time, items_out=1)
+
+    def failed(self, item) -> None:
+        logging.exception(f"Stage '{self.name}' failed on {item!r}.")
+        self.account(errors=1)
+
+    def run_thread(self, call: Callable[[Any], Any]) -> None:
+        while True:
+            item = self.get()
+            if item is _DONE:
+                return
+            self.account(items_in=1)
+            start_time = time.time()
+            try:
+                result = call(item)
+            except Exception:
+                self.failed(item)
+                continue
+            finally:
+                self.account(busy=time.time() - start_time)
+            self.put(result)
+
+    async def run_task(self) -> None:
+        while True:
+            item = await asyncio.to_thread(self.get)
+            if item is _DONE:
+                return
+            self.account(items_in=1)
+            start_time = time.time()
+            try:
+                if inspect.iscoroutinefunction(self.fn):
+                    result = await self.fn(item)
+                else:
+                    result = await asyncio.to_thread(self.fn, item)
+            except Exception:
+                self.failed(item)
+                continue
+            finally:
+                self.account(busy=time.time() - start_time)
+            await asyncio.to_thread(self.put, result)
+
+    async def run_tasks(self) -> None:
+        await asyncio.gather(*[self.run_task() for _ in range(self.workers)])
+
+    def start(self) -> List[threading.Thread]:
+        """
+        Start the workers of the stage, the returned threads end once the input is exhausted.
+        """
+        if self.executor == "asyncio":
+            targets = [lambda: asyncio.run(self.run_tasks())]
+        elif self.executor == "process":
+            pool = ProcessPoolExecutor(self.workers)
+            targets = [lambda: self.run_thread(lambda item: pool.submit(self.fn, item).result())] * self.workers
+            self.pool = pool
+        else:
+            targets = [lambda: self.run_thread(self.fn)] * self.workers
+
+        start_time = time.time()
+
+        def worker(target):
+            try:
+                target()
+            finally:
+                with self.lock:
+                    self.running -= 1
+                    last = self.running == 0
+                if last:
+                    self.wall = time.time() - start_time
+                    if self.executor == "process":
+                        self.pool.shutdown()
+                    self.outbox.put(_DONE)
+
+        self.running = len(targets)
+        threads = [threading.Thread(target=worker, args=(target,), daemon=True) for target in targets]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def stats(self) -> dict:
+        with self.lock:
+            capacity = self.wall * self.workers
+            return {
+                "stage": self.name,
+                "executor": self.executor,
+                "workers": self.workers,
+                "items_in": self.items_in,
+                "items_out": self.items_out,
+                "errors": self.errors,
+                "busy": self.busy,
+                "idle": self.idle,
+                "blocked": self.blocked,
+                "utilization": self.busy / capacity if capacity > 0 else 0.0,
+            }
+
+
+class Pipeline:
+    """
+    Stages connected by bounded queues, each with its own workers: a full queue blocks the stage feeding it, so a
+    slow stage throttles everything upstream instead of letting items pile up.
+    Every stage accounts the time its workers spend in `fn` (busy), waiting for input (idle) and waiting for room
+    downstream (blocked). The busiest stage relative to its worker count is the bottleneck.
+    A failing item is logged and dropped, the others go on.
+    """
+
+    def __init__(self, stages: List[Stage]):
+        assert len(stages) > 0
+        self.stages = stages
+        self.results = queue.Queue()
+
+    def run(self, items: Iterable, on_result: Optional[Callable[[Any], None]] = None) -> List[dict]:
+        """
+        Feed `items` into the first stage and wait until all of them went through.
+        :param on_result: Called with every item coming out of the last stage.
+        :return: The stats of every stage.
+        """
+        for stage in self.stages:
+            stage.inbox = queue.Queue(stage.queue_size)
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            stage.outbox = next_stage.inbox
+        self.stages[-1].outbox = self.results
+
+        threads = []
+        for stage in self.stages:
+            threads.extend(stage.start())
+
+        def feed():
+            for item in items:
+                self.stages[0].inbox.put(item)
+            self.stages[0].inbox.put(_DONE)
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+        while True:
+            result = self.results.get()
+            if result is _DONE:
+                break
+            if on_result is not None:
+                on_result(result)
+
+        feeder.join()
+        for thread in threads:
+            thread.join()
+        return [stage.stats() for stage in self.stages]
+
+    @staticmethod
+    def report(stats: List[dict]) -> None:
+        for s in stats:
+            logging.info(
+                f"Stage '{s['stage']}' ({s['workers']} {s['executor']}): {s['items_in']} in, {s['items_out']} out, "
+                f"{s['errors']} failed, busy {s['busy']:.1f}s, idle {s['idle']:.1f}s, blocked {s['blocked']:.1f}s, "
+                f"utilization {s['utilization']:.1%}."
+            )
+        bottleneck = max(stats, key=lambda s: s["utilization"])
+        logging.info(f"Bottleneck: '{bottleneck['stage']}' at {bottleneck['utilization']:.1%} utilization.")
+
+
+def parse_stage_option(option: str) -> dict:
+    """
+    Parse `name=workers[:executor[:queue_size]]`, e.g. `fetch=4:thread:8`, into Stage keyword overrides.
+    """
+    name, _, spec = option.partition("=")
+    fields = spec.split(":") if spec else []
+    overrides = {"name": name}
+    if len(fields) > 0 and fields[0]:
+        overrides["workers"] = int(fields[0])
+    if len(fields) > 1 and fields[1]:
+        if fields[1] not in EXECUTORS:
+            raise ValueError(f"Unknown executor '{fields[1]}' in '{option}', expected one of {EXECUTORS}.")
+        overrides["executor"] = fields[1]
+    if len(fields) > 2 and fields[2]:
+        overrides["queue_size"] = int(fields[2])
+    return overrides
@@ -0,0 +1,148 @@
+import csv
+import heapq
+import json
+import logging
+import os
+from collections import defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+
+def parse_sekai_csv(filename: str) -> Dict[str, List[Tuple[int, int]]]:
+    """
+    Read the clips of every video from a sekai annotation csv, whose first column is `<vid>_<s>_<e>.mp4`.
+    """
+    vid2clips = defaultdict(list)
+
+    with open(filename, "r") as f:
+        csv_reader = csv.reader(f)
+        for idx, line in enumerate(csv_reader):
+            if idx == 0:
+                continue
+            vid, s_frame, e_frame = os.path.splitext(line[0])[0].rsplit("_", 2)
+            vid2clips[vid].append((int(s_frame), int(e_frame)))
+
+    return {vid: sorted(clips) for vid, clips in vid2clips.items()}
+
+
+def url_to_vid(url: str) -> str:
+    return url.rsplit("v=", 1)[-1].split("&", 1)[0]
+
+
+class CostModel:
+    """
+    Per-video processing time estimated from the clip ranges alone, before anything is downloaded:
+    `overhead + decode_frames / decode_fps + encode_frames / encode_fps` seconds, where the decode span runs from
+    frame 0 to the end of the last clip at the source frame rate and the encode workload is the total clip length.
+    """
+
+    def __init__(
+        self,
+        s_fps: float = 60.0,
+        t_fps: float = 30.0,
+        decode_fps: float = 600.0,
+        encode_fps: float = 300.0,
+        overhead: float = 0.0,
+    ):
+        self.s_fps = s_fps
+        self.t_fps = t_fps
+        self.decode_fps = decode_fps
+        self.encode_fps = encode_fps
+        self.overhead = overhead
+
+    def workload(self, clips: Sequence[Tuple[int, int]]) -> Tuple[float, float]:
+        if len(clips) == 0:
+            return 0.0, 0.0
+        decode_frames = max(e for _, e in clips) * self.s_fps / self.t_fps
+        encode_frames = float(sum(e - s for s, e in clips))
+        return decode_frames, encode_frames
+
+    def cost(self, clips: Sequence[Tuple[int, int]]) -> float:
+        decode_frames, encode_frames = self.workload(clips)
+        return self.overhead + decode_frames / self.decode_fps + encode_frames / self.encode_fps
+
+    def refine(self, report_file: str, clip_index) -> None:
+        """
+        Fit the throughputs and the per-video overhead to the observed seconds of a prior run report, a JSON-lines
+        file with a `vid` (or `url`) and a `seconds` field per video. Keeps the current estimate if the fit is
+        degenerate.
+        """
+        rows, seconds = [], []
+        with open(report_file, "r") as f:
+            for line in f:
+                record = json.loads(line)
+                vid = record.get("vid") or url_to_vid(record["url"])
+                if vid not in clip_index:
+                    continue
+                rows.append((1.0, *self.workload(clip_index[vid])))
+                seconds.append(record["seconds"])
+
+        if len(rows) < 3:
+            logging.warning(f"Only {len(rows)} usable record(s) in '{report_file}', keep the default cost model.")
+            return
+
+        (overhead, decode_spf, encode_spf), *_ = np.linalg.lstsq(np.array(rows), np.array(seconds), rcond=None)
+        if decode_spf <= 0 or encode_spf <= 0:
+            # Collinear or noisy workloads, fall back to one rate over all frames.
+            frames = np.array(rows)[:, 1:].sum()
+            spf = sum(seconds) / frames if frames > 0 else 0.0
+            if spf <= 0:
+                return
+            overhead, decode_spf, encode_spf = 0.0, spf, spf
+
+        self.overhead = max(float(overhead), 0.0)
+        self.decode_fps = 1.0 / decode_spf
+        self.encode_fps = 1.0 / encode_spf
+        logging.info(
+            f"Refined cost model from {len(rows)} videos: overhead {self.overhead:.1f}s, "
+            f"decode {self.decode_fps:.0f} fps, encode {self.encode_fps:.0f} fps."
+        )
+
+
+def lpt_assign(costs: Dict[str, float], num_bins: int) -> List[List[str]]:
+    """
+    Longest-processing-time-first assignment: each video, in decreasing cost order, goes to the least loaded bin.
+    Each bin keeps its videos longest-first.
+    """
+    bins = [[] for _ in range(num_bins)]
+    loads = [(0.0, idx) for idx in range(num_bins)]
+    for vid in sorted(costs, key=lambda vid: (-costs[vid], vid)):
+        load, idx = heapq.heappop(loads)
+        bins[idx].append(vid)
+        heapq.heappush(loads, (load + costs[vid], idx))
+    return bins
+
+
+def plan_videos(
+    vid2clips: Dict[str, Sequence[Tuple[int, int]]],
+    model: CostModel,
+    num_shards: int = 1,
+    shard_id: int = 0,
+) -> List[str]:
+    """
+    Videos of one shard (node, GPU or worker group), ordered longest-first.
+    Feeding this order to a shared work queue makes the workers follow LPT list scheduling.
+    """
+    costs = {vid: model.cost(clips) for vid, clips in vid2clips.items()}
+    bins = lpt_assign(costs, num_shards)
+
+    loads = [sum(costs[vid] for vid in b) for b in bins]
+    logging.info(
+        f"Planned {len(costs)} videos into {num_shards} shard(s), estimated load "
+        f"{min(loads):.0f}s - {max(loads):.0f}s per shard."
+    )
+    return bins[shard_id]
+
+
+def order_urls_by_cost(urls: Sequence[str], clip_index, report_file: str = None) -> List[str]:
+    """
+    Reorder YouTube URLs longest-first by the estimated cost of their clips. URLs without clips go last.
+    """
+    model = CostModel()
+    if report_file is not None:
+        model.refine(report_file, clip_index)
+
+    costs = [model.cost(clip_index[url_to_vid(url)]) if url_to_vid(url) in clip_index else 0.0 for url in urls]
+    order = sorted(range(len(urls)), key=lambda idx: -costs[idx])
+    return [urls[idx] for idx in order]
@@ -0,0 +1,115 @@
+import heapq
+import os
+from typing import Optional, Union
+
+import av
+
+from utils.hevc_utils import presentation_order
+
+
+class ClipRemuxer:
+    """
+    In-process counterpart of the per-clip `ffmpeg -c copy -t 60 -movflags +faststart -vtag hvc1` calls of
+    4_remix_to_files.py, built on PyAV. One instance serves all clips of a video: an AAC source stream (`.m4a`) is
+    opened once and every clip copies its packets from it, other audio is taken from per-clip AAC files.
+    Packets are copied without decoding, the `max_duration` cap drops every packet starting at or after it.
+    """
+
+    def __init__(
+        self,
+        astream_filename: Optional[str] = None,
+        fps: Union[int, float] = 30,
+        max_duration: Optional[float] = 60,
+    ):
+        self.fps = fps
+        self.max_duration = max_duration
+
+        self.source = None
+        if astream_filename is not None and astream_filename.endswith(".m4a"):
+            self.source = av.open(astream_filename)
+
+    def remux(
+        self,
+        vstream_filename: str,
+        clip_filename: str,
+        start_frame: int,
+        end_frame: int,
+        astream_filename: Optional[str] = None,
+    ) -> str:
+        """
+        Mux a raw HEVC stream and its audio into `clip_filename`, through a temporary file renamed into place.
+        :param astream_filename: Per-clip AAC file, used if the remuxer has no source stream of its own.
+        """
+        containers = [av.open(vstream_filename, format="hevc", options={"framerate": str(self.fps)})]
+        output = av.open(clip_filename + ".tmp", "w", format="mp4", options={"movflags": "+faststart"})
+        try:
+            vstream = containers[0].streams.video[0]
+            out_vstream = output.add_stream_from_template(vstream)
+            out_vstream.codec_tag = "hvc1"
+            vpackets = [packet for packet in containers[0].demux(vstream) if packet.size > 0]
+            self.stamp(vpackets, vstream)
+            streams = [self.iter_packets(vpackets, vstream, out_vstream, 0.0)]
+
+            if self.source is not None:
+                astream = self.source.streams.audio[0]
+                start_time, end_time = start_frame / self.fps, end_frame / self.fps
+                # Start from the packet at or before the clip start, its leading samples end up before zero and are
+                # trimmed by the edit list of the muxer, as with `ffmpeg -ss` and stream copy.
+                self.source.seek(int(start_time / astream.time_base), stream=astream, backward=True)
+                out_astream = output.add_stream_from_template(astream)
+                streams.append(self.iter_packets(self.source.demux(astream), astream, out_astream, start_time, end_time))
+            elif astream_filename is not None:
+                containers.append(av.open(astream_filename))
+                astream = containers[-1].streams.audio[0]
+                out_astream = output.add_stream_from_template(astream)
+                streams.append(self.iter_packets(containers[-1].demux(astream), astream, out_astream, 0.0))
+
+            for _, _, packet in heapq.merge(*streams, key=lambda item: item[:2]):
+                output.mux(packet)
+        finally:
+            output.close()
+            for container in containers:
+                container.close()
+        os.replace(clip_filename + ".tmp", clip_filename)
+        return clip_filename
+
+    def stamp(self, packets, stream) -> None:
+        """
+        Set the timestamps of raw HEVC packets, which carry none. The pts follows the presentation order of the
+        pictures, from their picture order counts, so that streams with B-frames keep their display order. The dts
+        follows the decode order, delayed by the reorder depth so that no picture is decoded after it is shown.
+        """
+        duration = round(1 / (self.fps * stream.time_base))
+        ranks = presentation_order([bytes(packet) for packet in packets])
+        delay = max((idx - rank for idx, rank in enumerate(ranks)), default=0)
+        for idx, (packet, rank) in enumerate(zip(packets, ranks)):
+            packet.pts, packet.dts, packet.duration = rank * duration, (idx - delay) * duration, duration
+
+    def iter_packets(self, packets, stream, out_stream, start_time: float, end_time: Optional[float] = None):
+        """
+        Yield (dts in seconds, stream index, packet) for the packets of one stream, shifted by `start_time` and
+        retargeted to `out_stream`, in the order the muxer interleaves them.
+        """
+        offset = round(start_time / stream.time_base)
+        next_dts = 0
+        for packet in packets:
+            if packet.size == 0:
+                continue
+            if packet.dts is None:
+                packet.dts = next_dts
+            next_dts = packet.dts + packet.duration
+            pts = packet.pts if packet.pts is not None else packet.dts
+            if end_time is not None and pts * stream.time_base >= end_time:
+                break
+            if pts + packet.duration <= offset:
+                continue
+            if self.max_duration is not None and (pts - offset) * stream.time_base >= self.max_duration:
+                break
+            packet.pts, packet.dts = pts - offset, packet.dts - offset
+            packet.stream = out_stream
+            yield float(packet.dts * stream.time_base), out_stream.index, packet
+
+    def close(self) -> None:
+        if self.source is not None:
+            self.source.close()
+            self.source = None
@@ -1,7 +1,10 @@
 # https://superuser.com/questions/843292/ffmpeg-how-does-ffmpeg-decide-which-frames-to-pick-when-fps-value-is-specified
-from typing import Union
+import functools
+from fractions import Fraction
+from typing import Optional, Tuple, Union
 
 import bitarray
+import numpy as np
 
 
 class RecurrentBitQueue:
@@ -58,7 +61,71 @@ class EMDownSampler:
 
         return _res
 
+    def mask(self, n_frames: int) -> np.ndarray:
+        """
+        Keep/drop plan of the first `n_frames` source frames, bit-exact with iterating a fresh sampler.
+        The plan of an fps pair is a warm-up followed by one cycle repeating forever, both computed once per pair
+        and cached, so the plan of a whole video is built with array operations only.
+        """
+        head, cycle = _periodic_plan(self.s_fps, self.t_fps)
+        if cycle is None:
+            return _simulate(self.s_fps, self.t_fps, n_frames)
+        if n_frames <= len(head):
+            return head[:n_frames].copy()
+        return np.concatenate([head, np.resize(cycle, n_frames - len(head))])
+
     def __iter__(self):
         while True:
             yield self.test_and_set()
             self._frame_idx += 1
+
+
+def _simulate(s_fps: Union[int, float], t_fps: Union[int, float], n_frames: int) -> np.ndarray:
+    """
+    Decisions of a fresh EMDownSampler on `n_frames` frames, with the windows tracked as running sums.
+    """
+    flags = np.zeros(n_frames, dtype=bool)
+
+    sizes = [round(s_fps * s) - 1 for s in [0.5, 1.0, 3.0]]
+    counts = [0 for _ in sizes]
+    for idx in range(n_frames):
+        # test
+        _margins_a, _margins_b = [], []
+        for size, count in zip(sizes, counts):
+            _tmp = s_fps * count - t_fps * (min(idx, size) + 1)
+            _margins_a.append(abs(_tmp))
+            _margins_b.append(abs(_tmp + s_fps))
+        _res = sum(_margins_a) > sum(_margins_b)
+
+        # set
+        flags[idx] = _res
+        for k, size in enumerate(sizes):
+            counts[k] += _res
+            if idx >= size:
+                counts[k] -= flags[idx - size]
+
+    return flags
+
+
+@functools.lru_cache(maxsize=None)
+def _periodic_plan(s_fps: Union[int, float], t_fps: Union[int, float]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Warm-up and repeating cycle of the plan of an fps pair, or the simulated frames and None if no cycle was found.
+    A decision only depends on the last `history` decisions once all windows are full, so the plan repeats from the
+    first frame whose history equals the one a cycle earlier. Cycles are searched among the multiples of the period
+    of t_fps / s_fps, rounding of non-integer rates such as 59.94 can stretch the cycle to a multiple of it.
+    """
+    history = round(s_fps * 3.0) - 1
+    period = Fraction(t_fps / s_fps).limit_denominator(65536).denominator
+    flags = _simulate(s_fps, t_fps, history + 16 * period)
+    for cycle in range(period, 8 * period + 1, period):
+        # mismatch[i] tells whether frame i + cycle differs from frame i, a cycle starts at the first frame
+        # `idx` >= history + cycle preceded by `history` matching frames.
+        mismatch = np.concatenate([[0], np.cumsum(flags[cycle:] != flags[:-cycle])])
+        starts = np.arange(history, len(flags) - cycle + 1)
+        matched = np.flatnonzero(mismatch[starts] == mismatch[starts - history])
+        if len(matched) > 0:
+            idx = starts[matched[0]] + cycle
+            flags.flags.writeable = False
+            return flags[:idx], flags[idx - cycle : idx]
+    return flags, None
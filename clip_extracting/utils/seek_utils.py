@@ -0,0 +1,80 @@
+import math
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.sampler_utils import EMDownSampler
+
+
+def source_frame_index(sampler: EMDownSampler, n_frames: int) -> np.ndarray:
+    """
+    Source frame index of each of the first `n_frames` frames kept by the sampler.
+    """
+    n_source = max(65536, math.ceil(n_frames * sampler.s_fps / sampler.t_fps) + 1)
+    while True:
+        kept = np.flatnonzero(sampler.mask(n_source))
+        if len(kept) >= n_frames:
+            return kept[:n_frames]
+        n_source *= 2
+
+
+def clip_frame_mask(clips: Sequence[Tuple[int, int]]) -> np.ndarray:
+    """
+    Whether each target-fps frame up to the end of the last clip falls inside any clip [s, e).
+    """
+    wanted = np.zeros(max((e for _, e in clips), default=0), dtype=bool)
+    for s, e in clips:
+        wanted[s:e] = True
+    return wanted
+
+
+def plan_seek_segments(
+    clips: Sequence[Tuple[int, int]], kept: np.ndarray, keyframes: np.ndarray
+) -> List[Tuple[int, int]]:
+    """
+    Translate target-fps clips to source frame spans [start, stop), each starting at the keyframe preceding its
+    first clip. Spans whose keyframe falls before the end of the previous span are merged and decoded linearly.
+    """
+    keyframes = np.union1d([0], keyframes)
+
+    segments = []
+    for s, e in sorted(clips):
+        src_s, src_e = int(kept[s]), int(kept[e - 1]) + 1
+        seek = int(keyframes[np.searchsorted(keyframes, src_s, side="right") - 1])
+        if segments and seek <= segments[-1][1]:
+            segments[-1][1] = max(segments[-1][1], src_e)
+        else:
+            segments.append([seek, src_e])
+
+    return [(a, b) for a, b in segments]
+
+
+def iter_seek_frames(
+    frames: Iterable[Tuple[int, Any]],
+    sampler: EMDownSampler,
+    n_source: int,
+    process: Callable = lambda frame: frame,
+    wanted: Optional[np.ndarray] = None,
+):
+    """
+    Yield the target-fps frames of a seek plan, indexed exactly like a linear pass: every decoded frame the sampler
+    keeps is yielded through `process`, and None stands in for each kept frame that was never decoded.
+    :param frames: (source frame index, frame) pairs in increasing order, e.g. the spans of a seek plan.
+    :param n_source: Number of source frames covered by the plan.
+    :param wanted: Target-fps frames to be processed, see `clip_frame_mask`. Other decoded frames, e.g. those between
+        a keyframe and the clip start, are yielded as None too.
+    """
+    mask = sampler.mask(n_source)
+    target = np.cumsum(mask) - 1
+
+    frame_idx = 0
+    for src_idx, frame in frames:
+        if mask[src_idx]:
+            while frame_idx < target[src_idx]:
+                yield None
+                frame_idx += 1
+            if wanted is None or (frame_idx < len(wanted) and wanted[frame_idx]):
+                yield process(frame)
+            else:
+                yield None
+            frame_idx += 1
@@ -0,0 +1,144 @@
+import glob
+import io
+import json
+import os
+import re
+import tarfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from utils.journal_utils import atomic_write
+
+SHARD_FORMAT = "shard-{:06d}.tar"
+
+
+def clip_key(vid: str, clip: Tuple[int, int]) -> str:
+    """
+    WebDataset sample key of a clip, same as the stem of its per-clip file.
+    """
+    return f"{vid}_{clip[0]:07d}_{clip[1]:07d}"
+
+
+def parse_clip_key(key: str) -> Tuple[str, Tuple[int, int]]:
+    vid, s, e = key.rsplit("_", 2)
+    return vid, (int(s), int(e))
+
+
+class ShardWriter:
+    """
+    Pack clips and their sidecars into fixed-size tar shards, WebDataset style: every member is named
+    `<key>.<ext>`, and the members of one sample are stored next to each other.
+    A shard is written as `shard-XXXXXX.tar.tmp` and rotated once it exceeds `max_size` bytes or `max_count`
+    samples. On rotation its byte-offset index `shard-XXXXXX.json` is written, then the tar is renamed into place,
+    so only complete shards ever carry the final name. `on_finalize(shard_filename, keys)` is called after that,
+    e.g. to mark the clips as finished in the journal.
+    Threads may share a ShardWriter.
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        max_size: int = 1 << 30,
+        max_count: Optional[int] = None,
+        on_finalize: Optional[Callable[[str, List[str]], None]] = None,
+        prefix: str = "",
+    ):
+        """
+        :param prefix: Prefix of the shard filenames, to let several processes write into one dir.
+        """
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.max_size = max_size
+        self.max_count = max_count
+        self.on_finalize = on_finalize
+        self.lock = threading.Lock()
+
+        os.makedirs(output_dir, exist_ok=True)
+        # Continue after the highest shard of a previous run, even if earlier shards were moved away since, so that a
+        # finalized shard is never overwritten. Leftover .tmp shards are incomplete and get overwritten.
+        pattern = re.compile(re.escape(prefix) + r"shard-(\d+)\.(?:tar|json)")
+        indices = [int(m.group(1)) for m in map(pattern.fullmatch, os.listdir(output_dir)) if m is not None]
+        self.shard_idx = max(indices, default=-1) + 1
+
+        self.tar = None
+        self.filename = None
+        self.index = None
+
+    def open_shard(self) -> None:
+        self.filename = os.path.join(self.output_dir, self.prefix + SHARD_FORMAT.format(self.shard_idx))
+        self.tar = tarfile.open(self.filename + ".tmp", "w", format=tarfile.USTAR_FORMAT)
+        self.index = {}
+        self.shard_idx += 1
+
+    def write(self, key: str, members: Dict[str, Union[bytes, str]]) -> None:
+        """
+        Add one sample to the current shard.
+        :param members: Maps extensions, e.g. `mp4`, `m4a` or `json`, to the member data or to a file to copy.
+        """
+        with self.lock:
+            if self.tar is None:
+                self.open_shard()
+
+            self.index[key] = {}
+            for ext, data in members.items():
+                info = tarfile.TarInfo(f"{key}.{ext}")
+                info.mtime = int(time.time())
+                offset = self.tar.offset + len(info.tobuf(self.tar.format, self.tar.encoding, self.tar.errors))
+                if isinstance(data, str):
+                    info.size = os.path.getsize(data)
+                    with open(data, "rb") as f:
+                        self.tar.addfile(info, f)
+                else:
+                    info.size = len(data)
+                    self.tar.addfile(info, io.BytesIO(data))
+                self.index[key][ext] = [offset, info.size]
+
+            if self.tar.offset >= self.max_size or (self.max_count is not None and len(self.index) >= self.max_count):
+                self.finalize_shard()
+
+    def finalize_shard(self) -> None:
+        if self.tar is None:
+            return
+        self.tar.close()
+        with open(self.filename + ".tmp", "rb+") as f:
+            os.fsync(f.fileno())
+
+        atomic_write(self.filename[: -len(".tar")] + ".json", json.dumps(self.index).encode())
+        os.replace(self.filename + ".tmp", self.filename)
+
+        filename, keys = self.filename, list(self.index)
+        self.tar, self.filename, self.index = None, None, None
+        if self.on_finalize is not None:
+            self.on_finalize(filename, keys)
+
+    def close(self) -> None:
+        with self.lock:
+            self.finalize_shard()
+
+
+class ShardReader:
+    """
+    Random access to single members of finalized shards through their byte-offset indices.
+    """
+
+    def __init__(self, shard_dir: str):
+        self.shard_dir = shard_dir
+        self.key2shard = {}
+        for tar_filename in sorted(glob.glob(os.path.join(shard_dir, "*shard-*.tar"))):
+            with open(tar_filename[: -len(".tar")] + ".json", "r") as f:
+                for key, members in json.load(f).items():
+                    self.key2shard[key] = (tar_filename, members)
+
+    def keys(self) -> List[str]:
+        return list(self.key2shard)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.key2shard
+
+    def read(self, key: str, ext: str) -> bytes:
+        tar_filename, members = self.key2shard[key]
+        offset, size = members[ext]
+        with open(tar_filename, "rb") as f:
+            f.seek(offset)
+            return f.read(size)
@@ -0,0 +1,54 @@
+import os
+
+
+class BufferSink:
+    """
+    Growable in-memory bitstream sink, reused across clips so that a session keeps one buffer of the largest clip
+    instead of allocating and copying a new one per clip.
+    close() returns a memoryview of the written bytes without copying them. It stays valid until the next reset(),
+    so consume it before the next clip starts.
+    """
+
+    def __init__(self, capacity: int = 64 << 20):
+        self.buffer = bytearray(capacity)
+        self.size = 0
+
+    def reset(self) -> "BufferSink":
+        self.size = 0
+        return self
+
+    def write(self, data) -> int:
+        data = memoryview(data).cast("B")
+        end = self.size + data.nbytes
+        if end > len(self.buffer):
+            # Allocate a new buffer instead of resizing, which fails while a view of the old one is still alive.
+            buffer = bytearray(max(end, 2 * len(self.buffer)))
+            buffer[: self.size] = memoryview(self.buffer)[: self.size]
+            self.buffer = buffer
+        self.buffer[self.size : end] = data
+        self.size = end
+        return data.nbytes
+
+    def close(self) -> memoryview:
+        return memoryview(self.buffer)[: self.size]
+
+
+class FileSink:
+    """
+    Bitstream sink streaming straight into a temporary file next to `filename`, which close() syncs and renames into
+    place, so a crash never leaves a truncated file.
+    """
+
+    def __init__(self, filename: str, buffering: int = 1 << 20):
+        self.filename = filename
+        self.file = open(filename + ".tmp", "wb", buffering=buffering)
+
+    def write(self, data) -> int:
+        return self.file.write(data)
+
+    def close(self) -> str:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.filename + ".tmp", self.filename)
+        return self.filename
@@ -0,0 +1,78 @@
+import collections
+import logging
+import threading
+import time
+from typing import Callable, Iterable, List, Optional
+
+
+class TaskPool:
+    """
+    Threads pulling tasks from one shared deque. A task returns a list of follow-up tasks, which are pushed to the
+    front of the deque so that every idle thread picks them up right away, e.g. the clips of a video whose setup just
+    finished. Compared to a pool over whole videos, a video with many clips no longer keeps one thread busy alone.
+    Records when each thread ran out of work for good, to report the tail where only some threads are busy.
+    """
+
+    def __init__(self, num_workers: int):
+        self.num_workers = num_workers
+        self.tasks = collections.deque()
+        self.cond = threading.Condition()
+        self.running = 0
+        self.error = None
+
+        self.start_time = None
+        self.end_time = None
+        self.idle_times = []
+        self.busy = 0.0
+
+    def run(self, tasks: Iterable[Callable[[], Optional[List[Callable]]]]) -> None:
+        self.tasks.extend(tasks)
+        self.start_time = time.time()
+        threads = [threading.Thread(target=self.worker, daemon=True) for _ in range(self.num_workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def worker(self) -> None:
+        while True:
+            with self.cond:
+                idle_time = time.time() - self.start_time
+                # Wait while others are running, they may still add follow-up tasks.
+                while len(self.tasks) == 0 and self.running > 0 and self.error is None:
+                    self.cond.wait()
+                if len(self.tasks) == 0 or self.error is not None:
+                    # The thread ran out of work for good when it started its last wait.
+                    self.idle_times.append(idle_time)
+                    self.end_time = time.time() - self.start_time
+                    self.cond.notify_all()
+                    return
+                task = self.tasks.popleft()
+                self.running += 1
+
+            task_start = time.time()
+            try:
+                followups = task() or []
+            except BaseException as e:
+                logging.exception("Task failed.")
+                followups = []
+                with self.cond:
+                    self.error = self.error or e
+            with self.cond:
+                self.busy += time.time() - task_start
+                self.running -= 1
+                self.tasks.extendleft(reversed(followups))
+                self.cond.notify_all()
+
+    def report(self) -> dict:
+        """
+        Makespan, the tail from the first thread running out of work to the end, and the mean thread utilization.
+        """
+        makespan = self.end_time
+        return {
+            "makespan": makespan,
+            "tail": makespan - min(self.idle_times),
+            "utilization": self.busy / (makespan * self.num_workers) if makespan > 0 else 1.0,
+        }
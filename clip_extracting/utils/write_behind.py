@@ -0,0 +1,92 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+
+class WriteBehind:
+    """
+    Bounded thread pool that writes finished clips off the decode loop.
+    At most `max_pending` jobs are queued or running, submit() blocks beyond that, so a slow filesystem throttles the
+    decoder instead of piling clip buffers up in memory. The first failed job is re-raised by the next submit() or
+    by close().
+    """
+
+    def __init__(self, num_workers: int = 2, max_pending: int = 8):
+        self.executor = ThreadPoolExecutor(num_workers, thread_name_prefix="write_behind")
+        self.capacity = max_pending
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.error = None
+
+        self.pending = 0
+        self.max_pending = 0
+        self.num_jobs = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.stall_seconds = 0.0
+
+    def submit(self, fn: Callable, *args) -> None:
+        """
+        Run `fn(*args)` in the pool.
+        Buffers in `args` must not be reused by the caller until the job is done, pass a copy if they are.
+        """
+        self.raise_error()
+
+        start_time = time.time()
+        self.slots.acquire()
+        with self.lock:
+            self.stall_seconds += time.time() - start_time
+            self.pending += 1
+            self.max_pending = max(self.max_pending, self.pending)
+        self.executor.submit(self.run, fn, args, time.time())
+
+    def run(self, fn, args, submit_time):
+        try:
+            fn(*args)
+        except BaseException as e:
+            logging.exception("Write-behind job failed.")
+            with self.lock:
+                if self.error is None:
+                    self.error = e
+        finally:
+            latency = time.time() - submit_time
+            with self.lock:
+                self.pending -= 1
+                self.num_jobs += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+            self.slots.release()
+
+    def raise_error(self) -> None:
+        if self.error is not None:
+            raise RuntimeError("Write-behind job failed.") from self.error
+
+    def stats(self) -> dict:
+        """
+        Queue depth (current and peak), write latency from submission to completion, and the time submit() blocked.
+        """
+        with self.lock:
+            return {
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "jobs": self.num_jobs,
+                "mean_latency": self.total_latency / self.num_jobs if self.num_jobs > 0 else 0.0,
+                "max_latency": self.max_latency,
+                "stall_seconds": self.stall_seconds,
+            }
+
+    def flush(self) -> None:
+        """
+        Wait until all submitted jobs are done.
+        """
+        for _ in range(self.capacity):
+            self.slots.acquire()
+        for _ in range(self.capacity):
+            self.slots.release()
+        self.raise_error()
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        self.raise_error()
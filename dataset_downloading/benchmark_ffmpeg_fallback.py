@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+FFmpeg备用方案的性能对比
+逐clip调用ffmpeg (输出端 -ss，每个clip都从头解码) 与单次解码、多clip编码的 process_with_ffmpeg
+两者使用相同的编码器 (libx265)、Lanczos缩放和AAC音频，只比较解码方式
+"""
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "clip_extracting"))
+from utils.ffmpeg_utils import count_video_frames, probe_video  # noqa: E402
+
+from download_and_process_compatible import process_with_ffmpeg  # noqa: E402
+
+
+def process_with_ffmpeg_per_clip(video_path, clips, output_dir, video_id, width=1280, height=720, fps=30):
+    """
+    原来的备用方案：每个clip启动一个ffmpeg进程，-ss 位于 -i 之后
+    编码器、缩放滤镜和音频设置与 process_with_ffmpeg 相同，两者只在解码方式上不同
+    """
+    processed_files = []
+
+    for start_frame, end_frame in clips:
+        start_time = start_frame / fps
+        duration = (end_frame - start_frame) / fps
+
+        output_file = os.path.join(output_dir, f"{video_id}_{start_frame:07d}_{end_frame:07d}.mp4")
+
+        cmd = [
+            "ffmpeg",
+            "-i",
+            video_path,
+            "-ss",
+            str(start_time),
+            "-t",
+            str(duration),
+            "-vf",
+            f"fps={fps},scale={width}:{height}:flags=lanczos",
+            "-c:v",
+            "libx265",
+            "-x265-params",
+            "log-level=error",
+            "-pix_fmt",
+            "yuv420p",
+            "-vtag",
+            "hvc1",
+            "-c:a",
+            "aac",
+            "-ar",
+            "48000",
+            "-ac",
+            "2",
+            "-b:a",
+            "192k",
+            "-movflags",
+            "+faststart",
+            "-y",
+            output_file,
+        ]
+        subprocess.run(cmd, check=True, capture_output=True)
+        processed_files.append(output_file)
+
+    return processed_files
+
+
+def make_clips(duration, fps, num_clips, clip_frames):
+    """在视频中均匀分布 num_clips 个长度为 clip_frames 的clip (目标帧率下的帧号)"""
+    total = int(duration * fps) - 1
+    step = max(total // num_clips, clip_frames)
+    return [(s, s + clip_frames) for s in range(0, total - clip_frames + 1, step)][:num_clips]
+
+
+def run(name, func, video_path, clips, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.time()
+    files = func(video_path, clips, output_dir)
+    elapsed = time.time() - start
+
+    exact = sum(count_video_frames(f) == e - s for f, (s, e) in zip(files, clips))
+    logging.info(
+        f"{name}: {elapsed:.2f}s, {len(files)}/{len(clips)} 个clip, 帧数与clip长度一致 {exact}/{len(files)}"
+    )
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FFmpeg备用方案性能对比")
+    parser.add_argument("--video", "-i", required=True, help="源视频文件")
+    parser.add_argument("--clips", default=None, help="clip文件 (每行 起始帧 结束帧)，默认均匀生成")
+    parser.add_argument("--num-clips", type=int, default=8, help="均匀生成的clip数量 (默认: 8)")
+    parser.add_argument("--clip-frames", type=int, default=60, help="均匀生成的clip帧数 (默认: 60)")
+    parser.add_argument("--width", type=int, default=1280, help="输出视频宽度 (默认: 1280)")
+    parser.add_argument("--height", type=int, default=720, help="输出视频高度 (默认: 720)")
+    parser.add_argument("--fps", type=int, default=30, help="输出视频FPS (默认: 30)")
+    parser.add_argument("--output-dir", "-o", default=None, help="输出目录 (默认: 临时目录)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.output_dir is None:
+        args.output_dir = tempfile.mkdtemp(prefix="ffmpeg_fallback_")
+
+    if args.clips is not None:
+        with open(args.clips, "r") as f:
+            clips = [tuple(map(int, line.split())) for line in f if line.strip()]
+    else:
+        duration = float(
+            subprocess.run(
+                ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", args.video],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        )
+        clips = make_clips(duration, args.fps, args.num_clips, args.clip_frames)
+
+    info = probe_video(args.video)
+    video_id = os.path.splitext(os.path.basename(args.video))[0]
+    logging.info(
+        f"源视频 {info['width']}x{info['height']} @ {info['fps']:.3f}fps, {len(clips)} 个clip, 输出到 {args.output_dir}"
+    )
+
+    per_clip = run(
+        "逐clip ffmpeg",
+        lambda video_path, clips, output_dir: process_with_ffmpeg_per_clip(
+            video_path, clips, output_dir, video_id, args.width, args.height, args.fps
+        ),
+        args.video,
+        clips,
+        os.path.join(args.output_dir, "per_clip"),
+    )
+    single_pass = run(
+        "单次解码",
+        lambda video_path, clips, output_dir: process_with_ffmpeg(
+            video_path, clips, output_dir, video_id, args.width, args.height, args.fps
+        ),
+        args.video,
+        clips,
+        os.path.join(args.output_dir, "single_pass"),
+    )
+    logging.info(f"加速比 {per_clip / single_pass:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,53 @@
 import argparse
 import csv
+import logging
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "clip_extracting"))
+from utils.plan_utils import CostModel, parse_sekai_csv, plan_videos  # noqa: E402
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_file", type=str)
     parser.add_argument("--output_file", type=str, default=None)
+    parser.add_argument(
+        "--order",
+        type=str,
+        default="csv",
+        choices=["csv", "cost"],
+        help="Keep the csv order, or order videos by estimated processing cost, longest first.",
+    )
+    parser.add_argument("--prior_report", type=str, default=None, help="Prior run report to refine the cost model.")
+    parser.add_argument("--num_shards", type=int, default=1, help="Split videos across nodes/GPUs by cost.")
+    parser.add_argument("--shard_id", type=int, default=0)
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.INFO)
+
     if args.output_file is None:
         args.output_file = args.input_file.replace(".csv", "_urls.txt")
+        if args.num_shards > 1:
+            args.output_file = args.output_file.replace(".txt", f"_{args.shard_id}.txt")
+
+    if args.order == "cost" or args.num_shards > 1:
+        vid2clips = parse_sekai_csv(args.input_file)
+
+        model = CostModel()
+        if args.prior_report is not None:
+            model.refine(args.prior_report, vid2clips)
 
-    vids = set()
+        vids = plan_videos(vid2clips, model, args.num_shards, args.shard_id)
+    else:
+        vids = set()
 
-    with open(args.input_file, "r") as f:
-        csv_reader = csv.reader(f)
-        for idx, line in enumerate(csv_reader):
-            if idx == 0:
-                continue
+        with open(args.input_file, "r") as f:
+            csv_reader = csv.reader(f)
+            for idx, line in enumerate(csv_reader):
+                if idx == 0:
+                    continue
 
-            vids.add(os.path.splitext(line[0])[0].rsplit("_", 2)[0])
+                vids.add(os.path.splitext(line[0])[0].rsplit("_", 2)[0])
 
     with open(args.output_file, "x") as f:
         [f.write(f"https://www.youtube.com/watch?v={vid}\n") for vid in vids]
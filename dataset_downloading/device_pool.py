@@ -0,0 +1,192 @@
+"""
+GPU设备池与会话池
+按活跃会话数把工作者分配到负载最低的GPU上，设备出错后其工作转移到其余设备
+同一GPU上的多个线程通过会话池并发使用各自的解码器/编码器
+"""
+
+import contextlib
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# 在独立进程中创建上下文、分配显存并同步，检查GPU本身是否可用
+PROBE_SCRIPT = (
+    "import pycuda.driver as cuda; cuda.init(); ctx = cuda.Device(0).make_context(); "
+    "cuda.mem_alloc(1 << 20); cuda.Context.synchronize(); ctx.pop()"
+)
+
+
+def list_visible_devices():
+    """
+    列出可见的GPU设备ID：优先使用 CUDA_VISIBLE_DEVICES，否则通过 nvidia-smi 枚举，没有GPU时返回空列表
+    不在主进程中初始化CUDA，否则fork出的子进程无法再使用CUDA
+    """
+    visible = os.environ.get("CUDA_VISIBLE_DEVICES")
+    if visible is not None:
+        devices = [d.strip() for d in visible.split(",") if d.strip()]
+        return [int(d) if d.isdigit() else d for d in devices]
+
+    try:
+        result = subprocess.run(
+            ["nvidia-smi", "--query-gpu=index", "--format=csv,noheader"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.warning(f"无法通过nvidia-smi枚举GPU: {e}")
+        return []
+    return [int(line) for line in result.stdout.split() if line.strip()]
+
+
+def probe_device(device_id, timeout=120):
+    """
+    在新的子进程中检查GPU能否创建CUDA上下文、分配显存并同步
+    出错的工作进程中的上下文可能已经不可用，因此不能在其中探测
+    """
+    env = dict(os.environ, CUDA_VISIBLE_DEVICES=str(device_id))
+    env.setdefault("CUDA_DEVICE_ORDER", "PCI_BUS_ID")
+    try:
+        subprocess.run(
+            [sys.executable, "-c", PROBE_SCRIPT],
+            env=env,
+            capture_output=True,
+            timeout=timeout,
+            check=True,
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        logging.error(f"GPU {device_id} 探测失败: {e}")
+        return False
+    return True
+
+
+class DevicePool:
+    """
+    GPU设备池，每个设备最多同时承载 sessions_per_device 个会话 (每个会话即一组解码器和编码器)
+    acquire() 返回活跃会话数最少的健康设备，设备出错时调用 fail()，之后的分配只考虑其余设备
+    record_error() 记录设备上出现的CUDA错误，同一设备在多个不同URL上出错说明问题出在设备而不是视频
+    list_devices() 返回设备ID列表，测试时可传入假的枚举函数，无需GPU
+    """
+
+    def __init__(self, sessions_per_device=1, list_devices=list_visible_devices):
+        self.sessions_per_device = sessions_per_device
+        self.devices = list(list_devices())
+        self.active = {device: 0 for device in self.devices}
+        self.failed = set()
+        self.errors = {device: [] for device in self.devices}
+        self.lock = threading.Lock()
+
+    def healthy(self):
+        return [device for device in self.devices if device not in self.failed]
+
+    def capacity(self):
+        """健康设备上的会话总数上限"""
+        return len(self.healthy()) * self.sessions_per_device
+
+    def acquire(self):
+        """为一个新会话选择设备，所有健康设备都已满时返回None"""
+        with self.lock:
+            candidates = [
+                device for device in self.healthy() if self.active[device] < self.sessions_per_device
+            ]
+            if not candidates:
+                return None
+            # 负载相同时按枚举顺序选择
+            device = min(candidates, key=lambda device: self.active[device])
+            self.active[device] += 1
+            return device
+
+    def release(self, device):
+        with self.lock:
+            self.active[device] -= 1
+
+    def fail(self, device):
+        """将设备标记为失效，其上的会话不再计入负载"""
+        with self.lock:
+            if device not in self.failed:
+                self.failed.add(device)
+                logging.error(f"GPU {device} 已标记为失效, 剩余可用设备: {self.healthy()}")
+            self.active[device] = 0
+
+    def record_error(self, device, url=None):
+        """
+        记录设备上的一次CUDA错误，返回该设备出错的不同URL数
+        url为None (初始化失败、进程异常退出) 时每次都单独计数
+        """
+        with self.lock:
+            self.errors[device].append(url)
+            errors = self.errors[device]
+            return len({url for url in errors if url is not None}) + errors.count(None)
+
+    def stats(self):
+        with self.lock:
+            return {"active": dict(self.active), "failed": sorted(self.failed, key=str)}
+
+
+class SessionPool:
+    """
+    有上限的会话池，每个会话是一组独立的解码器/编码器，按视频借出
+    多个线程因此可以在同一个CUDA上下文上同时转码，下载则完全不受限制
+    会话在第一次需要时由 create() 创建，最多 size 个，并记录每次借出前的等待时间
+    """
+
+    def __init__(self, create, size):
+        self.create = create
+        self.size = size
+        self.idle = []
+        self.sessions = []
+        self.waits = []
+        self.cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def session(self):
+        wait_start = time.time()
+        with self.cond:
+            while not self.idle and len(self.sessions) >= self.size:
+                self.cond.wait()
+            session = self.idle.pop() if self.idle else None
+            self.waits.append(time.time() - wait_start)
+            if session is None:
+                # 占位，避免其他线程同时创建超过 size 个会话
+                self.sessions.append(None)
+
+        if session is None:
+            try:
+                session = self.create()
+            except BaseException:
+                with self.cond:
+                    self.sessions.remove(None)
+                    self.cond.notify()
+                raise
+            with self.cond:
+                self.sessions[self.sessions.index(None)] = session
+
+        try:
+            yield session
+        finally:
+            with self.cond:
+                self.idle.append(session)
+                self.cond.notify()
+
+    def stats(self):
+        """会话数量、借出次数以及借出前的平均/最长/累计等待时间 (秒)"""
+        with self.cond:
+            waits = list(self.waits)
+            return {
+                "sessions": len(self.sessions),
+                "checkouts": len(waits),
+                "mean_wait": sum(waits) / len(waits) if waits else 0.0,
+                "max_wait": max(waits, default=0.0),
+                "total_wait": sum(waits),
+            }
+
+    def close(self):
+        """关闭所有会话，调用前应确保会话都已归还"""
+        with self.cond:
+            sessions, self.sessions, self.idle = self.sessions, [], []
+        for session in sessions:
+            if session is not None:
+                session.close()
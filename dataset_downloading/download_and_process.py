@@ -11,12 +11,27 @@ import sys
 import time
 import subprocess
 import multiprocessing
+import queue
 import argparse
+import functools
+import itertools
 import math
+import shlex
+import shutil
 import threading
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from device_pool import DevicePool, SessionPool, list_visible_devices, probe_device
+from work_queue import (
+    Prefetcher,
+    WorkerStats,
+    iter_urls,
+    make_url_queue,
+    report_utilization,
+    write_report,
+)
+
 # 导入CUDA相关模块
 import pycuda.driver as cuda
 import cvcuda
@@ -24,11 +39,22 @@ import torch
 
 # 导入nvtranscoding的工具
 sys.path.append("/workspace/sekai-codebase/clip_extracting")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "clip_extracting"))
+from utils.ffmpeg_utils import probe_video
+from utils.journal_utils import Journal, reached
+from utils.manifest_utils import open_clip_index
+from utils.mux_utils import MOVFLAGS, mux_clip
+from utils.pipeline_utils import EXECUTORS, Pipeline, Stage, parse_stage_option
+from utils.plan_utils import order_urls_by_cost, url_to_vid
+from utils.sink_utils import FileSink
 from utils.nvvpf_utils import (
     VideoBatchDecoder,
     VideoMemoryEncoder,
 )
 
+# 同一GPU在这么多个不同的URL上出现CUDA错误时，即使探测正常也标记为失效
+DEVICE_ERROR_LIMIT = 3
+
 
 def process_one_video(
     video_filename,
@@ -38,34 +64,33 @@ def process_one_video(
     encoder,
     cvcuda_stream,
     torch_stream,
+    journal=None,
+    vid=None,
+    seek=None,
 ):
     """
     处理单个视频的函数 (从3_nvtranscoding.py移植)
+    每个clip写入完成后记录到journal (如果提供)
     """
     files = []
     if len(clips) == 0:
         return files
 
-    decoder.initialize(video_filename)
+    decoder.initialize(video_filename, clips, seek=seek)
 
     clip_idx, s, e = 0, clips[0][0], clips[0][1]
     with cvcuda_stream, torch.cuda.stream(torch_stream):
         for frame_idx, frames in enumerate(decoder):
             if frame_idx == s:
-                encoder.initialize()
+                encoder.initialize(FileSink(vstream_filename_format.format(s, e)))
                 encoder(frames)
             elif s < frame_idx < e - 1:
                 encoder(frames)
             elif frame_idx == e - 1:
                 encoder(frames)
-                file = encoder.finish()
-
-                with open(
-                    os.path.join(vstream_filename_format.format(s, e)), "wb"
-                ) as f:
-                    f.write(file)
-                del file
-                files.append(vstream_filename_format.format(s, e))
+                files.append(encoder.finish())
+                if journal is not None:
+                    journal.set_clip_state(vid, (s, e), "transcoded")
 
                 clip_idx += 1
                 if clip_idx == len(clips):
@@ -78,6 +103,19 @@ def process_one_video(
     return files
 
 
+def is_device_error(e):
+    """
+    判断异常是否为CUDA驱动或运行时错误，出错后进程中的上下文可能已不可用
+    错误也可能由单个损坏的视频引起，是否是GPU本身的问题由主进程探测后决定
+    """
+    return isinstance(e, cuda.Error) or "CUDA error" in str(e) or "CUDA_ERROR" in str(e)
+
+
+def remove_download(video_path):
+    """删除下载的视频所在的子目录，连同yt-dlp留下的 .part/.ytdl 和未合并的分轨文件"""
+    shutil.rmtree(os.path.dirname(video_path), ignore_errors=True)
+
+
 def download_single_video(url, temp_video_dir, max_retries=3):
     """
     下载单个视频
@@ -133,7 +171,8 @@ def download_single_video(url, temp_video_dir, max_retries=3):
 
 def process_worker(
     worker_id,
-    urls,
+    url_queue,
+    stats_queue,
     input_clip_dir,
     output_dir,
     start_delay,
@@ -141,39 +180,76 @@ def process_worker(
     height=720,
     fps=30,
     device_id=0,
+    seek=False,
+    prefetch_depth=0,
+    prefetch_max_bytes=None,
+    journal_file=None,
+    resume=False,
+    retry_urls=(),
+    taken_urls=None,
 ):
     """
-    工作进程：下载并处理视频
+    工作进程：从共享队列逐个获取URL，下载并处理视频
+    prefetch_depth > 0 时，在处理当前视频的同时由后台线程下载后续视频
+    resume 时复用上次已下载的视频，并跳过journal中已完成的clip
+    retry_urls 为从失效GPU上转移过来的URL，优先处理
+    GPU出错时停止处理，在统计结果中返回出错的设备和未处理完的URL，由主进程转移到其他设备
+    taken_urls 为主进程的共享字典，本进程已取出但未处理完的URL记在 taken_urls[worker_id] 中，
+    进程异常退出 (例如CUDA段错误) 没有返回统计结果时，主进程据此转移这些URL
     """
+    stats = WorkerStats(worker_id)
+
+    unfinished = list(retry_urls)
+    unfinished_lock = threading.Lock()
+
+    def mark(url, taken):
+        if taken_urls is None:
+            return
+        with unfinished_lock:
+            if taken:
+                unfinished.append(url)
+            else:
+                unfinished.remove(url)
+            taken_urls[worker_id] = list(unfinished)
+
+    def take(urls):
+        """从共享队列取出URL时立即记录，预取线程取出的URL也包括在内"""
+        for url in urls:
+            mark(url, True)
+            yield url
+
     # 延迟启动
     if start_delay > 0:
         logging.info(f"进程 {worker_id}: 等待 {start_delay} 秒后开始...")
         time.sleep(start_delay)
 
-    logging.info(f"进程 {worker_id}: 开始处理 {len(urls)} 个视频...")
+    logging.info(f"进程 {worker_id}: 开始从共享队列获取视频...")
 
     # 创建临时目录
     temp_video_dir = f"/tmp/temp_videos_worker_{worker_id}"
     os.makedirs(temp_video_dir, exist_ok=True)
 
+    # 打开clip索引 (txt目录或clip manifest)
+    clip_index = open_clip_index(input_clip_dir)
+
     # 在子进程中初始化CUDA环境
     cuda_ctx = None
     decoder = None
     encoder = None
 
     try:
-        # 设置CUDA环境变量（在子进程中）
-        os.environ["CUDA_DEVICE_ORDER"] = "PCI_BUS_ID"
+        # 设置CUDA环境变量（在子进程中），设备编号与nvidia-smi一致，按PCI总线顺序
+        os.environ.setdefault("CUDA_DEVICE_ORDER", "PCI_BUS_ID")
         os.environ["CUDA_VISIBLE_DEVICES"] = str(device_id)
 
         # 初始化CUDA
-        logging.info(f"进程 {worker_id}: 初始化CUDA...")
+        logging.info(f"进程 {worker_id}: 在GPU {device_id} 上初始化CUDA...")
 
         # 初始化CUDA驱动（这在每个进程中都需要调用）
         cuda.init()
 
-        # 获取设备并创建上下文
-        cuda_device = cuda.Device(device_id)
+        # 只有分配到的GPU可见，在进程内它的编号为0
+        cuda_device = cuda.Device(0)
         cuda_ctx = cuda_device.make_context()
 
         # 创建CUDA流
@@ -182,37 +258,70 @@ def process_worker(
 
         # 初始化编码器和解码器
         decoder = VideoBatchDecoder(
-            width, height, fps, 1, device_id, cuda_ctx, cvcuda_stream
+            width, height, fps, 1, 0, cuda_ctx, cvcuda_stream, seek=seek
         )
         encoder = VideoMemoryEncoder(
-            width, height, fps, 1, device_id, cuda_ctx, cvcuda_stream
+            width, height, fps, 1, 0, cuda_ctx, cvcuda_stream
         )
 
         logging.info(f"进程 {worker_id}: CUDA初始化成功")
 
     except Exception as e:
-        logging.error(f"进程 {worker_id}: CUDA初始化失败 - {e}")
-        # 如果CUDA初始化失败，清理并退出
+        logging.error(f"进程 {worker_id}: GPU {device_id} 上CUDA初始化失败 - {e}")
+        # 如果CUDA初始化失败，清理并退出，由主进程把任务转移到其他设备
         if cuda_ctx:
             try:
                 cuda_ctx.pop()
             except:
                 pass
+        stats.device_error = device_id
+        stats.handoff = list(retry_urls)
+        stats_queue.put(stats.to_dict())
         return
 
     processed_count = 0
     failed_count = 0
 
+    journal = Journal(journal_file) if journal_file else None
+
+    def fetch(url):
+        video_id = url_to_vid(url)
+        if resume and journal is not None:
+            video_path = journal.video_path(video_id)
+            if video_path is not None and os.path.exists(video_path):
+                logging.info(f"进程 {worker_id}: 复用已下载的视频 - {video_path}")
+                return True, video_path, video_id
+
+        # 每个视频下载到单独的子目录，避免预取的多个文件互相混淆
+        video_dir = os.path.join(temp_video_dir, video_id)
+        os.makedirs(video_dir, exist_ok=True)
+        result = download_single_video(url, video_dir)
+        if not result[0]:
+            shutil.rmtree(video_dir, ignore_errors=True)
+        elif journal is not None:
+            journal.set_video_state(result[2], "downloaded", os.path.abspath(result[1]))
+        return result
+
+    prefetcher = Prefetcher(
+        itertools.chain(retry_urls, take(iter_urls(url_queue))),
+        fetch,
+        prefetch_depth,
+        prefetch_max_bytes,
+    )
+
     try:
-        for i, url in enumerate(urls):
+        previous = None
+        for i, (url, (success, video_path, video_id)) in enumerate(
+            stats.track(prefetcher, key=lambda item: item[0])
+        ):
+            # 上一个URL已处理完 (成功或失败)
+            if previous is not None:
+                mark(previous, False)
+            previous = url
             try:
-                logging.info(f"进程 {worker_id}: 处理 {i+1}/{len(urls)} - {url}")
-
-                # 1. 下载视频
-                success, video_path, video_id = download_single_video(
-                    url, temp_video_dir
-                )
+                logging.info(f"进程 {worker_id}: 处理第 {i+1} 个视频 - {url}")
 
+                # 1. 下载视频 (预取模式下已由后台线程完成)
                 if not success:
                     logging.error(f"进程 {worker_id}: 下载失败 - {url}")
                     failed_count += 1
@@ -220,23 +329,30 @@ def process_worker(
 
                 logging.info(f"进程 {worker_id}: 下载完成 - {video_id}")
 
-                # 2. 检查是否有对应的clip文件
-                clip_file = os.path.join(input_clip_dir, f"{video_id}.txt")
-                if not os.path.exists(clip_file):
-                    logging.warning(f"进程 {worker_id}: 找不到clip文件 - {clip_file}")
-                    os.remove(video_path)  # 删除下载的视频
+                # 2. 检查是否有对应的clip
+                if video_id not in clip_index:
+                    logging.warning(f"进程 {worker_id}: 找不到clip - {video_id}")
+                    remove_download(video_path)  # 删除下载的视频
                     failed_count += 1
                     continue
 
                 # 3. 读取clip信息
-                with open(clip_file, "r") as f:
-                    clips = [tuple(map(int, line.strip().split(" "))) for line in f]
+                clips = clip_index[video_id]
 
                 if len(clips) == 0:
-                    logging.warning(f"进程 {worker_id}: clip文件为空 - {video_id}")
-                    os.remove(video_path)
+                    logging.warning(f"进程 {worker_id}: clip为空 - {video_id}")
+                    remove_download(video_path)
                     continue
 
+                # 跳过已完成的clip
+                pending = clips
+                if resume and journal is not None:
+                    pending = journal.pending_clips(video_id, clips, "transcoded")
+                    if len(pending) < len(clips):
+                        logging.info(
+                            f"进程 {worker_id}: 跳过 {len(clips) - len(pending)} 个已完成的clip - {video_id}"
+                        )
+
                 # 4. 创建输出目录
                 video_output_dir = os.path.join(output_dir, video_id)
                 os.makedirs(video_output_dir, exist_ok=True)
@@ -250,12 +366,18 @@ def process_worker(
                 processed_files = process_one_video(
                     video_path,
                     vstream_format,
-                    clips,
+                    pending,
                     decoder,
                     encoder,
                     cvcuda_stream,
                     torch_stream,
+                    journal,
+                    video_id,
+                    # 部分完成的视频只从第一个未完成的clip开始解码
+                    seek=True if len(pending) < len(clips) else None,
                 )
+                if journal is not None:
+                    journal.set_video_state(video_id, "transcoded")
 
                 logging.info(
                     f"进程 {worker_id}: 处理完成 - {video_id}, 生成 {len(processed_files)} 个片段"
@@ -263,34 +385,49 @@ def process_worker(
                 processed_count += 1
 
                 # 6. 删除原始视频文件以节省空间
-                os.remove(video_path)
+                remove_download(video_path)
                 logging.info(f"进程 {worker_id}: 已删除临时视频文件 - {video_path}")
 
                 # 7. 清理内存
                 gc.collect()
 
             except Exception as e:
+                if is_device_error(e):
+                    # 上下文可能已不可用，由主进程探测GPU后决定标记失效还是换新进程继续
+                    logging.error(
+                        f"进程 {worker_id}: GPU {device_id} 出错 - {url}, 错误: {e}"
+                    )
+                    stats.device_error = device_id
+                    stats.error_url = url
+                    stats.handoff = [url] + prefetcher.close()
+                    previous = None
+                    break
+
                 logging.error(
                     f"进程 {worker_id}: 处理视频时发生错误 - {url}, 错误: {e}"
                 )
                 # 清理可能的临时文件
-                try:
-                    if "video_path" in locals() and os.path.exists(video_path):
-                        os.remove(video_path)
-                except:
-                    pass
+                if video_path is not None:
+                    remove_download(video_path)
                 failed_count += 1
+        if previous is not None:
+            mark(previous, False)
 
     finally:
         # 清理CUDA上下文
         logging.info(f"进程 {worker_id}: 清理CUDA资源...")
         try:
+            if encoder is not None:
+                encoder.close()
             if cuda_ctx:
                 cuda_ctx.pop()
                 logging.info(f"进程 {worker_id}: CUDA上下文已清理")
         except Exception as e:
             logging.warning(f"进程 {worker_id}: 清理CUDA上下文时出错 - {e}")
 
+        if journal is not None:
+            journal.close()
+
         # 清理临时目录
         try:
             import shutil
@@ -303,98 +440,291 @@ def process_worker(
     logging.info(
         f"进程 {worker_id}: 完成处理，成功: {processed_count}, 失败: {failed_count}"
     )
+    stats.stage_idle = prefetcher.idle()
+    logging.info(
+        f"进程 {worker_id}: 下载空闲 {stats.stage_idle['download']:.1f}s, "
+        f"处理等待下载 {stats.stage_idle['process']:.1f}s"
+    )
+    stats_queue.put(stats.to_dict())
+
+
+class TranscodeSession:
+    """一组独立的解码器、编码器和CUDA流，由SessionPool按视频借给线程使用"""
+
+    def __init__(self, width, height, fps, device_id, cuda_ctx, seek=False):
+        self.cvcuda_stream = cvcuda.Stream()
+        self.torch_stream = torch.cuda.Stream(device=device_id)
+        self.decoder = VideoBatchDecoder(
+            width, height, fps, 1, device_id, cuda_ctx, self.cvcuda_stream, seek=seek
+        )
+        self.encoder = VideoMemoryEncoder(
+            width, height, fps, 1, device_id, cuda_ctx, self.cvcuda_stream
+        )
+
+    def close(self):
+        self.encoder.close()
 
 
 def process_worker_thread(
     worker_id,
-    urls,
+    url_queue,
+    stats_queue,
     input_clip_dir,
     output_dir,
-    shared_decoder,
-    shared_encoder,
-    shared_cuda_resources,
-    thread_lock,
+    session_pool,
+    cuda_ctx,
+    prefetch_depth=0,
+    prefetch_max_bytes=None,
 ):
     """
-    线程工作函数
+    线程工作函数：从共享队列逐个获取URL
+    每个视频从会话池借出一组解码器/编码器，最多 session_pool.size 个视频同时转码
+    prefetch_depth > 0 时，在处理当前视频的同时由后台线程下载后续视频
     """
-    for i, url in enumerate(urls):
-        try:
-            logging.info(f"线程 {worker_id}: 处理 {i+1}/{len(urls)} - {url}")
+    stats = WorkerStats(worker_id)
+    clip_index = open_clip_index(input_clip_dir)
 
-            # 下载视频
-            temp_video_dir = f"/tmp/temp_videos_thread_{worker_id}"
-            os.makedirs(temp_video_dir, exist_ok=True)
+    temp_video_dir = f"/tmp/temp_videos_thread_{worker_id}"
+    os.makedirs(temp_video_dir, exist_ok=True)
+
+    def fetch(url):
+        # 每个视频下载到单独的子目录，避免预取的多个文件互相混淆
+        video_dir = os.path.join(temp_video_dir, url_to_vid(url))
+        os.makedirs(video_dir, exist_ok=True)
+        result = download_single_video(url, video_dir)
+        if not result[0]:
+            shutil.rmtree(video_dir, ignore_errors=True)
+        return result
 
-            success, video_path, video_id = download_single_video(url, temp_video_dir)
+    prefetcher = Prefetcher(iter_urls(url_queue), fetch, prefetch_depth, prefetch_max_bytes)
+
+    for i, (url, (success, video_path, video_id)) in enumerate(
+        stats.track(prefetcher, key=lambda item: item[0])
+    ):
+        try:
+            logging.info(f"线程 {worker_id}: 处理第 {i+1} 个视频 - {url}")
 
+            # 下载视频 (预取模式下已由后台线程完成)
             if not success:
                 continue
 
-            # 读取clip文件
-            clip_file = os.path.join(input_clip_dir, f"{video_id}.txt")
-            if not os.path.exists(clip_file):
-                os.remove(video_path)
+            # 读取clip
+            if video_id not in clip_index:
+                remove_download(video_path)
                 continue
 
-            with open(clip_file, "r") as f:
-                clips = [tuple(map(int, line.strip().split(" "))) for line in f]
+            clips = clip_index[video_id]
 
             if len(clips) == 0:
-                os.remove(video_path)
+                remove_download(video_path)
                 continue
 
             # 创建输出目录
             video_output_dir = os.path.join(output_dir, video_id)
             os.makedirs(video_output_dir, exist_ok=True)
 
-            # 使用锁保护CUDA资源的访问
-            with thread_lock:
-                logging.info(f"线程 {worker_id}: 开始处理视频 - {video_id}")
-                vstream_format = os.path.join(
-                    video_output_dir, f"{video_id}_{{:07d}}_{{:07d}}.hevc"
-                )
+            vstream_format = os.path.join(
+                video_output_dir, f"{video_id}_{{:07d}}_{{:07d}}.hevc"
+            )
 
-                processed_files = process_one_video(
-                    video_path,
-                    vstream_format,
-                    clips,
-                    shared_decoder,
-                    shared_encoder,
-                    shared_cuda_resources["cvcuda_stream"],
-                    shared_cuda_resources["torch_stream"],
-                )
+            # CUDA上下文需要在每个线程中分别设为当前上下文
+            cuda_ctx.push()
+            try:
+                with session_pool.session() as session:
+                    logging.info(f"线程 {worker_id}: 开始处理视频 - {video_id}")
+                    processed_files = process_one_video(
+                        video_path,
+                        vstream_format,
+                        clips,
+                        session.decoder,
+                        session.encoder,
+                        session.cvcuda_stream,
+                        session.torch_stream,
+                    )
+            finally:
+                cuda_ctx.pop()
 
             # 删除临时视频
-            os.remove(video_path)
+            remove_download(video_path)
             logging.info(f"线程 {worker_id}: 处理完成 - {video_id}")
 
         except Exception as e:
             logging.error(f"线程 {worker_id}: 处理错误 - {e}")
+            if video_path is not None:
+                remove_download(video_path)
 
+    shutil.rmtree(temp_video_dir, ignore_errors=True)
+    stats.stage_idle = prefetcher.idle()
+    stats_queue.put(stats.to_dict())
 
-def split_urls(urls, num_workers):
-    """分割URL列表"""
-    urls_per_worker = math.ceil(len(urls) / num_workers)
-    split_urls = []
 
-    for i in range(num_workers):
-        start_idx = i * urls_per_worker
-        end_idx = min((i + 1) * urls_per_worker, len(urls))
+def mux_hevc_file(item, fps, layout):
+    """流水线的mux阶段：把转码得到的.hevc封装为MP4并删除.hevc，模块级函数以便在进程池中运行"""
+    with open(item["path"], "rb") as f:
+        bitstream = f.read()
+    filename = os.path.splitext(item["path"])[0] + ".mp4"
+    mux_clip(filename, bitstream, fps, start_frame=item["clip"][0], end_frame=item["clip"][1], layout=layout)
+    os.remove(item["path"])
+    return dict(item, path=filename)
 
-        if start_idx >= len(urls):
-            break
 
-        worker_urls = urls[start_idx:end_idx]
-        split_urls.append(worker_urls)
+class DownloadPipeline:
+    """
+    把 process_worker 中串行的 下载 -> 处理 拆成流水线的各个阶段:
+    fetch (下载) -> probe (检查视频和clip) -> transcode (GPU解码+编码) -> mux (可选, 封装MP4) -> write (记录journal)
+    -> upload (可选, 执行上传命令)
+    解码和编码在同一个阶段中完成，因为GPU上的帧无法在进程间传递，逐帧在线程间传递也得不偿失
+    transcode 阶段的每个worker从会话池借出一组解码器/编码器，只能使用线程执行器
+    其余以本对象方法实现的阶段无法序列化到进程池，只能使用线程或asyncio执行器，只有mux阶段可以使用进程池
+    """
+
+    def __init__(self, args, cuda_ctx, device_id):
+        self.args = args
+        self.cuda_ctx = cuda_ctx
+        self.clip_index = open_clip_index(args.input_clip_dir)
+        self.journal = Journal(args.journal)
+        self.temp_video_dir = "/tmp/temp_videos_pipeline"
+        self.done_state = "transcoded" if args.mp4_layout is None else "muxed"
+
+        self.overrides = {}
+        for option in args.stage:
+            overrides = parse_stage_option(option)
+            self.overrides[overrides.pop("name")] = overrides
+
+        self.session_pool = SessionPool(
+            lambda: TranscodeSession(
+                args.width, args.height, args.fps, device_id, cuda_ctx, args.seek
+            ),
+            self.overrides.get("transcode", {}).get("workers", 2),
+        )
 
-    return split_urls
+        # 每个视频还未写完的clip数，全部写完后记录视频状态
+        self.remaining = {}
+        self.lock = threading.Lock()
+
+        # 在开始下载之前检查各阶段的执行器
+        self.pipeline = Pipeline(self.stages())
+
+    def stage(self, name, fn, workers=1, executors=("thread", "asyncio"), **kwargs):
+        kwargs.update(workers=workers, executors=executors)
+        kwargs.update(self.overrides.get(name, {}))
+        return Stage(name, fn, **kwargs)
+
+    def stages(self):
+        stages = [
+            self.stage("fetch", self.fetch, self.args.workers),
+            self.stage("probe", self.probe),
+            self.stage(
+                "transcode", self.transcode, self.session_pool.size, ("thread",), expand=True
+            ),
+        ]
+        if self.args.mp4_layout is not None:
+            mux = functools.partial(mux_hevc_file, fps=self.args.fps, layout=self.args.mp4_layout)
+            stages.append(self.stage("mux", mux, 2, EXECUTORS))
+        stages.append(self.stage("write", self.write))
+        if self.args.upload_cmd is not None:
+            stages.append(self.stage("upload", self.upload, 2))
+        return stages
+
+    def fetch(self, url):
+        video_id = url_to_vid(url)
+        if self.args.resume:
+            video_path = self.journal.video_path(video_id)
+            if video_path is not None and os.path.exists(video_path):
+                logging.info(f"复用已下载的视频 - {video_path}")
+                return {"url": url, "vid": video_id, "path": video_path}
+
+        video_dir = os.path.join(self.temp_video_dir, video_id)
+        os.makedirs(video_dir, exist_ok=True)
+        success, video_path, video_id = download_single_video(url, video_dir)
+        if not success:
+            logging.error(f"下载失败 - {url}")
+            shutil.rmtree(video_dir, ignore_errors=True)
+            return None
+        self.journal.set_video_state(video_id, "downloaded", os.path.abspath(video_path))
+        return {"url": url, "vid": video_id, "path": video_path}
+
+    def probe(self, item):
+        video_id = item["vid"]
+        clips = self.clip_index[video_id] if video_id in self.clip_index else []
+        pending = clips
+        if self.args.resume:
+            pending = self.journal.pending_clips(video_id, clips, self.done_state)
+        if len(pending) == 0:
+            logging.warning(f"没有需要处理的clip - {video_id}")
+            remove_download(item["path"])
+            return None
+
+        # 在占用GPU之前发现损坏的下载
+        try:
+            info = probe_video(item["path"])
+        except Exception:
+            remove_download(item["path"])
+            raise
+        logging.info(f"{video_id}: {info['width']}x{info['height']} @ {info['fps']:.2f}fps, {len(pending)} 个clip")
+        return dict(item, clips=clips, pending=pending, info=info)
+
+    def transcode(self, item):
+        video_id = item["vid"]
+        video_output_dir = os.path.join(self.args.output_dir, video_id)
+        os.makedirs(video_output_dir, exist_ok=True)
+        vstream_format = os.path.join(video_output_dir, f"{video_id}_{{:07d}}_{{:07d}}.hevc")
+
+        self.cuda_ctx.push()
+        try:
+            with self.session_pool.session() as session:
+                process_one_video(
+                    item["path"],
+                    vstream_format,
+                    item["pending"],
+                    session.decoder,
+                    session.encoder,
+                    session.cvcuda_stream,
+                    session.torch_stream,
+                    # 部分完成的视频只从第一个未完成的clip开始解码
+                    seek=True if len(item["pending"]) < len(item["clips"]) else None,
+                )
+        finally:
+            self.cuda_ctx.pop()
+            remove_download(item["path"])
+
+        with self.lock:
+            self.remaining[video_id] = len(item["pending"])
+        return [
+            {"vid": video_id, "clip": (s, e), "path": vstream_format.format(s, e)}
+            for s, e in item["pending"]
+        ]
+
+    def write(self, item):
+        video_id = item["vid"]
+        self.journal.set_clip_state(video_id, item["clip"], self.done_state)
+        with self.lock:
+            self.remaining[video_id] -= 1
+            finished = self.remaining[video_id] == 0
+        if finished:
+            self.journal.set_video_state(video_id, self.done_state)
+            logging.info(f"处理完成 - {video_id}")
+        return item
+
+    def upload(self, item):
+        cmd = [arg.format(path=item["path"]) for arg in shlex.split(self.args.upload_cmd)]
+        subprocess.run(cmd, check=True)
+        return item
+
+    def run(self, urls):
+        stats = self.pipeline.run(urls)
+        Pipeline.report(stats)
+        logging.info(f"会话池: {self.session_pool.stats()}")
+        self.session_pool.close()
+        self.journal.close()
+        shutil.rmtree(self.temp_video_dir, ignore_errors=True)
+        return stats
 
 
 def main():
     parser = argparse.ArgumentParser(description="集成下载-处理脚本")
     parser.add_argument("--urls-file", "-u", required=True, help="URL列表文件")
-    parser.add_argument("--input-clip-dir", "-c", required=True, help="输入clip目录")
+    parser.add_argument("--input-clip-dir", "-c", required=True, help="输入clip目录或clip manifest文件")
     parser.add_argument("--output-dir", "-o", required=True, help="输出vstream目录")
     parser.add_argument(
         "--workers", "-w", type=int, default=2, help="工作进程数量 (默认: 2)"
@@ -413,7 +743,81 @@ def main():
         "--height", type=int, default=720, help="输出视频高度 (默认: 720)"
     )
     parser.add_argument("--fps", type=int, default=30, help="输出视频FPS (默认: 30)")
-    parser.add_argument("--device-id", type=int, default=0, help="GPU设备ID (默认: 0)")
+    parser.add_argument(
+        "--device-id",
+        type=int,
+        default=None,
+        help="只使用指定的GPU设备 (默认: 使用全部可见GPU)",
+    )
+    parser.add_argument(
+        "--sessions-per-device",
+        type=int,
+        default=None,
+        help="每个GPU上最多同时运行的工作进程数 (默认: 把工作进程平均分配到各GPU)",
+    )
+    parser.add_argument(
+        "--seek",
+        action="store_true",
+        help="按关键帧跳转解码，跳过clip之间的帧",
+    )
+    parser.add_argument(
+        "--prefetch-depth",
+        type=int,
+        default=0,
+        help="每个进程在处理当前视频时预先下载的视频数量 (默认: 0，不预取)",
+    )
+    parser.add_argument(
+        "--prefetch-max-gb",
+        type=float,
+        default=None,
+        help="每个进程临时目录中已下载未处理视频的总大小上限 (GB)",
+    )
+    parser.add_argument(
+        "--order-by-cost",
+        action="store_true",
+        help="按clip估计的处理时间从长到短排列URL (最长优先)",
+    )
+    parser.add_argument(
+        "--prior-report", default=None, help="上次运行的报告文件，用于修正成本模型"
+    )
+    parser.add_argument(
+        "--report-file", default=None, help="将每个URL的处理耗时追加写入该报告文件"
+    )
+    parser.add_argument(
+        "--journal",
+        default=None,
+        help="记录每个视频和clip处理状态的SQLite文件 (默认: 输出目录下的journal.sqlite)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="从上次中断处继续：跳过journal中已完成的视频和clip，复用已下载的视频",
+    )
+    parser.add_argument(
+        "--engine",
+        default="processes",
+        choices=["processes", "pipeline"],
+        help="processes: 每个工作进程串行下载和处理视频; pipeline: 各阶段由有界队列连接，分别设置并发数 (默认: processes)",
+    )
+    parser.add_argument(
+        "--stage",
+        action="append",
+        default=[],
+        help="pipeline模式下设置阶段的并发: 名称=worker数[:thread|process|asyncio[:队列长度]]，"
+        "阶段为fetch, probe, transcode, mux, write, upload，例如 --stage fetch=8 --stage mux=4:process。"
+        "transcode只能使用thread，mux可以使用任意执行器，其余阶段可以使用thread或asyncio",
+    )
+    parser.add_argument(
+        "--mp4-layout",
+        default=None,
+        choices=list(MOVFLAGS),
+        help="pipeline模式下把clip封装为MP4 (默认: 输出.hevc)",
+    )
+    parser.add_argument(
+        "--upload-cmd",
+        default=None,
+        help="pipeline模式下对每个输出文件执行的上传命令，{path} 替换为文件路径",
+    )
     parser.add_argument(
         "--log-level",
         default="INFO",
@@ -445,64 +849,211 @@ def main():
     with open(args.urls_file, "r", encoding="utf-8") as f:
         urls = [line.strip() for line in f if line.strip()]
 
+    if args.journal is None:
+        args.journal = os.path.join(args.output_dir, "journal.sqlite")
+
+    # 跳过已完成转码的视频
+    if args.resume:
+        journal = Journal(args.journal)
+        finished = {
+            url for url in urls if reached(journal.video_state(url_to_vid(url)), "transcoded")
+        }
+        journal.close()
+        urls = [url for url in urls if url not in finished]
+        logging.info(f"跳过 {len(finished)} 个已完成的视频")
+
+    # 按估计处理时间从长到短排序
+    if args.order_by_cost:
+        urls = order_urls_by_cost(
+            urls, open_clip_index(args.input_clip_dir), args.prior_report
+        )
+
+    # 工作进程分配到各GPU上
+    devices = list_visible_devices() if args.device_id is None else [args.device_id]
+    if not devices:
+        logging.error("未找到可用的GPU设备")
+        sys.exit(1)
+    sessions_per_device = args.sessions_per_device or math.ceil(
+        args.workers / len(devices)
+    )
+    pool = DevicePool(sessions_per_device, lambda: devices)
+
+    if args.engine == "pipeline":
+        # 流水线在当前进程中运行，只使用第一个GPU，在进程内它的编号为0
+        logging.info(f"总共 {len(urls)} 个URL需要处理, 使用GPU {devices[0]}")
+        os.environ.setdefault("CUDA_DEVICE_ORDER", "PCI_BUS_ID")
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(devices[0])
+        cuda.init()
+        cuda_ctx = cuda.Device(0).retain_primary_context()
+        cuda_ctx.push()
+        try:
+            try:
+                pipeline = DownloadPipeline(args, cuda_ctx, 0)
+            except ValueError as e:
+                parser.error(str(e))
+            pipeline.run(urls)
+        finally:
+            cuda_ctx.pop()
+        return
+
     logging.info(f"总共 {len(urls)} 个URL需要处理")
     logging.info(f"使用 {args.workers} 个工作进程")
+    logging.info(f"使用GPU {devices}, 每个GPU最多 {sessions_per_device} 个工作进程")
     logging.info(f"输出目录: {args.output_dir}")
 
-    # 分割URL
-    split_url_lists = split_urls(urls, args.workers)
-    logging.info(f"URL分配: {[len(url_list) for url_list in split_url_lists]}")
-
-    # 启动工作进程
-    processes = []
+    # 创建共享URL队列
+    num_workers = min(args.workers, len(urls), pool.capacity())
+    url_queue = make_url_queue(urls, num_workers)
+    stats_queue = multiprocessing.Queue()
+
+    # 启动工作进程: worker_id -> (进程, GPU)
+    processes = {}
+    # 每个进程已取出但未处理完的URL，进程异常退出时据此转移
+    manager = multiprocessing.Manager()
+    taken_urls = manager.dict()
+    retried = set()
+    # 等待空闲GPU的转移任务
+    waiting = []
+
+    def start_worker(device_id, delay, retry_urls=()):
+        worker_id = len(processes)
+        taken_urls[worker_id] = list(retry_urls)
+        process = multiprocessing.Process(
+            target=process_worker,
+            args=(
+                worker_id,
+                url_queue,
+                stats_queue,
+                args.input_clip_dir,
+                args.output_dir,
+                delay,
+                args.width,
+                args.height,
+                args.fps,
+                device_id,
+                args.seek,
+                args.prefetch_depth,
+                None
+                if args.prefetch_max_gb is None
+                else int(args.prefetch_max_gb * 1024**3),
+                args.journal,
+                args.resume,
+                list(retry_urls),
+                taken_urls,
+            ),
+        )
+        process.start()
+        processes[worker_id] = (process, device_id)
+        logging.info(f"启动进程 {worker_id} (PID: {process.pid}, GPU {device_id})")
+
+    def start_waiting():
+        """在有空闲会话的GPU上启动等待中的转移任务"""
+        while waiting:
+            device_id = pool.acquire()
+            if device_id is None:
+                return
+            start_worker(device_id, 0, waiting.pop(0))
+
+    def move_work(device_id, handoff, error_url=None):
+        """
+        工作进程出现CUDA错误后，启动新的工作进程接手未完成的URL，没有空闲会话时等其他进程结束
+        只有GPU探测失败，或同一GPU在 DEVICE_ERROR_LIMIT 个不同的URL上出错时，才把它标记为失效
+        """
+        # 每个URL只转移一次，已经转移过又出错的URL视为视频本身的问题
+        dropped = [url for url in handoff if url in retried]
+        if dropped:
+            logging.error(f"以下URL已转移过一次仍然失败，不再转移: {dropped}")
+        handoff = [url for url in handoff if url not in retried]
+        retried.update(handoff)
+
+        if error_url in dropped:
+            # 重试时仍出错的视频不计入GPU的错误次数
+            pool.release(device_id)
+        elif (
+            pool.record_error(device_id, error_url) >= DEVICE_ERROR_LIMIT
+            or not probe_device(device_id)
+        ):
+            pool.fail(device_id)
+        else:
+            logging.warning(f"GPU {device_id} 探测正常, 继续使用")
+            pool.release(device_id)
+        # 新进程需要自己的结束标记
+        url_queue.put(None)
+        waiting.append(handoff)
+        start_waiting()
 
     try:
-        for i, worker_urls in enumerate(split_url_lists):
-            delay = i * args.start_delay
-
-            process = multiprocessing.Process(
-                target=process_worker,
-                args=(
-                    i,
-                    worker_urls,
-                    args.input_clip_dir,
-                    args.output_dir,
-                    delay,
-                    args.width,
-                    args.height,
-                    args.fps,
-                    args.device_id,
-                ),
-            )
-            process.start()
-            processes.append(process)
-            logging.info(
-                f"启动进程 {i} (PID: {process.pid}), 处理 {len(worker_urls)} 个URL"
-            )
+        for i in range(num_workers):
+            start_worker(pool.acquire(), i * args.start_delay)
 
         logging.info(f"所有 {len(processes)} 个进程已启动，等待完成...")
 
-        # 等待所有进程完成
-        for i, process in enumerate(processes):
+        # 等待所有进程完成，同时处理GPU失效
+        stats = []
+        finished, exited = set(), set()
+        while len(finished) < len(processes) or (waiting and pool.capacity() > 0):
+            try:
+                worker_stats = stats_queue.get(timeout=1)
+            except queue.Empty:
+                worker_stats = None
+            if worker_stats is not None:
+                stats.append(worker_stats)
+                worker_id = worker_stats["worker_id"]
+                finished.add(worker_id)
+                device_id = processes[worker_id][1]
+                if worker_stats["device_error"] is not None:
+                    move_work(
+                        device_id, worker_stats["handoff"], worker_stats["error_url"]
+                    )
+                else:
+                    pool.release(device_id)
+                    start_waiting()
+                logging.info(f"进程 {worker_id} 已完成")
+
+            for worker_id, (process, device_id) in list(processes.items()):
+                if worker_id in finished or process.is_alive():
+                    continue
+                if worker_id in exited:
+                    # 进程已退出且没有返回统计信息，按GPU出错处理，转移它已取出但未处理完的URL
+                    finished.add(worker_id)
+                    handoff = list(taken_urls.get(worker_id, []))
+                    logging.error(
+                        f"进程 {worker_id} 异常退出 (exitcode {process.exitcode}), "
+                        f"未处理完的URL: {handoff}"
+                    )
+                    move_work(device_id, handoff)
+                else:
+                    # 统计信息可能还在队列中，下一轮再确认
+                    exited.add(worker_id)
+
+        for process, _ in processes.values():
             process.join()
-            logging.info(f"进程 {i} 已完成")
+        if waiting:
+            lost = [url for handoff in waiting for url in handoff]
+            logging.error(f"没有可用的GPU设备, {len(lost)} 个URL未能转移: {lost}")
+        logging.info(f"GPU使用情况: {pool.stats()}")
 
         logging.info("所有处理进程已完成！")
+        report_utilization(stats, urls, num_workers)
+        if args.report_file:
+            write_report(stats, args.report_file)
 
     except KeyboardInterrupt:
         logging.info("收到中断信号，正在终止所有进程...")
-        for process in processes:
+        for process, _ in processes.values():
             if process.is_alive():
                 process.terminate()
                 process.join(timeout=10)
                 if process.is_alive():
                     process.kill()
+    finally:
+        manager.shutdown()
 
 
 def main_threaded():
     parser = argparse.ArgumentParser(description="集成下载-处理脚本")
     parser.add_argument("--urls-file", "-u", required=True, help="URL列表文件")
-    parser.add_argument("--input-clip-dir", "-c", required=True, help="输入clip目录")
+    parser.add_argument("--input-clip-dir", "-c", required=True, help="输入clip目录或clip manifest文件")
     parser.add_argument("--output-dir", "-o", required=True, help="输出vstream目录")
     parser.add_argument(
         "--workers", "-w", type=int, default=2, help="工作进程数量 (默认: 2)"
@@ -522,6 +1073,40 @@ def main_threaded():
     )
     parser.add_argument("--fps", type=int, default=30, help="输出视频FPS (默认: 30)")
     parser.add_argument("--device-id", type=int, default=0, help="GPU设备ID (默认: 0)")
+    parser.add_argument(
+        "--seek",
+        action="store_true",
+        help="按关键帧跳转解码，跳过clip之间的帧",
+    )
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        default=2,
+        help="同时转码的视频数上限，即解码器/编码器组数 (默认: 2)",
+    )
+    parser.add_argument(
+        "--prefetch-depth",
+        type=int,
+        default=0,
+        help="每个线程在处理当前视频时预先下载的视频数量 (默认: 0，不预取)",
+    )
+    parser.add_argument(
+        "--prefetch-max-gb",
+        type=float,
+        default=None,
+        help="每个线程临时目录中已下载未处理视频的总大小上限 (GB)",
+    )
+    parser.add_argument(
+        "--order-by-cost",
+        action="store_true",
+        help="按clip估计的处理时间从长到短排列URL (最长优先)",
+    )
+    parser.add_argument(
+        "--prior-report", default=None, help="上次运行的报告文件，用于修正成本模型"
+    )
+    parser.add_argument(
+        "--report-file", default=None, help="将每个URL的处理耗时追加写入该报告文件"
+    )
     parser.add_argument(
         "--log-level",
         default="INFO",
@@ -553,50 +1138,54 @@ def main_threaded():
     with open(args.urls_file, "r", encoding="utf-8") as f:
         urls = [line.strip() for line in f if line.strip()]
 
+    # 按估计处理时间从长到短排序
+    if args.order_by_cost:
+        urls = order_urls_by_cost(
+            urls, open_clip_index(args.input_clip_dir), args.prior_report
+        )
+
     logging.info(f"总共 {len(urls)} 个URL需要处理")
     logging.info(f"使用 {args.workers} 个工作进程")
     logging.info(f"输出目录: {args.output_dir}")
 
-    # 初始化CUDA（只在主进程中一次）
+    # 初始化CUDA（只在主进程中一次），所有线程共用设备的主上下文，设备编号与nvidia-smi一致
+    os.environ.setdefault("CUDA_DEVICE_ORDER", "PCI_BUS_ID")
     cuda.init()
     cuda_device = cuda.Device(args.device_id)
-    cuda_ctx = cuda_device.make_context()
-    cvcuda_stream = cvcuda.Stream().current
-    torch_stream = torch.cuda.default_stream()
-
-    # 创建共享的编码器和解码器
-    decoder = VideoBatchDecoder(
-        args.width, args.height, args.fps, 1, args.device_id, cuda_ctx, cvcuda_stream
-    )
-    encoder = VideoMemoryEncoder(
-        args.width, args.height, args.fps, 1, args.device_id, cuda_ctx, cvcuda_stream
+    cuda_ctx = cuda_device.retain_primary_context()
+    cuda_ctx.push()
+
+    # 创建共享URL队列
+    num_workers = min(args.workers, len(urls))
+
+    # 解码器/编码器会话池，下载不受会话数限制
+    session_pool = SessionPool(
+        lambda: TranscodeSession(
+            args.width, args.height, args.fps, args.device_id, cuda_ctx, args.seek
+        ),
+        min(args.sessions, num_workers),
     )
 
-    shared_cuda_resources = {
-        "cvcuda_stream": cvcuda_stream,
-        "torch_stream": torch_stream,
-    }
-
-    # 创建线程锁
-    cuda_lock = threading.Lock()
-
-    # 分割URL
-    split_url_lists = split_urls(urls, args.workers)
+    url_queue = make_url_queue(urls, num_workers, use_threads=True)
+    stats_queue = queue.Queue()
 
     # 使用线程池
-    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
         futures = []
-        for i, worker_urls in enumerate(split_url_lists):
+        for i in range(num_workers):
             future = executor.submit(
                 process_worker_thread,
                 i,
-                worker_urls,
+                url_queue,
+                stats_queue,
                 args.input_clip_dir,
                 args.output_dir,
-                decoder,
-                encoder,
-                shared_cuda_resources,
-                cuda_lock,
+                session_pool,
+                cuda_ctx,
+                args.prefetch_depth,
+                None
+                if args.prefetch_max_gb is None
+                else int(args.prefetch_max_gb * 1024**3),
             )
             futures.append(future)
 
@@ -604,7 +1193,14 @@ def main_threaded():
         for future in futures:
             future.result()
 
+    report_utilization(list(stats_queue.queue), urls, num_workers)
+    if args.report_file:
+        write_report(list(stats_queue.queue), args.report_file)
+
+    logging.info(f"会话池: {session_pool.stats()}")
+
     # 清理CUDA资源
+    session_pool.close()
     cuda_ctx.pop()
 
 
@@ -10,11 +10,20 @@ import time
 import subprocess
 import multiprocessing
 import argparse
-import math
 import logging
 import shutil
 from pathlib import Path
 
+from work_queue import WorkerStats, collect_stats, make_url_queue, report_utilization, write_report
+
+sys.path.append("/workspace/sekai-codebase/clip_extracting")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "clip_extracting"))
+from utils.audio_utils import probe_audio
+from utils.ffmpeg_utils import FFmpegVideoBatchDecoder, FFmpegVideoEncoder
+from utils.manifest_utils import open_clip_index
+from utils.mux_utils import MOVFLAGS, mux_clip
+from utils.plan_utils import order_urls_by_cost
+
 # 尝试导入CUDA相关库
 try:
     import pycuda.driver as cuda
@@ -25,7 +34,6 @@ try:
 
     # 尝试导入nvvpf工具
     try:
-        sys.path.append("/workspace/sekai-codebase/clip_extracting")
         from utils.nvvpf_utils import VideoBatchDecoder, VideoMemoryEncoder
 
         NVVPF_AVAILABLE = True
@@ -39,43 +47,60 @@ except ImportError:
     print("警告: CUDA库不可用，将使用CPU处理")
 
 
-def process_with_ffmpeg(video_path, clips, output_dir, video_id):
+def process_with_ffmpeg(video_path, clips, output_dir, video_id, width=1280, height=720, fps=30, mp4_layout=None):
     """
     使用FFmpeg处理视频（备用方案）
+    源视频只解码一次，按与CUDA路径相同的EMDownSampler抽帧，再分别编码各个clip，
+    输出的片段与3_nvtranscoding.py逐帧对应
+    与原来一样输出带AAC音频的MP4片段：编码结果保存在内存中，与GPU路径经同一个mux_clip写成MP4，
+    音频从源视频中按clip的帧范围截取。mp4_layout 只决定MP4的布局，默认 faststart
     """
     processed_files = []
+    if len(clips) == 0:
+        return processed_files
 
-    for i, (start_frame, end_frame) in enumerate(clips):
-        # 假设30fps
-        start_time = start_frame / 30.0
-        duration = (end_frame - start_frame) / 30.0
+    decoder = FFmpegVideoBatchDecoder(width, height, fps, 1)
+    decoder.initialize(video_path, clips)
 
-        output_file = os.path.join(
-            output_dir, f"{video_id}_{start_frame:07d}_{end_frame:07d}.mp4"
-        )
+    layout = mp4_layout or "faststart"
+    has_audio = probe_audio(video_path) is not None
+    clip_format = os.path.join(output_dir, f"{video_id}_{{:07d}}_{{:07d}}.mp4")
 
-        cmd = [
-            "ffmpeg",
-            "-i",
-            video_path,
-            "-ss",
-            str(start_time),
-            "-t",
-            str(duration),
-            "-c:v",
-            "libx264",
-            "-c:a",
-            "aac",
-            "-y",
-            output_file,
-        ]
+    encoder = None
+    frame_idx, clip_idx, s, e = -1, 0, clips[0][0], clips[0][1]
+    try:
+        for frame_idx, frames in enumerate(decoder):
+            if frame_idx == s:
+                encoder = FFmpegVideoEncoder(None, width, height, fps)
+            if s <= frame_idx < e:
+                encoder(frames)
+            if frame_idx == e - 1:
+                bitstream = encoder.finish()
+                encoder = None
+                file = mux_clip(
+                    clip_format.format(s, e),
+                    bitstream,
+                    fps,
+                    video_path if has_audio else None,
+                    s,
+                    e,
+                    layout,
+                )
+                processed_files.append(file)
+                logging.info(f"使用FFmpeg处理完成: {file}")
 
-        try:
-            subprocess.run(cmd, check=True, capture_output=True)
-            processed_files.append(output_file)
-            logging.info(f"使用FFmpeg处理完成: {output_file}")
-        except subprocess.CalledProcessError as e:
-            logging.error(f"FFmpeg处理失败: {e}")
+                clip_idx += 1
+                if clip_idx == len(clips):
+                    break
+                s, e = clips[clip_idx]
+    finally:
+        if encoder is not None:
+            # 丢弃不完整的clip
+            encoder.finish()
+        decoder.finish()
+
+    if clip_idx < len(clips):
+        logging.error(f"FFmpeg处理失败: 视频只有 {frame_idx + 1} 帧, 剩余 {len(clips) - clip_idx} 个clip未完成")
 
     return processed_files
 
@@ -88,9 +113,11 @@ def process_one_video_cuda(
     encoder,
     cvcuda_stream,
     torch_stream,
+    mp4_layout=None,
 ):
     """
     使用CUDA处理视频的函数
+    指定 mp4_layout 时直接写出MP4片段，不再经过.hevc中间文件
     """
     import gc
 
@@ -98,7 +125,7 @@ def process_one_video_cuda(
     if len(clips) == 0:
         return files
 
-    decoder.initialize(video_filename)
+    decoder.initialize(video_filename, clips)
 
     clip_idx, s, e = 0, clips[0][0], clips[0][1]
     with cvcuda_stream, torch.cuda.stream(torch_stream):
@@ -112,10 +139,13 @@ def process_one_video_cuda(
                 encoder(frames)
                 file = encoder.finish()
 
-                with open(
-                    os.path.join(vstream_filename_format.format(s, e)), "wb"
-                ) as f:
-                    f.write(file)
+                if mp4_layout is None:
+                    with open(
+                        os.path.join(vstream_filename_format.format(s, e)), "wb"
+                    ) as f:
+                        f.write(file)
+                else:
+                    mux_clip(vstream_filename_format.format(s, e), file, decoder.fps, layout=mp4_layout)
                 del file
                 files.append(vstream_filename_format.format(s, e))
 
@@ -175,7 +205,8 @@ def download_single_video(url, temp_video_dir, max_retries=3):
 
 def process_worker(
     worker_id,
-    urls,
+    url_queue,
+    stats_queue,
     input_clip_dir,
     output_dir,
     start_delay,
@@ -184,20 +215,26 @@ def process_worker(
     fps=30,
     device_id=0,
     use_cuda=True,
+    mp4_layout=None,
 ):
     """
-    工作进程：下载并处理视频
+    工作进程：从共享队列逐个获取URL，下载并处理视频
     """
+    stats = WorkerStats(worker_id)
+
     if start_delay > 0:
         logging.info(f"进程 {worker_id}: 等待 {start_delay} 秒后开始...")
         time.sleep(start_delay)
 
-    logging.info(f"进程 {worker_id}: 开始处理 {len(urls)} 个视频...")
+    logging.info(f"进程 {worker_id}: 开始从共享队列获取视频...")
 
     # 创建临时目录
     temp_video_dir = f"/tmp/temp_videos_worker_{worker_id}"
     os.makedirs(temp_video_dir, exist_ok=True)
 
+    # 打开clip索引 (txt目录或clip manifest)
+    clip_index = open_clip_index(input_clip_dir)
+
     # 初始化处理器
     decoder = None
     encoder = None
@@ -231,9 +268,9 @@ def process_worker(
         processed_count = 0
         failed_count = 0
 
-        for i, url in enumerate(urls):
+        for i, url in enumerate(stats.iter_queue(url_queue)):
             try:
-                logging.info(f"进程 {worker_id}: 处理 {i+1}/{len(urls)} - {url}")
+                logging.info(f"进程 {worker_id}: 处理第 {i+1} 个视频 - {url}")
 
                 # 1. 下载视频
                 success, video_path, video_id = download_single_video(
@@ -247,20 +284,18 @@ def process_worker(
 
                 logging.info(f"进程 {worker_id}: 下载完成 - {video_id}")
 
-                # 2. 检查clip文件
-                clip_file = os.path.join(input_clip_dir, f"{video_id}.txt")
-                if not os.path.exists(clip_file):
-                    logging.warning(f"进程 {worker_id}: 找不到clip文件 - {clip_file}")
+                # 2. 检查是否有对应的clip
+                if video_id not in clip_index:
+                    logging.warning(f"进程 {worker_id}: 找不到clip - {video_id}")
                     os.remove(video_path)
                     failed_count += 1
                     continue
 
                 # 3. 读取clip信息
-                with open(clip_file, "r") as f:
-                    clips = [tuple(map(int, line.strip().split(" "))) for line in f]
+                clips = clip_index[video_id]
 
                 if len(clips) == 0:
-                    logging.warning(f"进程 {worker_id}: clip文件为空 - {video_id}")
+                    logging.warning(f"进程 {worker_id}: clip为空 - {video_id}")
                     os.remove(video_path)
                     continue
 
@@ -272,8 +307,9 @@ def process_worker(
                 logging.info(f"进程 {worker_id}: 开始处理视频 - {video_id}")
 
                 if use_cuda:
+                    ext = "hevc" if mp4_layout is None else "mp4"
                     vstream_format = os.path.join(
-                        video_output_dir, f"{video_id}_{{:07d}}_{{:07d}}.hevc"
+                        video_output_dir, f"{video_id}_{{:07d}}_{{:07d}}.{ext}"
                     )
                     processed_files = process_one_video_cuda(
                         video_path,
@@ -283,10 +319,11 @@ def process_worker(
                         encoder,
                         cvcuda_stream,
                         torch_stream,
+                        mp4_layout,
                     )
                 else:
                     processed_files = process_with_ffmpeg(
-                        video_path, clips, video_output_dir, video_id
+                        video_path, clips, video_output_dir, video_id, width, height, fps, mp4_layout
                     )
 
                 logging.info(
@@ -312,11 +349,14 @@ def process_worker(
         logging.info(
             f"进程 {worker_id}: 完成处理，成功: {processed_count}, 失败: {failed_count}"
         )
+        stats_queue.put(stats.to_dict())
 
     finally:
         # 清理CUDA环境
         if cuda_ctx:
             try:
+                if encoder is not None:
+                    encoder.close()
                 cuda_ctx.pop()
             except:
                 pass
@@ -328,28 +368,10 @@ def process_worker(
             pass
 
 
-def split_urls(urls, num_workers):
-    """分割URL列表"""
-    urls_per_worker = math.ceil(len(urls) / num_workers)
-    split_urls = []
-
-    for i in range(num_workers):
-        start_idx = i * urls_per_worker
-        end_idx = min((i + 1) * urls_per_worker, len(urls))
-
-        if start_idx >= len(urls):
-            break
-
-        worker_urls = urls[start_idx:end_idx]
-        split_urls.append(worker_urls)
-
-    return split_urls
-
-
 def main():
     parser = argparse.ArgumentParser(description="下载-处理脚本 (兼容版)")
     parser.add_argument("--urls-file", "-u", required=True, help="URL列表文件")
-    parser.add_argument("--input-clip-dir", "-c", required=True, help="输入clip目录")
+    parser.add_argument("--input-clip-dir", "-c", required=True, help="输入clip目录或clip manifest文件")
     parser.add_argument("--output-dir", "-o", required=True, help="输出目录")
     parser.add_argument("--workers", "-w", type=int, default=2, help="工作进程数量")
     parser.add_argument(
@@ -362,6 +384,24 @@ def main():
     parser.add_argument(
         "--no-cuda", action="store_true", help="强制使用FFmpeg而不是CUDA"
     )
+    parser.add_argument(
+        "--mp4-layout",
+        default=None,
+        choices=list(MOVFLAGS),
+        help="CUDA路径直接输出无声MP4片段而不是.hevc，省去4_remix_to_files.py (faststart 或 fragmented)；"
+        "FFmpeg路径始终输出带音频的MP4，该选项只决定其布局",
+    )
+    parser.add_argument(
+        "--order-by-cost",
+        action="store_true",
+        help="按clip估计的处理时间从长到短排列URL (最长优先)",
+    )
+    parser.add_argument(
+        "--prior-report", default=None, help="上次运行的报告文件，用于修正成本模型"
+    )
+    parser.add_argument(
+        "--report-file", default=None, help="将每个URL的处理耗时追加写入该报告文件"
+    )
     parser.add_argument(
         "--log-level",
         default="INFO",
@@ -404,24 +444,33 @@ def main():
     with open(args.urls_file, "r", encoding="utf-8") as f:
         urls = [line.strip() for line in f if line.strip()]
 
+    # 按估计处理时间从长到短排序
+    if args.order_by_cost:
+        urls = order_urls_by_cost(
+            urls, open_clip_index(args.input_clip_dir), args.prior_report
+        )
+
     logging.info(f"总共 {len(urls)} 个URL需要处理")
     logging.info(f"使用 {args.workers} 个工作进程")
 
-    # 分割URL
-    split_url_lists = split_urls(urls, args.workers)
+    # 创建共享URL队列
+    num_workers = min(args.workers, len(urls))
+    url_queue = make_url_queue(urls, num_workers)
+    stats_queue = multiprocessing.Queue()
 
     # 启动进程
     processes = []
 
     try:
-        for i, worker_urls in enumerate(split_url_lists):
+        for i in range(num_workers):
             delay = i * args.start_delay
 
             process = multiprocessing.Process(
                 target=process_worker,
                 args=(
                     i,
-                    worker_urls,
+                    url_queue,
+                    stats_queue,
                     args.input_clip_dir,
                     args.output_dir,
                     delay,
@@ -430,21 +479,24 @@ def main():
                     args.fps,
                     args.device_id,
                     use_cuda,
+                    args.mp4_layout,
                 ),
             )
             process.start()
             processes.append(process)
-            logging.info(
-                f"启动进程 {i} (PID: {process.pid}), 处理 {len(worker_urls)} 个URL"
-            )
+            logging.info(f"启动进程 {i} (PID: {process.pid})")
 
         logging.info("等待所有进程完成...")
 
+        stats = collect_stats(processes, stats_queue)
         for i, process in enumerate(processes):
             process.join()
             logging.info(f"进程 {i} 已完成")
 
         logging.info("所有处理进程已完成！")
+        report_utilization(stats, urls, num_workers)
+        if args.report_file:
+            write_report(stats, args.report_file)
 
     except KeyboardInterrupt:
         logging.info("收到中断信号，正在终止进程...")
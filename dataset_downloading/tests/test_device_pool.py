@@ -0,0 +1,127 @@
+import threading
+import time
+import unittest
+
+from device_pool import DevicePool, SessionPool
+
+
+class DevicePoolTest(unittest.TestCase):
+    """调度逻辑使用假的设备枚举函数，无需GPU"""
+
+    def test_least_loaded_placement(self):
+        pool = DevicePool(2, lambda: [0, 1, 2])
+        self.assertEqual([pool.acquire() for _ in range(3)], [0, 1, 2])
+        pool.release(1)
+        self.assertEqual(pool.acquire(), 1)
+        self.assertEqual(pool.acquire(), 0)
+        pool.release(2)
+        pool.release(2)
+        self.assertEqual(pool.acquire(), 2)
+
+    def test_session_cap(self):
+        pool = DevicePool(2, lambda: [0, 1])
+        self.assertEqual(pool.capacity(), 4)
+        self.assertEqual(sorted(pool.acquire() for _ in range(4)), [0, 0, 1, 1])
+        self.assertIsNone(pool.acquire())
+        pool.release(0)
+        self.assertEqual(pool.acquire(), 0)
+        self.assertEqual(pool.stats()["active"], {0: 2, 1: 2})
+
+    def test_fail(self):
+        pool = DevicePool(1, lambda: ["GPU-a", "GPU-b"])
+        self.assertEqual(pool.acquire(), "GPU-a")
+        with self.assertLogs(level="ERROR"):
+            pool.fail("GPU-a")
+        self.assertEqual(pool.healthy(), ["GPU-b"])
+        self.assertEqual(pool.capacity(), 1)
+        self.assertEqual(pool.acquire(), "GPU-b")
+        self.assertIsNone(pool.acquire())
+        self.assertEqual(pool.stats(), {"active": {"GPU-a": 0, "GPU-b": 1}, "failed": ["GPU-a"]})
+
+    def test_no_devices(self):
+        pool = DevicePool(1, lambda: [])
+        self.assertEqual(pool.capacity(), 0)
+        self.assertIsNone(pool.acquire())
+
+    def test_record_error(self):
+        pool = DevicePool(1, lambda: [0, 1])
+        self.assertEqual(pool.record_error(0, "a"), 1)
+        # 同一个URL重复出错只计一次
+        self.assertEqual(pool.record_error(0, "a"), 1)
+        self.assertEqual(pool.record_error(0, "b"), 2)
+        # 没有URL的错误 (初始化失败、进程异常退出) 每次单独计数
+        self.assertEqual(pool.record_error(0, None), 3)
+        self.assertEqual(pool.record_error(0, None), 4)
+        self.assertEqual(pool.record_error(1, "a"), 1)
+
+
+class FakeSession:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class SessionPoolTest(unittest.TestCase):
+    def test_bounded_sessions(self):
+        pool = SessionPool(FakeSession, 2)
+        lock = threading.Lock()
+        active, peak = 0, 0
+
+        def work():
+            nonlocal active, peak
+            with pool.session():
+                with lock:
+                    active += 1
+                    peak = max(peak, active)
+                time.sleep(0.02)
+                with lock:
+                    active -= 1
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(peak, 2)
+        stats = pool.stats()
+        self.assertEqual(stats["sessions"], 2)
+        self.assertEqual(stats["checkouts"], 8)
+        # 8个视频共用2个会话，后面的视频必须等待
+        self.assertGreater(stats["max_wait"], 0.01)
+        self.assertAlmostEqual(stats["total_wait"], stats["mean_wait"] * 8)
+
+        sessions = list(pool.sessions)
+        pool.close()
+        self.assertTrue(all(session.closed for session in sessions))
+
+    def test_reuse(self):
+        pool = SessionPool(FakeSession, 2)
+        with pool.session() as first:
+            pass
+        with pool.session() as second:
+            self.assertIs(second, first)
+        self.assertEqual(pool.stats()["sessions"], 1)
+
+    def test_failed_create_frees_slot(self):
+        calls = []
+
+        def create():
+            calls.append(None)
+            if len(calls) == 1:
+                raise RuntimeError("CUDA error")
+            return FakeSession()
+
+        pool = SessionPool(create, 1)
+        with self.assertRaises(RuntimeError):
+            with pool.session():
+                pass
+        with pool.session() as session:
+            self.assertIsInstance(session, FakeSession)
+        self.assertEqual(pool.stats()["sessions"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
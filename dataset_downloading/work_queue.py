@@ -0,0 +1,265 @@
+"""
+共享任务队列
+各工作进程/线程每次从队列中取一个URL，避免静态分割导致个别进程拖尾
+"""
+
+import json
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+
+def make_url_queue(urls, num_workers, use_threads=False):
+    """
+    创建共享URL队列，末尾为每个工作者放入一个结束标记 (None)
+
+    Args:
+        urls: URL列表 (按处理优先级排序)
+        num_workers: 工作者数量
+        use_threads: 为线程创建queue.Queue，否则创建multiprocessing.Queue
+    """
+    url_queue = queue.Queue() if use_threads else multiprocessing.Queue()
+    for url in urls:
+        url_queue.put(url)
+    for _ in range(num_workers):
+        url_queue.put(None)
+    return url_queue
+
+
+def iter_urls(url_queue):
+    """逐个从队列中取URL，直到遇到结束标记"""
+    while True:
+        url = url_queue.get()
+        if url is None:
+            return
+        yield url
+
+
+class WorkerStats:
+    """记录单个工作者的忙碌时间，用于统计利用率"""
+
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.start = time.time()
+        self.busy = 0.0
+        self.tasks = []
+        self.stage_idle = {}
+        # 出现CUDA错误时记录设备ID和出错的URL，以及已取出但未处理完、需要转移给其他工作者的URL
+        self.device_error = None
+        self.error_url = None
+        self.handoff = []
+
+    def iter_queue(self, url_queue):
+        """逐个从队列中取URL，并记录每个URL的处理耗时"""
+        return self.track(iter_urls(url_queue))
+
+    def track(self, items, key=lambda item: item):
+        """
+        记录每个元素从开始获取到处理完成的耗时，key(item) 为报告中的URL
+        计时包含 items 产生该元素的时间：顺序下载时即为下载耗时，预取时为未被上一个视频的处理掩盖的等待下载时间
+        """
+        items = iter(items)
+        while True:
+            task_start = time.time()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            yield item
+            elapsed = time.time() - task_start
+            self.busy += elapsed
+            self.tasks.append((key(item), elapsed))
+
+    def to_dict(self):
+        return {
+            "worker_id": self.worker_id,
+            "wall": time.time() - self.start,
+            "busy": self.busy,
+            "tasks": self.tasks,
+            "stage_idle": self.stage_idle,
+            "device_error": self.device_error,
+            "error_url": self.error_url,
+            "handoff": self.handoff,
+        }
+
+
+class Prefetcher:
+    """
+    后台预取：在处理当前视频的同时，由后台线程提前下载后续最多 depth 个视频
+
+    fetch(url) 返回 (success, path, video_id)。已下载但未处理完的文件总大小超过
+    max_bytes 时暂停新的下载 (在每次开始下载前检查，因此最多超出一个视频的大小)。
+    depth 为 0 时不启动后台线程，按原来的 下载 -> 处理 顺序执行，便于对比空闲时间。
+    close() 提前停止预取，并返回已取出但尚未处理的URL。
+    """
+
+    def __init__(self, urls, fetch, depth=0, max_bytes=None):
+        self.urls = urls
+        self.fetch = fetch
+        self.depth = depth
+        self.max_bytes = max_bytes
+
+        # 下载阶段等待空位/磁盘预算的时间，处理阶段等待下载完成的时间
+        self.fetch_idle = 0.0
+        self.process_idle = 0.0
+
+        self.ready = queue.Queue()
+        self.cond = threading.Condition()
+        self.pending = 0
+        self.pending_bytes = 0
+        self.closed = False
+        self.unfetched = []
+
+        self.thread = None
+        if depth > 0:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def _fetch(self, url):
+        try:
+            result = self.fetch(url)
+        except Exception as e:
+            logging.error(f"预取失败: {url}, 错误: {e}")
+            result = (False, None, None)
+        size = os.path.getsize(result[1]) if result[0] else 0
+        return url, result, size
+
+    def _run(self):
+        for url in self.urls:
+            wait_start = time.time()
+            with self.cond:
+                while not self.closed and (
+                    self.pending >= self.depth
+                    or (self.max_bytes is not None and self.pending_bytes >= self.max_bytes)
+                ):
+                    self.cond.wait()
+                if self.closed:
+                    self.unfetched.append(url)
+                    break
+                self.pending += 1
+            self.fetch_idle += time.time() - wait_start
+
+            url, result, size = self._fetch(url)
+            with self.cond:
+                self.pending_bytes += size
+            self.ready.put((url, result, size))
+        self.ready.put(None)
+
+    def _release(self, size):
+        with self.cond:
+            self.pending_bytes -= size
+            self.cond.notify_all()
+
+    def __iter__(self):
+        """按下载完成的顺序返回 (url, (success, path, video_id))，调用方处理完后才释放磁盘预算"""
+        if self.thread is None:
+            for url in self.urls:
+                fetch_start = time.time()
+                url, result, _ = self._fetch(url)
+                self.process_idle += time.time() - fetch_start
+
+                process_start = time.time()
+                yield url, result
+                self.fetch_idle += time.time() - process_start
+            return
+
+        while True:
+            wait_start = time.time()
+            item = self.ready.get()
+            self.process_idle += time.time() - wait_start
+            if item is None:
+                return
+
+            url, result, size = item
+            with self.cond:
+                self.pending -= 1
+                self.cond.notify_all()
+            yield url, result
+            self._release(size)
+
+    def close(self):
+        """
+        停止预取并等待后台线程结束，返回已从队列取出但还没有交给调用方的URL
+        已下载的文件留在原处，由调用方随临时目录一起清理
+        """
+        if self.thread is None:
+            return []
+
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join()
+
+        urls = []
+        while True:
+            try:
+                item = self.ready.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                break
+            urls.append(item[0])
+        return urls + self.unfetched
+
+    def idle(self):
+        return {"download": self.fetch_idle, "process": self.process_idle}
+
+
+def collect_stats(processes, stats_queue):
+    """在等待进程结束的同时读取统计结果，避免子进程阻塞在队列写入上"""
+    stats = []
+    while any(p.is_alive() for p in processes) or not stats_queue.empty():
+        try:
+            stats.append(stats_queue.get(timeout=1))
+        except queue.Empty:
+            pass
+    return stats
+
+
+def report_utilization(stats, urls, num_workers):
+    """
+    输出每个工作者的利用率，并用实测的单URL耗时估算静态分割下的完成时间
+    """
+    if not stats:
+        return
+
+    makespan = max(s["wall"] for s in stats)
+    for s in sorted(stats, key=lambda s: s["worker_id"]):
+        utilization = s["busy"] / makespan if makespan > 0 else 0.0
+        logging.info(
+            f"工作者 {s['worker_id']}: 处理 {len(s['tasks'])} 个URL, 忙碌 {s['busy']:.1f}s / {makespan:.1f}s, "
+            f"利用率 {utilization:.1%}"
+        )
+
+    elapsed = {url: t for s in stats for url, t in s["tasks"]}
+    urls_per_worker = math.ceil(len(urls) / num_workers)
+    static_makespan = max(
+        sum(elapsed.get(url, 0.0) for url in urls[i : i + urls_per_worker])
+        for i in range(0, len(urls), urls_per_worker)
+    )
+    total_busy = sum(s["busy"] for s in stats)
+    logging.info(
+        f"总完成时间 {makespan:.1f}s, 平均利用率 {total_busy / (makespan * len(stats)):.1%}; "
+        f"静态分割估计完成时间 {static_makespan:.1f}s"
+    )
+
+    stage_idle = [s["stage_idle"] for s in stats if s.get("stage_idle")]
+    if stage_idle:
+        logging.info(
+            f"阶段空闲: 下载 {sum(idle['download'] for idle in stage_idle):.1f}s, "
+            f"处理(等待下载) {sum(idle['process'] for idle in stage_idle):.1f}s"
+        )
+
+
+def write_report(stats, report_file):
+    """
+    将每个URL的实测处理耗时写入JSON lines报告，供下次运行时修正成本模型
+    """
+    with open(report_file, "a", encoding="utf-8") as f:
+        for s in stats:
+            for url, elapsed in s["tasks"]:
+                f.write(json.dumps({"url": url, "seconds": elapsed}) + "\n")